@@ -0,0 +1,73 @@
+"""
+Benchmark: memory of annotations held as dicts versus the AnnotationStore.
+
+Loads the annotations of a synthetic project (the one of
+bench_project_format.py, about 1.8M vertices) once as the nested dicts the
+annotator used to keep and once packed into an AnnotationStore, and
+compares the memory each retains, as measured by tracemalloc. Also times
+unpacking one image, which happens on every image switch. Run from the
+repository root:
+
+    python benchmarks/bench_annotation_memory.py
+"""
+
+import gc
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_project_format import synthetic_project
+from src.annotation_store import AnnotationStore
+
+
+def image_annotations(project):
+    """(name, annotations) with every image parsed from JSON, as a project file load produces them."""
+    for image in project['images']:
+        yield image['file_name'], json.loads(json.dumps(image['annotations']))
+
+
+def retained(build):
+    gc.collect()
+    tracemalloc.start()
+    result = build()
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, size
+
+
+def main():
+    project = synthetic_project()
+    vertices = sum(len(a['segmentation']) // 2 for image in project['images']
+                   for items in image['annotations'].values() for a in items)
+
+    def as_dicts():
+        return dict(image_annotations(project))
+
+    def as_store():
+        store = AnnotationStore()
+        for name, annotations in image_annotations(project):
+            store.load(name, annotations)
+        return store
+
+    dicts, dict_bytes = retained(as_dicts)
+    del dicts
+    store, store_bytes = retained(as_store)
+
+    start = time.perf_counter()
+    store.copy_of("image_0100.png")
+    unpack_ms = (time.perf_counter() - start) * 1000
+
+    print(f"{len(project['images'])} images, {store.annotation_count()} annotations, {vertices} vertices")
+    print(f"{'dicts (MB)':>24} {dict_bytes / 2**20:10.1f}")
+    print(f"{'AnnotationStore (MB)':>24} {store_bytes / 2**20:10.1f}")
+    print(f"{'  of which vertices (MB)':>24} {store.nbytes() / 2**20:10.1f}")
+    print(f"{'unpack one image (ms)':>24} {unpack_ms:10.1f}")
+
+
+if __name__ == "__main__":
+    main()
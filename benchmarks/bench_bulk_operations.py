@@ -0,0 +1,60 @@
+"""
+Benchmark: project-wide annotation changes in one AnnotationStore batch.
+
+Loads a synthetic project of about 100k annotations (700 images of the
+project of bench_project_format.py) into an AnnotationStore, then times
+renaming a class, renumbering every image and deleting a class (keeping its
+annotations for undo) inside a batch, and checks that each batch reported
+its changes to the listeners once. Run from the
+repository root:
+
+    python benchmarks/bench_bulk_operations.py
+"""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_project_format import synthetic_project
+from src.annotation_store import AnnotationStore
+
+
+def main():
+    project = synthetic_project(images=700, vertices=20)
+    store = AnnotationStore()
+    for image in project['images']:
+        store.load(image['file_name'], image['annotations'])
+
+    commits = []
+    store.commit_listeners.append(lambda changed: commits.append(len(changed)))
+
+    start = time.perf_counter()
+    with store.batch():
+        store.rename_class("cell", "cell body")
+    rename_ms = (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    with store.batch():
+        for name in list(store):
+            store.renumber(name)
+    renumber_ms = (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    with store.batch():
+        removed = store.extract_class("nucleus")
+        store.remove_classes(lambda name: name == "nucleus")
+    delete_ms = (time.perf_counter() - start) * 1000
+    undo_bytes = sum(packed.nbytes() for packed in removed.values())
+
+    print(f"{len(store)} images, {store.annotation_count()} annotations")
+    print(f"{'rename class (ms)':>24} {rename_ms:10.1f}")
+    print(f"{'renumber all (ms)':>24} {renumber_ms:10.1f}")
+    print(f"{'delete class (ms)':>24} {delete_ms:10.1f}")
+    print(f"{'  kept for undo (MB)':>24} {undo_bytes / 2**20:10.1f}")
+    print(f"{'commits (images each)':>24} {commits}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""
+Benchmark: slice normalization before and after src/normalization.py.
+
+The "legacy" functions reproduce the previous ImageAnnotator.normalize_array /
+convert_to_8bit_rgb / array_to_qimage path. Run from the repository root:
+
+    python benchmarks/bench_normalization.py
+"""
+
+import os
+import sys
+import time
+
+import numpy as np
+from PyQt5.QtGui import QImage
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.normalization import SliceNormalizer, normalize_to_qimage, CONTRAST_PER_STACK
+from src.slice_stack import SliceStack
+
+
+def legacy_normalize_array(array):
+    array_float = array.astype(np.float32)
+    if array.dtype == np.uint8:
+        p_low, p_high = np.percentile(array_float, (0, 100))
+        array_normalized = np.clip(array_float, p_low, p_high)
+        array_normalized = (array_normalized - p_low) / (p_high - p_low)
+    else:
+        array_normalized = (array_float - array.min()) / (array.max() - array.min())
+    array_normalized = np.power(array_normalized, 1.0)
+    return (array_normalized * 255).astype(np.uint8)
+
+
+def legacy_to_qimage(array):
+    image_8bit = legacy_normalize_array(array)
+    rgb = np.stack((image_8bit,) * 3, axis=-1)
+    height, width, _ = rgb.shape
+    return QImage(rgb.data, width, height, 3 * width, QImage.Format_RGB888).copy()
+
+
+def timeit(func, slices, repeat=3):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for array in slices:
+            func(array)
+        best = min(best, time.perf_counter() - start)
+    return best / len(slices) * 1000
+
+
+def main():
+    rng = np.random.default_rng(0)
+    for dtype, high in ((np.uint8, 255), (np.uint16, 4095), (np.float32, 1.0)):
+        stack = (rng.random((16, 2048, 2048)) * high).astype(dtype)
+        slices = list(stack)
+        normalizer = SliceNormalizer(CONTRAST_PER_STACK)
+        normalizer.bind(SliceStack("bench", stack, ['Z', 'H', 'W'], normalizer))
+
+        legacy_ms = timeit(legacy_to_qimage, slices)
+        slice_ms = timeit(normalize_to_qimage, slices)
+        stack_ms = timeit(normalizer, slices)
+        print(f"{np.dtype(dtype).name:>8} 2048x2048: legacy {legacy_ms:7.1f} ms/slice | "
+              f"per-slice LUT {slice_ms:6.1f} ms ({legacy_ms / slice_ms:4.1f}x) | "
+              f"stack-wide LUT {stack_ms:6.1f} ms ({legacy_ms / stack_ms:4.1f}x)")
+
+        legacy_bytes = legacy_to_qimage(slices[0]).sizeInBytes()
+        new_bytes = normalizer(slices[0]).sizeInBytes()
+        print(f"{'':>8} QImage size: legacy {legacy_bytes / 2**20:.1f} MB, new {new_bytes / 2**20:.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
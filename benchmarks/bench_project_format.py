@@ -0,0 +1,101 @@
+"""
+Benchmark: JSON (.iap) versus binary (.iapdb) project files.
+
+Builds a synthetic project, writes it in both formats and compares file
+size, full load time, metadata-only load time and the time to read the
+annotations of a single image. Run from the repository root:
+
+    python benchmarks/bench_project_format.py
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.project_store import BinaryProject, read_project_file, write_project_file
+
+
+def synthetic_project(images=200, annotations_per_image=150, vertices=60, seed=0):
+    rng = np.random.default_rng(seed)
+    classes = ["cell", "nucleus", "debris"]
+    project = {
+        'classes': [{'name': name, 'color': color} for name, color in zip(classes, ("#ff0000", "#00ff00", "#0000ff"))],
+        'images': [],
+        'image_paths': {},
+        'notes': "benchmark project",
+        'creation_date': "2024-01-01T00:00:00",
+        'last_modified': "2024-01-01T00:00:00",
+    }
+    for i in range(images):
+        file_name = f"image_{i:04d}.png"
+        annotations = {name: [] for name in classes}
+        for number in range(annotations_per_image):
+            class_name = classes[number % len(classes)]
+            centre = rng.random(2) * 2000
+            angles = np.linspace(0, 2 * np.pi, vertices, endpoint=False)
+            radius = 10 + rng.random(vertices) * 20
+            points = np.stack([centre[0] + radius * np.cos(angles), centre[1] + radius * np.sin(angles)], axis=1)
+            # Half the polygons come from contours (integer vertices), half from editing (floats)
+            if number % 2:
+                segmentation = np.round(points).astype(int).ravel().tolist()
+            else:
+                segmentation = np.round(points, 2).ravel().tolist()
+            annotations[class_name].append({
+                'segmentation': segmentation,
+                'category_id': classes.index(class_name) + 1,
+                'category_name': class_name,
+                'number': number + 1,
+            })
+        project['images'].append({'file_name': file_name, 'width': 2048, 'height': 2048,
+                                  'is_multi_slice': False, 'annotations': annotations})
+        project['image_paths'][file_name] = f"/data/images/{file_name}"
+    return project
+
+
+def best_of(func, repeat=3):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+def main():
+    project = synthetic_project()
+    with tempfile.TemporaryDirectory() as directory:
+        json_path = os.path.join(directory, "bench.iap")
+        binary_path = os.path.join(directory, "bench.iapdb")
+
+        json_write = best_of(lambda: write_project_file(json_path, project), repeat=1)
+        binary_write = best_of(lambda: write_project_file(binary_path, project), repeat=1)
+
+        def read_one_image():
+            with BinaryProject(binary_path) as stored:
+                stored.annotations("image_0100.png")
+
+        rows = [
+            ("file size (MB)", os.path.getsize(json_path) / 2**20, os.path.getsize(binary_path) / 2**20),
+            ("write (ms)", json_write, binary_write),
+            ("full load (ms)", best_of(lambda: read_project_file(json_path)),
+             best_of(lambda: read_project_file(binary_path))),
+            ("metadata only (ms)", best_of(lambda: read_project_file(json_path, include_annotations=False)),
+             best_of(lambda: read_project_file(binary_path, include_annotations=False))),
+            ("one image (ms)", float('nan'), best_of(read_one_image)),
+        ]
+        print(f"{'':>20} {'.iap':>10} {'.iapdb':>10}")
+        for label, json_value, binary_value in rows:
+            print(f"{label:>20} {json_value:10.1f} {binary_value:10.1f}")
+
+        restored = read_project_file(binary_path)
+        same = restored['images'][0]['annotations'] == project['images'][0]['annotations']
+        print(f"round trip identical: {same}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,229 @@
+"""
+Undo/redo of annotation changes.
+
+An undo step is a list of changes. The usual one is an ImageChange: the
+annotations of one image or slice that were added, removed or modified,
+each stored before and after the change in a PackedImage (vertices in one
+float64 buffer per side, see annotation_store) together with its position
+in its class list. Annotations the change did not touch are not stored.
+Class renames and class deletions span every image and are recorded as
+ClassRename and ClassDelete; a deletion keeps the removed annotations
+packed the same way.
+
+ImageChanges are found by diffing, not by instrumenting each tool:
+AnnotationHistory keeps a baseline of the image being edited (a shallow
+copy of each annotation dict, so unchanged vertices are shared rather than
+copied) and checkpoint() compares the annotations with it by ID. The
+annotator checkpoints whenever it saves the current image's annotations
+and when an AnnotationStore batch ends, so each tool's commit, merge or
+class operation becomes one step.
+
+The steps are kept within a byte budget (set in Settings); the oldest are
+dropped first.
+"""
+
+from collections import deque
+
+from src.annotation_store import PackedImage
+
+
+DEFAULT_UNDO_BUDGET_MB = 64
+# Rough size of one packed annotation besides its vertices (record, tuples, position)
+RECORD_OVERHEAD = 200
+
+_MISSING = object()
+
+
+def annotation_changed(annotation, baseline):
+    """Whether an annotation differs from its baseline copy (vertex lists are compared by identity first)."""
+    if len(annotation) != len(baseline):
+        return True
+    for key, value in baseline.items():
+        current = annotation.get(key, _MISSING)
+        if current is not value and current != value:
+            return True
+    return False
+
+
+def is_temporary(class_name):
+    # Unaccepted predictions are not part of the history
+    return class_name.startswith("Temp-")
+
+
+class ImageChange:
+    """The annotations of one image that a step added, removed or modified."""
+
+    def __init__(self, name, before, after, before_positions, after_positions):
+        self.name = name
+        self.before = before
+        self.after = after
+        self.before_positions = before_positions
+        self.after_positions = after_positions
+
+    def apply(self, annotations, undo):
+        """Change {class: [annotation dict]} from the state after the change to before it (or back)."""
+        remove, add = (self.after, self.before) if undo else (self.before, self.after)
+        positions = self.before_positions if undo else self.after_positions
+        for class_name, records in remove.classes.items():
+            ids = {record.id for record in records}
+            class_annotations = annotations.get(class_name)
+            if class_annotations is None:
+                continue
+            class_annotations[:] = [a for a in class_annotations if a.get('id') not in ids]
+            if not class_annotations:
+                del annotations[class_name]
+        for class_name, records in add.classes.items():
+            class_annotations = annotations.setdefault(class_name, [])
+            for record in sorted(records, key=lambda r: positions[r.id]):
+                class_annotations.insert(positions[record.id], record.to_dict(add.coords))
+
+    def nbytes(self):
+        count = sum(1 for _ in self.before.records()) + sum(1 for _ in self.after.records())
+        return self.before.nbytes() + self.after.nbytes() + count * RECORD_OVERHEAD
+
+
+class ClassRename:
+    def __init__(self, old_name, new_name):
+        self.old_name = old_name
+        self.new_name = new_name
+
+    def nbytes(self):
+        return RECORD_OVERHEAD
+
+
+class ClassDelete:
+    """A deleted class: its colour and ID, and its annotations as {image name: PackedImage}."""
+
+    def __init__(self, class_name, color, class_id, removed):
+        self.class_name = class_name
+        self.color = color
+        self.class_id = class_id
+        self.removed = removed
+
+    def nbytes(self):
+        return RECORD_OVERHEAD + sum(packed.nbytes() + RECORD_OVERHEAD * sum(1 for _ in packed.records())
+                                     for packed in self.removed.values())
+
+
+class AnnotationHistory:
+    def __init__(self, budget_bytes=DEFAULT_UNDO_BUDGET_MB * 1024 * 1024):
+        self.budget_bytes = budget_bytes
+        self.used_bytes = 0
+        # (changes, bytes) per step, oldest first
+        self.undo_steps = deque()
+        self.redo_steps = []
+        # Baseline of the image being edited: {id: (class name, position, shallow copy)}
+        self.baseline_name = None
+        self.baseline = {}
+        # Changes recorded for the step the next checkpoint closes
+        self.pending = []
+        self.skip_diff = False
+
+    def clear(self):
+        self.undo_steps.clear()
+        self.redo_steps.clear()
+        self.used_bytes = 0
+        self.pending = []
+        self.skip_diff = False
+        self.baseline_name = None
+        self.baseline = {}
+
+    def can_undo(self):
+        return bool(self.undo_steps)
+
+    def can_redo(self):
+        return bool(self.redo_steps)
+
+    def set_baseline(self, name, annotations):
+        self.baseline_name = name
+        self.baseline = {}
+        for class_name, class_annotations in annotations.items():
+            if is_temporary(class_name):
+                continue
+            for position, annotation in enumerate(class_annotations):
+                if 'id' in annotation:
+                    self.baseline[annotation['id']] = (class_name, position, dict(annotation))
+
+    def record(self, change):
+        """Add a change that covers the image being edited too (class operations) to the next step."""
+        self.pending.append(change)
+        self.skip_diff = True
+
+    def ignore_changes(self):
+        """Take the current state as the baseline at the next checkpoint (after an undo or redo)."""
+        self.skip_diff = True
+
+    def needs_checkpoint(self):
+        return bool(self.pending) or self.skip_diff
+
+    def checkpoint(self, name, annotations):
+        """Close a step: diff the image against its baseline, push what changed, take a new baseline."""
+        changes, self.pending = self.pending, []
+        if not self.skip_diff and name == self.baseline_name:
+            change = self.diff(name, annotations)
+            if change is not None:
+                changes.append(change)
+        self.skip_diff = False
+        self.set_baseline(name, annotations)
+        if changes:
+            self.push(changes)
+
+    def diff(self, name, annotations):
+        before, after = {}, {}
+        before_positions, after_positions = {}, {}
+        seen = set()
+        for class_name, class_annotations in annotations.items():
+            if is_temporary(class_name):
+                continue
+            for position, annotation in enumerate(class_annotations):
+                annotation_id = annotation.get('id')
+                seen.add(annotation_id)
+                baseline = self.baseline.get(annotation_id)
+                if baseline is not None:
+                    old_class, old_position, old_annotation = baseline
+                    if old_class == class_name and not annotation_changed(annotation, old_annotation):
+                        continue
+                    before.setdefault(old_class, []).append(old_annotation)
+                    before_positions[annotation_id] = old_position
+                after.setdefault(class_name, []).append(annotation)
+                after_positions[annotation_id] = position
+        for annotation_id, (old_class, old_position, old_annotation) in self.baseline.items():
+            if annotation_id not in seen:
+                before.setdefault(old_class, []).append(old_annotation)
+                before_positions[annotation_id] = old_position
+        if not before and not after:
+            return None
+        return ImageChange(name, PackedImage.pack(before), PackedImage.pack(after),
+                           before_positions, after_positions)
+
+    def push(self, changes):
+        for _, size in self.redo_steps:
+            self.used_bytes -= size
+        self.redo_steps.clear()
+        size = sum(change.nbytes() for change in changes)
+        self.undo_steps.append((changes, size))
+        self.used_bytes += size
+        self.trim()
+
+    def trim(self):
+        while self.undo_steps and self.used_bytes > self.budget_bytes:
+            self.used_bytes -= self.undo_steps.popleft()[1]
+
+    def set_budget(self, budget_bytes):
+        self.budget_bytes = budget_bytes
+        self.trim()
+
+    def undo_step(self):
+        """The changes of the step to undo (it moves to the redo stack), or None."""
+        if not self.undo_steps:
+            return None
+        step = self.undo_steps.pop()
+        self.redo_steps.append(step)
+        return step[0]
+
+    def redo_step(self):
+        if not self.redo_steps:
+            return None
+        step = self.redo_steps.pop()
+        self.undo_steps.append(step)
+        return step[0]
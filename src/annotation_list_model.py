@@ -0,0 +1,150 @@
+"""
+Model/view annotation list.
+
+The annotation list used to be a QListWidget that was cleared and refilled
+with one QListWidgetItem per annotation after every edit. AnnotationListModel
+instead exposes the annotations of the current image (the dicts the
+AnnotationStore holds for it) as rows: adding or removing annotations
+inserts or removes just those rows, and the row text with its polygon area
+is only computed when a row is painted, then cached. Rows are found by
+annotation ID through a {id: row} map, so looking up k annotations does not
+scan the list.
+"""
+
+from PyQt5.QtCore import Qt, QAbstractListModel, QModelIndex, QItemSelectionModel, pyqtSignal
+from PyQt5.QtGui import QColor
+from PyQt5.QtWidgets import QListView, QAbstractItemView
+
+from src.utils import calculate_area
+
+
+class AnnotationListModel(QAbstractListModel):
+    def __init__(self, class_colors, parent=None):
+        """`class_colors` is the live {class name: QColor} dict of the image label."""
+        super().__init__(parent)
+        self.class_colors = class_colors
+        self.rows = []
+        # Annotation ID -> row, kept up to date as rows are inserted and removed
+        self.row_ids = {}
+        # id(annotation) -> (annotation, area); the annotation is kept so its id is not reused
+        self.area_cache = {}
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.rows)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or index.row() >= len(self.rows):
+            return None
+        annotation = self.rows[index.row()]
+        if role == Qt.DisplayRole:
+            number = annotation.get('number', 0)
+            return f"{annotation['category_name']} - {number:<3} Area: {self.area(annotation):.2f}"
+        if role == Qt.ForegroundRole:
+            return self.class_colors.get(annotation['category_name'], QColor(Qt.white))
+        if role == Qt.UserRole:
+            return annotation
+        return None
+
+    def area(self, annotation):
+        cached = self.area_cache.get(id(annotation))
+        if cached is None or cached[0] is not annotation:
+            cached = (annotation, calculate_area(annotation))
+            self.area_cache[id(annotation)] = cached
+        return cached[1]
+
+    def set_annotations(self, annotations):
+        """Show these annotations, in this order (temporary classes are left out)."""
+        self.beginResetModel()
+        self.rows = [a for a in annotations if not a['category_name'].startswith("Temp-")]
+        self.row_ids = {}
+        self.index_rows()
+        self.area_cache = {}
+        self.endResetModel()
+
+    def clear(self):
+        self.set_annotations([])
+
+    def append(self, annotation):
+        if annotation['category_name'].startswith("Temp-"):
+            return
+        row = len(self.rows)
+        self.beginInsertRows(QModelIndex(), row, row)
+        self.rows.append(annotation)
+        self.row_ids[annotation.get('id')] = row
+        self.endInsertRows()
+
+    def index_rows(self, first=0):
+        for row in range(first, len(self.rows)):
+            self.row_ids[self.rows[row].get('id')] = row
+
+    def row_of(self, annotation):
+        row = self.row_ids.get(annotation.get('id'), -1)
+        return row if row >= 0 and self.rows[row] is annotation else -1
+
+    def remove(self, annotations):
+        """Remove the rows of these annotations (matched by ID), one contiguous block at a time."""
+        rows = sorted({self.row_ids[annotation['id']] for annotation in annotations
+                       if annotation.get('id') in self.row_ids})
+        if not rows:
+            return
+        first_changed = rows[0]
+        while rows:
+            last = first = rows.pop()
+            while rows and rows[-1] == first - 1:
+                first = rows.pop()
+            self.beginRemoveRows(QModelIndex(), first, last)
+            for removed in self.rows[first:last + 1]:
+                self.area_cache.pop(id(removed), None)
+                self.row_ids.pop(removed.get('id'), None)
+            del self.rows[first:last + 1]
+            self.endRemoveRows()
+        # Rows after the first removed one moved up
+        self.index_rows(first_changed)
+
+    def annotation_changed(self, annotation):
+        """Repaint the row of an annotation whose polygon, class or number changed."""
+        row = self.row_of(annotation)
+        if row >= 0:
+            self.area_cache.pop(id(annotation), None)
+            index = self.index(row)
+            self.dataChanged.emit(index, index)
+
+    def colors_changed(self):
+        if self.rows:
+            self.dataChanged.emit(self.index(0), self.index(len(self.rows) - 1), [Qt.ForegroundRole])
+
+
+class AnnotationListView(QListView):
+    """List view over an AnnotationListModel, with annotation-level selection helpers."""
+
+    selection_changed = pyqtSignal()
+
+    def __init__(self, model, parent=None):
+        super().__init__(parent)
+        self.setModel(model)
+        self.setSelectionMode(QAbstractItemView.ExtendedSelection)
+        # Rows have the same height, so only the visible ones are measured and painted
+        self.setUniformItemSizes(True)
+        self.selectionModel().selectionChanged.connect(lambda *_: self.selection_changed.emit())
+
+    def count(self):
+        return self.model().rowCount()
+
+    def clear(self):
+        self.model().clear()
+
+    def selected_annotations(self):
+        # One column, so the selected indexes are the selected rows (selectedRows() rescans every range)
+        rows = sorted(index.row() for index in self.selectionModel().selectedIndexes())
+        return [self.model().rows[row] for row in rows]
+
+    def current_annotation(self):
+        index = self.currentIndex()
+        return self.model().rows[index.row()] if index.isValid() else None
+
+    def select_annotation(self, annotation):
+        row = self.model().row_of(annotation)
+        if row >= 0:
+            index = self.model().index(row)
+            self.selectionModel().setCurrentIndex(index, QItemSelectionModel.ClearAndSelect)
+            self.scrollTo(index)
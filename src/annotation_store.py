@@ -0,0 +1,425 @@
+"""
+Compact in-memory storage of a project's annotations.
+
+A project's annotations used to be held as nested dicts, one dict per
+annotation with its polygon as a list of Python floats (about 32 bytes per
+coordinate, before the dict itself). AnnotationStore keeps the images that
+are not being edited packed instead: all vertices of an image in one
+contiguous float64 NumPy buffer, and one AnnotationRecord (a __slots__
+object) per annotation holding its offset and length into that buffer, a
+shared tuple with the annotation's key order and the other values.
+
+Every annotation gets an integer ID, stored in its dict as 'id' and saved
+with the project, so it stays the same across image switches and sessions.
+IDs are handed out from one counter per project and are unique within an
+image.
+
+For the existing code, AnnotationStore behaves like the old
+{image or slice name: {class: [annotation dict]}} mapping:
+
+- store[name] unpacks the image into dicts (if it was packed) and returns
+  them; changes made to those dicts are kept. store[name] = annotations
+  stores the dict as it is. Such "live" images stay dicts until pack() is
+  called, which the annotator does whenever it switches images, so at most
+  the image on screen is unpacked.
+- items() and values() yield images without unpacking them in the store:
+  packed images are rebuilt as fresh dicts one at a time and must be
+  treated as read-only. peek() and get() do the same for one image.
+- Class-wide changes (rename_class, remove_classes, add_classes, renumber)
+  work on packed images directly.
+
+Changes that span several annotations or images are made inside a batch
+(`with store.batch(): ...`, or begin()/commit()). The bulk methods record
+which images they changed, and when the outermost batch is committed the
+commit listeners are called once with all of them, so the annotator
+refreshes its lists and saves once per batch rather than once per change.
+Changes made outside a batch are not reported.
+"""
+
+import copy
+from collections.abc import MutableMapping
+from contextlib import contextmanager
+
+import numpy as np
+
+
+# Key orders of annotation dicts; records with the same keys share one tuple
+_layouts = {}
+
+
+def shared_layout(keys):
+    keys = tuple(keys)
+    return _layouts.setdefault(keys, keys)
+
+
+def detach(value):
+    """Copy the mutable values (bbox lists and the like) a record must not share with a dict."""
+    if isinstance(value, (list, dict)):
+        return copy.deepcopy(value)
+    return value
+
+
+def flat_coordinates(segmentation):
+    """A flat numeric polygon as a NumPy array, or None for anything that cannot be packed."""
+    if not isinstance(segmentation, list):
+        return None
+    values = np.asarray(segmentation)
+    if values.ndim != 1 or (values.size and values.dtype.kind not in 'iuf'):
+        return None
+    return values
+
+
+class AnnotationRecord:
+    """One packed annotation: where its vertices are, and its other values in key order."""
+
+    __slots__ = ('id', 'start', 'count', 'is_int', 'keys', 'values')
+
+    def __init__(self, annotation_id, start, count, is_int, keys, values):
+        self.id = annotation_id
+        self.start = start  # -1: the segmentation could not be packed and is in `values`
+        self.count = count
+        self.is_int = is_int
+        self.keys = keys
+        self.values = values
+
+    def value_keys(self):
+        packed = ('id', 'segmentation') if self.start >= 0 else ('id',)
+        return [key for key in self.keys if key not in packed]
+
+    def get(self, key, default=None):
+        if key == 'id':
+            return self.id
+        value_keys = self.value_keys()
+        if key in value_keys:
+            return self.values[value_keys.index(key)]
+        return default
+
+    def set(self, key, value):
+        value_keys = self.value_keys()
+        if key in value_keys:
+            values = list(self.values)
+            values[value_keys.index(key)] = value
+            self.values = tuple(values)
+        else:
+            self.keys = shared_layout(self.keys + (key,))
+            self.values = self.values + (value,)
+
+    def coordinates(self, coords):
+        return coords[self.start:self.start + self.count]
+
+    def to_dict(self, coords):
+        annotation = {}
+        values = iter(self.values)
+        for key in self.keys:
+            if key == 'id':
+                annotation[key] = self.id
+            elif key == 'segmentation' and self.start >= 0:
+                vertices = self.coordinates(coords)
+                annotation[key] = (vertices.astype(np.int64) if self.is_int else vertices).tolist()
+            else:
+                annotation[key] = detach(next(values))
+        return annotation
+
+
+class PackedImage:
+    """The annotations of one image or slice: records per class over one vertex buffer."""
+
+    __slots__ = ('classes', 'coords')
+
+    def __init__(self, classes, coords):
+        self.classes = classes
+        self.coords = coords
+
+    @classmethod
+    def pack(cls, annotations):
+        """Pack {class: [annotation dict]}; the dicts must already carry their 'id'."""
+        classes = {}
+        buffers = []
+        offset = 0
+        for class_name, items in annotations.items():
+            records = []
+            for annotation in items:
+                keys = list(annotation)
+                if 'id' not in annotation:
+                    keys.append('id')
+                vertices = flat_coordinates(annotation.get('segmentation'))
+                if vertices is None:
+                    start, count, is_int = -1, 0, False
+                    skip = ('id',)
+                else:
+                    start, count, is_int = offset, len(vertices), vertices.dtype.kind in 'iu'
+                    buffers.append(vertices.astype(np.float64))
+                    offset += count
+                    skip = ('id', 'segmentation')
+                values = tuple(detach(annotation[key]) for key in keys if key not in skip)
+                records.append(AnnotationRecord(annotation['id'], start, count, is_int,
+                                                shared_layout(keys), values))
+            classes[class_name] = records
+        coords = np.concatenate(buffers) if buffers else np.empty(0, dtype=np.float64)
+        return cls(classes, coords)
+
+    def unpack(self):
+        return {class_name: [record.to_dict(self.coords) for record in records]
+                for class_name, records in self.classes.items()}
+
+    def select(self, class_names):
+        """A PackedImage of just these classes, with their vertices copied into its own buffer."""
+        return PackedImage.combine([(self, [c for c in class_names if c in self.classes])])
+
+    @classmethod
+    def combine(cls, parts):
+        """Pack the given classes of several PackedImages, [(packed, class names)], into one buffer."""
+        classes = {}
+        buffers = []
+        offset = 0
+        for packed, class_names in parts:
+            for class_name in class_names:
+                records = classes.setdefault(class_name, [])
+                for record in packed.classes[class_name]:
+                    start = -1
+                    if record.start >= 0:
+                        buffers.append(record.coordinates(packed.coords))
+                        start = offset
+                        offset += record.count
+                    # Record values are replaced, never changed in place, so they can be shared
+                    records.append(AnnotationRecord(record.id, start, record.count, record.is_int,
+                                                    record.keys, record.values))
+        coords = np.concatenate(buffers) if buffers else np.empty(0, dtype=np.float64)
+        return cls(classes, coords)
+
+    def records(self):
+        for records in self.classes.values():
+            yield from records
+
+    def nbytes(self):
+        return self.coords.nbytes
+
+
+class AnnotationStore(MutableMapping):
+    """Annotations of all images and slices of a project, packed except where being edited."""
+
+    def __init__(self):
+        # name -> PackedImage, or the annotation dict of a live image
+        self._images = {}
+        self.next_id = 1
+        # Called with the set of changed image names when a batch is committed
+        self.commit_listeners = []
+        self._batch_depth = 0
+        self._changed = set()
+
+    # Mapping interface (the compatibility view)
+
+    def __getitem__(self, name):
+        entry = self._images[name]
+        if isinstance(entry, PackedImage):
+            entry = entry.unpack()
+            self._images[name] = entry
+        return entry
+
+    def __setitem__(self, name, annotations):
+        self.assign_ids(annotations)
+        self._images[name] = annotations
+
+    def get(self, name, default=None):
+        """Like peek(): a packed image is not unpacked in the store, so do not modify the result."""
+        return self.peek(name, default)
+
+    def __delitem__(self, name):
+        del self._images[name]
+
+    def __iter__(self):
+        return iter(self._images)
+
+    def __len__(self):
+        return len(self._images)
+
+    def __contains__(self, name):
+        return name in self._images
+
+    def clear(self):
+        self._images.clear()
+        self.next_id = 1
+
+    def items(self):
+        """(name, annotations) pairs; packed images are rebuilt one at a time and are read-only."""
+        for name in list(self._images):
+            yield name, self.peek(name)
+
+    def values(self):
+        for _, annotations in self.items():
+            yield annotations
+
+    # Packed access
+
+    def peek(self, name, default=None):
+        """The annotations of an image without unpacking it in the store. Do not modify the result."""
+        entry = self._images.get(name)
+        if entry is None:
+            return default
+        return entry.unpack() if isinstance(entry, PackedImage) else entry
+
+    def copy_of(self, name, default=None):
+        """An independent copy of an image's annotations, for editing."""
+        entry = self._images.get(name)
+        if entry is None:
+            return default
+        return entry.unpack() if isinstance(entry, PackedImage) else copy.deepcopy(entry)
+
+    def load(self, name, annotations):
+        """Store the annotations of an image that is not being edited, packed straight away."""
+        self.assign_ids(annotations)
+        self._images[name] = PackedImage.pack(annotations)
+
+    def pack(self, keep=()):
+        """Pack every live image except those in `keep`."""
+        for name, entry in self._images.items():
+            if name not in keep and not isinstance(entry, PackedImage):
+                self.assign_ids(entry)
+                self._images[name] = PackedImage.pack(entry)
+
+    def is_packed(self, name):
+        return isinstance(self._images.get(name), PackedImage)
+
+    def has_annotations(self, name):
+        """True if the image has at least one annotation (of any class)."""
+        entry = self._images.get(name)
+        if entry is None:
+            return False
+        classes = entry.classes if isinstance(entry, PackedImage) else entry
+        return any(classes.values())
+
+    def class_names(self):
+        names = {}
+        for entry in self._images.values():
+            classes = entry.classes if isinstance(entry, PackedImage) else entry
+            names.update(dict.fromkeys(classes))
+        return list(names)
+
+    def annotation_count(self):
+        count = 0
+        for entry in self._images.values():
+            classes = entry.classes if isinstance(entry, PackedImage) else entry
+            count += sum(len(items) for items in classes.values())
+        return count
+
+    # IDs
+
+    def new_id(self):
+        annotation_id = self.next_id
+        self.next_id += 1
+        return annotation_id
+
+    def assign_ids(self, annotations):
+        """Give every annotation of an image an ID it does not share with another one of the image."""
+        seen = set()
+        for items in annotations.values():
+            for annotation in items:
+                annotation_id = annotation.get('id')
+                if not isinstance(annotation_id, int) or annotation_id in seen:
+                    annotation_id = annotation['id'] = self.new_id()
+                elif annotation_id >= self.next_id:
+                    self.next_id = annotation_id + 1
+                seen.add(annotation_id)
+
+    # Batches
+
+    def begin(self):
+        self._batch_depth += 1
+
+    def commit(self):
+        """End a batch; ending the outermost one reports every image changed in it to the listeners."""
+        self._batch_depth -= 1
+        if self._batch_depth == 0 and self._changed:
+            changed, self._changed = self._changed, set()
+            for listener in self.commit_listeners:
+                listener(changed)
+
+    @contextmanager
+    def batch(self):
+        self.begin()
+        try:
+            yield self
+        finally:
+            self.commit()
+
+    def touch(self, name):
+        """Record that an image changed in the current batch."""
+        if self._batch_depth:
+            self._changed.add(name)
+
+    def in_batch(self):
+        return self._batch_depth > 0
+
+    # Class-wide changes
+
+    def rename_class(self, old_name, new_name):
+        for name, entry in self._images.items():
+            classes = entry.classes if isinstance(entry, PackedImage) else entry
+            if old_name not in classes:
+                continue
+            classes[new_name] = classes.pop(old_name)
+            for annotation in classes[new_name]:
+                if isinstance(annotation, AnnotationRecord):
+                    annotation.set('category_name', new_name)
+                else:
+                    annotation['category_name'] = new_name
+            self.touch(name)
+
+    def extract_class(self, class_name):
+        """{image name: PackedImage holding only this class} for every image with annotations of it."""
+        extracted = {}
+        for name, entry in self._images.items():
+            if isinstance(entry, PackedImage):
+                if entry.classes.get(class_name):
+                    extracted[name] = entry.select((class_name,))
+            elif entry.get(class_name):
+                extracted[name] = PackedImage.pack({class_name: entry[class_name]})
+        return extracted
+
+    def add_classes(self, name, packed):
+        """Add the classes of a PackedImage to an image (created if missing), without unpacking it."""
+        entry = self._images.get(name)
+        if isinstance(entry, PackedImage):
+            self._images[name] = PackedImage.combine([(entry, list(entry.classes)), (packed, list(packed.classes))])
+        elif entry is not None:
+            for class_name, annotations in packed.unpack().items():
+                entry.setdefault(class_name, []).extend(annotations)
+        else:
+            self._images[name] = PackedImage.combine([(packed, list(packed.classes))])
+        self.touch(name)
+
+    def remove_classes(self, predicate, drop_empty=False):
+        """Remove the classes whose name satisfies `predicate` from every image."""
+        for name in list(self._images):
+            entry = self._images[name]
+            classes = entry.classes if isinstance(entry, PackedImage) else entry
+            removed = [c for c in classes if predicate(c)]
+            if removed:
+                if isinstance(entry, PackedImage):
+                    # Repacked so the removed vertices do not stay in the buffer
+                    entry = self._images[name] = entry.select([c for c in classes if c not in removed])
+                    classes = entry.classes
+                else:
+                    for class_name in removed:
+                        del classes[class_name]
+                self.touch(name)
+            if drop_empty and not classes:
+                del self._images[name]
+
+    def renumber(self, name):
+        """Number the annotations of each class of an image 1, 2, 3... in their current order."""
+        entry = self._images.get(name)
+        if entry is None:
+            return
+        classes = entry.classes if isinstance(entry, PackedImage) else entry
+        for annotations in classes.values():
+            for number, annotation in enumerate(annotations, start=1):
+                if isinstance(annotation, AnnotationRecord):
+                    annotation.set('number', number)
+                else:
+                    annotation['number'] = number
+        self.touch(name)
+
+    def nbytes(self):
+        """Bytes held in vertex buffers (packed images only)."""
+        return sum(entry.nbytes() for entry in self._images.values() if isinstance(entry, PackedImage))
@@ -6,11 +6,10 @@ from PyQt5.QtWidgets import (QMainWindow, QWidget, QVBoxLayout, QHBoxLayout,
                              QSlider, QMenu, QMessageBox, QColorDialog, QDialog, QDoubleSpinBox,
                              QGridLayout, QComboBox, QAbstractItemView, QProgressDialog,
                              QApplication, QAction, QLineEdit, QTextEdit, QDialogButtonBox, QProgressBar)
-from PyQt5.QtGui import QPixmap, QColor, QIcon, QImage, QFont, QKeySequence, QPalette
-from PyQt5.QtCore import Qt, QThread, pyqtSignal
+from PyQt5.QtGui import QPixmap, QColor, QIcon, QImage, QImageReader, QFont, QKeySequence, QPalette
+from PyQt5.QtCore import Qt, QThread, pyqtSignal, QSettings, QTimer, QEventLoop
 import numpy as np
 from tifffile import TiffFile
-from czifile import CziFile
 import cv2
 from datetime import datetime
 
@@ -33,6 +32,22 @@ from src.sam_utils import SAMUtils
 from src.yolo_trainer import YOLOTrainer, TrainingInfoDialog, LoadPredictionModelDialog
 from src.stack_interpolator import StackInterpolator
 from src.dicom_converter import DicomConverter
+from src.slice_stack import SliceStack, LazySlice, materialize_slice, close_slices
+from src.normalization import SliceNormalizer, normalize_to_qimage, CONTRAST_PER_SLICE, CONTRAST_PER_STACK
+from src.stack_readers import open_tiff_stack, open_czi_stack
+from src.slice_cache import SliceCache, DEFAULT_BUDGET_MB
+from src.slice_prefetcher import SlicePrefetcher, DEFAULT_PREFETCH_RADIUS
+from src.spatial_index import polygons_connected
+from src.project_journal import ProjectJournal
+from src.project_store import (read_project_file, with_project_suffix, annotations_digest,
+                               SAVE_PROJECT_FILTER, OPEN_PROJECT_FILTER)
+from src.image_store import ImageCopyWorker
+from src.project_backup import ProjectBackups, DEFAULT_KEEP_LAST, DEFAULT_KEEP_DAILY
+from src.project_saver import ProjectSaver, AUTO_SAVE_DELAY_MS
+from src.annotation_store import AnnotationStore
+from src.annotation_history import AnnotationHistory, ImageChange, ClassRename, ClassDelete, DEFAULT_UNDO_BUDGET_MB
+from src.annotation_list_model import AnnotationListModel, AnnotationListView
+from src.name_list_model import NameListModel, NameListView
 
 from shapely.geometry import Polygon, MultiPolygon, Point
 from shapely.ops import unary_union
@@ -49,6 +64,7 @@ from src.import_formats import process_import_format
 
 import shutil 
 import copy
+from contextlib import contextmanager
 from ultralytics import SAM
 
 import warnings
@@ -115,7 +131,26 @@ class ImageAnnotator(QMainWindow):
         super().__init__()
         
         self.is_loading_project = False
-        self.backup_project_path = None
+        
+        # Incremental saving: images whose annotations changed since the last save/journal append
+        self.dirty_images = set()
+        self.full_save_needed = False
+        self.journaled_metadata = None
+        self.journal = None
+        # Digest of each image's annotations as last written, to skip saves that change nothing
+        self.saved_digests = {}
+        
+        # Saves are serialized and written on a worker thread; auto-saves are debounced
+        self.project_saver = ProjectSaver(self)
+        self.auto_save_timer = QTimer(self)
+        self.auto_save_timer.setSingleShot(True)
+        self.auto_save_timer.setInterval(AUTO_SAVE_DELAY_MS)
+        self.auto_save_timer.timeout.connect(self.save_project_changes)
+        
+        # User preferences persisted between sessions
+        self.settings = QSettings("ZoraVision", "ZoraVision")
+        # Display contrast: per slice (default) or shared by the whole stack
+        self.contrast_mode = self.settings.value("contrast_mode", CONTRAST_PER_SLICE)
         
         self.setWindowTitle("ZoraVision")
         self.setGeometry(100, 100, 1400, 800)
@@ -134,7 +169,8 @@ class ImageAnnotator(QMainWindow):
         self.current_image = None
         self.current_class = None
         self.image_file_name = ""
-        self.all_annotations = {}
+        self.all_annotations = AnnotationStore()
+        self.all_annotations.commit_listeners.append(self.on_annotations_committed)
         self.all_images = []
         self.image_paths = {}
         self.loaded_json = None
@@ -146,6 +182,20 @@ class ImageAnnotator(QMainWindow):
         self.image_dimensions = {}
         self.image_slices = {}
         self.image_shapes = {}
+        # Content hashes of the images in the project directory (see image_store)
+        self.image_hashes = {}
+        
+        # Rendered slices are kept in a bounded LRU cache (budget set in Settings)
+        cache_budget_mb = int(self.settings.value("slice_cache_budget_mb", DEFAULT_BUDGET_MB))
+        self.slice_cache = SliceCache(cache_budget_mb * 1024 * 1024)
+        
+        # Undo steps hold only what changed, within a memory budget (set in Settings)
+        undo_budget_mb = int(self.settings.value("undo_budget_mb", DEFAULT_UNDO_BUDGET_MB))
+        self.annotation_history = AnnotationHistory(undo_budget_mb * 1024 * 1024)
+        
+        # Neighbouring slices are rendered into the cache on a worker thread
+        self.slice_prefetcher = SlicePrefetcher(self)
+        self.slice_prefetch_radius = DEFAULT_PREFETCH_RADIUS
         
         #For paint brush and eraser
         self.paint_brush_size = 10
@@ -184,6 +234,13 @@ class ImageAnnotator(QMainWindow):
         
         self.class_list.itemChanged.connect(self.toggle_class_visibility)
         
+        # Save indicator in the status bar
+        self.save_status_label = QLabel()
+        self.statusBar().addPermanentWidget(self.save_status_label)
+        self.project_saver.save_started.connect(self.on_project_saving)
+        self.project_saver.save_finished.connect(self.on_project_saved)
+        self.project_saver.save_failed.connect(self.on_project_save_failed)
+        
         #YOLO Trainer
         self.yolo_trainer = None
         self.setup_yolo_menu()
@@ -213,7 +270,8 @@ class ImageAnnotator(QMainWindow):
         if hasattr(self, 'current_project_file'):
             project_name = os.path.basename(self.current_project_file)
             project_name = os.path.splitext(project_name)[0]  # Remove the file extension
-            self.setWindowTitle(f"{base_title} - {project_name}")
+            # [*] shows an asterisk while the project has unsaved changes
+            self.setWindowTitle(f"{base_title} - {project_name}[*]")
         else:
             self.setWindowTitle(base_title)
         
@@ -221,11 +279,11 @@ class ImageAnnotator(QMainWindow):
                 
     def new_project(self):
         self.remove_all_temp_annotations()  # Remove temp annotations from the previous project
-        project_file, _ = QFileDialog.getSaveFileName(self, "Create New Project", "", "Image Annotator Project (*.iap)")
+        self.flush_pending_saves()
+        project_file, selected_filter = QFileDialog.getSaveFileName(self, "Create New Project", "", SAVE_PROJECT_FILTER)
         if project_file:
             # Ensure the file has the correct extension
-            if not project_file.lower().endswith('.iap'):
-                project_file += '.iap'
+            project_file = with_project_suffix(project_file, selected_filter)
             
             self.current_project_file = project_file
             self.current_project_dir = os.path.dirname(project_file)
@@ -263,51 +321,136 @@ class ImageAnnotator(QMainWindow):
     def open_project(self):
         print("open_project method called")  # Debug print
         self.remove_all_temp_annotations()  # Remove temp annotations from the previous project
-        project_file, _ = QFileDialog.getOpenFileName(self, "Open Project", "", "Image Annotator Project (*.iap)")
+        project_file, _ = QFileDialog.getOpenFileName(self, "Open Project", "", OPEN_PROJECT_FILTER)
         print(f"Selected project file: {project_file}")  # Debug print
         if project_file:
             try:
-                self.backup_project_before_open(project_file)
                 self.open_specific_project(project_file)
             except Exception as e:
-                self.restore_project_from_backup()
-                QMessageBox.critical(self, "Error", f"An error occurred while opening the project: {str(e)}\n"
-                                                  f"The project file has been restored from backup.")
+                QMessageBox.critical(self, "Error", f"An error occurred while opening the project: {str(e)}")
+                self.offer_restore_after_failed_open(project_file)
         else:
             print("No project file selected")  # Debug print
 
 
     def backup_project_before_open(self, project_file):
-        """Create a backup of the project file before opening it."""
-        import shutil
-        import os
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        backup_dir = os.path.join(os.path.dirname(project_file), ".project_backups")
-        os.makedirs(backup_dir, exist_ok=True)
-        
-        self.backup_project_path = os.path.join(backup_dir, 
-            f"{os.path.basename(project_file)}.{timestamp}.backup")
-        shutil.copy2(project_file, self.backup_project_path)
-
-    def restore_project_from_backup(self):
-        """Restore the project file from its backup if available."""
-        if self.backup_project_path and os.path.exists(self.backup_project_path):
-            try:
-                shutil.copy2(self.backup_project_path, self.current_project_file)
-                print(f"Project restored from backup: {self.backup_project_path}")
-            except Exception as e:
-                print(f"Failed to restore from backup: {str(e)}")
-            
-            
+        """Snapshot the project before opening it (on the saver thread, ahead of any save)."""
+        self.project_saver.back_up(project_file, *self.backup_retention())
+
+    def backup_retention(self):
+        keep_last = int(self.settings.value("backup_keep_last", DEFAULT_KEEP_LAST))
+        keep_daily = int(self.settings.value("backup_keep_daily", DEFAULT_KEEP_DAILY))
+        return keep_last, keep_daily
+
+    def restore_project_from_backup(self, snapshot_path, project_file):
+        """Restore a project file to a backup snapshot."""
+        self.project_saver.flush()
+        try:
+            ProjectBackups(project_file).restore(snapshot_path)
+            return True
+        except Exception as e:
+            print(f"Failed to restore from backup: {str(e)}")
+            return False
+
+    def restore_from_backup(self):
+        """Let the user pick a snapshot of the current project and roll the project back to it."""
+        if not hasattr(self, 'current_project_file'):
+            QMessageBox.warning(self, "No Project", "Please open or create a project first.")
+            return
+        project_file = self.current_project_file
+        snapshots = ProjectBackups(project_file).snapshots()
+        if not snapshots:
+            QMessageBox.information(self, "Restore from Backup", "There are no backups of this project yet.")
+            return
+        snapshot_path = self.choose_backup_snapshot(snapshots, "Restore the project to:",
+                                                    "The current state is backed up first.")
+        if snapshot_path is None:
+            return
+
+        errors = self.flush_pending_saves()
+        if errors:
+            QMessageBox.critical(self, "Error", f"The project could not be saved before restoring:\n{errors[-1]}")
+            return
+        try:
+            # Restoring is undoable: the state being replaced becomes a snapshot too
+            ProjectBackups(project_file).snapshot()
+        except Exception as e:
+            QMessageBox.critical(self, "Error", f"Failed to back up the current state: {str(e)}")
+            return
+        if not self.restore_project_from_backup(snapshot_path, project_file):
+            QMessageBox.critical(self, "Error", "Failed to restore from backup.")
+            return
+        self.open_specific_project(project_file)
+
+    def offer_restore_after_failed_open(self, project_file):
+        """Offer the backups of a project that failed to open; nothing is restored without asking."""
+        # Let the open-time snapshot finish (or fail) so the list is final
+        self.project_saver.flush()
+        snapshots = ProjectBackups(project_file).snapshots()
+        if not snapshots:
+            return
+        snapshot_path = self.choose_backup_snapshot(
+            snapshots, "The project could not be opened. Restore it from a backup?",
+            "The file that failed to open and its journal are kept next to it, renamed.")
+        if snapshot_path is None:
+            return
+        try:
+            kept = ProjectBackups(project_file).set_aside()
+        except Exception as e:
+            QMessageBox.critical(self, "Error", f"Failed to set the project file aside: {str(e)}")
+            return
+        if not self.restore_project_from_backup(snapshot_path, project_file):
+            QMessageBox.critical(self, "Error", f"Failed to restore from backup. The project file was kept as {kept}.")
+            return
+        try:
+            self.open_specific_project(project_file)
+        except Exception as e:
+            QMessageBox.critical(self, "Error", f"An error occurred while opening the restored project: {str(e)}")
+
+    def choose_backup_snapshot(self, snapshots, prompt, note):
+        """Let the user pick one of the snapshots and confirm; returns its manifest path or None."""
+        labels = []
+        for _, manifest in snapshots:
+            created = datetime.fromisoformat(manifest['created']).strftime("%Y-%m-%d %H:%M:%S")
+            labels.append(f"{created} ({len(manifest['annotations'])} images/slices)")
+        label, ok = QInputDialog.getItem(self, "Restore from Backup", prompt, labels, 0, False)
+        if not ok:
+            return None
+        reply = QMessageBox.question(self, "Restore from Backup",
+                                     f"Replace the project with the backup from {label.split(' (')[0]}?\n{note}",
+                                     QMessageBox.Yes | QMessageBox.No, QMessageBox.No)
+        if reply != QMessageBox.Yes:
+            return None
+        return snapshots[labels.index(label)][0]
+
+    def set_backup_retention(self):
+        keep_last, keep_daily = self.backup_retention()
+        keep_last, ok = QInputDialog.getInt(self, "Backup Retention", "Always keep the newest backups:",
+                                            keep_last, 1, 1000, 1)
+        if not ok:
+            return
+        keep_daily, ok = QInputDialog.getInt(self, "Backup Retention", "Keep one backup per day for (days):",
+                                             keep_daily, 0, 3650, 1)
+        if not ok:
+            return
+        self.settings.setValue("backup_keep_last", keep_last)
+        self.settings.setValue("backup_keep_daily", keep_daily)
+        if hasattr(self, 'current_project_file'):
+            self.project_saver.prune_backups(self.current_project_file, keep_last, keep_daily)
 
     def open_specific_project(self, project_file):
         print(f"Opening specific project: {project_file}")  # Debug print
+        self.flush_pending_saves()
         if os.path.exists(project_file):
+            # Queued after the flush, so opening does not wait for it
+            self.backup_project_before_open(project_file)
             try:
                 self.is_loading_project = True  # Set loading flag
                 
-                with open(project_file, 'r') as f:
-                    project_data = json.load(f)
+                project_data = read_project_file(project_file)
+                
+                # Changes auto-saved since the last full save are kept in the journal
+                annotation_overrides = ProjectJournal(project_file).replay(project_data)
                 
                 self.clear_all(show_messages=False)
                 self.current_project_file = project_file
@@ -325,11 +468,14 @@ class ImageAnnotator(QMainWindow):
                     self.last_modified = datetime.fromisoformat(self.last_modified).strftime("%Y-%m-%d %H:%M:%S")
                 
                 # Load all data without triggering auto-saves
-                self.load_project_data(project_data)
+                self.load_project_data(project_data, annotation_overrides)
                 
-                # Now save once after everything is loaded
+                # Nothing changed yet: no save until something does
                 self.is_loading_project = False  # Clear loading flag
-                self.save_project(show_message=False)  # Save once after loading
+                self.set_project_modified(False)
+                if self.build_project_metadata() != self.journaled_metadata:
+                    # Loading changed the image entries (missing images removed, sizes filled in)
+                    self.auto_save()
                 
                 self.initialize_yolo_trainer()    
                 self.update_window_title()
@@ -344,7 +490,7 @@ class ImageAnnotator(QMainWindow):
             print(f"Project file not found: {project_file}")
             QMessageBox.critical(self, "Error", f"Project file not found: {project_file}")
 
-    def load_project_data(self, project_data):
+    def load_project_data(self, project_data, annotation_overrides=None):
         """Load project data without triggering auto-saves."""
         # Load classes
         self.class_mapping.clear()
@@ -352,38 +498,63 @@ class ImageAnnotator(QMainWindow):
         for class_info in project_data.get('classes', []):
             self.add_class(class_info['name'], QColor(class_info['color']))
     
-        # Load images
-        self.all_images = project_data.get('images', [])
+        # Load images; entries keep only metadata, annotations live in all_annotations
+        self.all_images = []
+        for image_info in project_data.get('images', []):
+            image_info = {key: value for key, value in image_info.items() if key != 'annotations'}
+            if 'slices' in image_info:
+                image_info['slices'] = [{'name': slice_info['name']} for slice_info in image_info['slices']]
+            self.all_images.append(image_info)
         self.image_paths = project_data.get('image_paths', {})
+        self.image_hashes = project_data.get('image_hashes', {})
+        self.journaled_metadata = self.stored_project_metadata(project_data)
         
-        # Load all annotations first
+        # Load all annotations first, packed (see annotation_store)
         self.all_annotations.clear()
+        annotation_overrides = annotation_overrides or {}
         for image_info in project_data['images']:
             if image_info.get('is_multi_slice', False):
                 for slice_info in image_info.get('slices', []):
-                    self.all_annotations[slice_info['name']] = slice_info['annotations']
+                    self.all_annotations.load(slice_info['name'], slice_info['annotations'])
+            else:
+                self.all_annotations.load(image_info['file_name'], image_info.get('annotations', {}))
+        
+        # Annotations replayed from the journal replace those of the project file
+        for name, annotations in annotation_overrides.items():
+            if annotations:
+                self.all_annotations.load(name, annotations)
             else:
-                self.all_annotations[image_info['file_name']] = image_info.get('annotations', {})
+                self.all_annotations.pop(name, None)
     
-        # Handle missing images
+        # Handle missing images. The list is filled from the stored metadata; an image is
+        # only decoded when switch_image shows it.
+        images_dir = os.path.join(self.current_project_dir, "images")
+        try:
+            present = {os.path.normcase(entry.name) for entry in os.scandir(images_dir) if entry.is_file()}
+        except OSError:
+            present = set()
         missing_images = []
-        for image_info in project_data['images']:
-            image_path = os.path.join(self.current_project_dir, "images", image_info['file_name'])
-            
-            if not os.path.exists(image_path):
-                missing_images.append(image_info['file_name'])
+        for image_info in self.all_images:
+            file_name = image_info['file_name']
+            image_path = os.path.join(images_dir, file_name)
+            # The listing is only a fast path: names it does not match exactly (a different case on
+            # a case-insensitive filesystem such as macOS's) are checked on disk
+            if os.path.normcase(file_name) not in present and not os.path.exists(image_path):
+                missing_images.append(file_name)
                 continue
     
             # Update image_paths
-            self.image_paths[image_info['file_name']] = image_path
+            self.image_paths[file_name] = image_path
     
             if image_info.get('is_multi_slice', False):
-                dimensions = image_info.get('dimensions', [])
-                shape = image_info.get('shape', [])
-                self.load_multi_slice_image(image_path, dimensions, shape)
-            else:
-                self.add_images_to_list([image_path])
-    
+                base_name = os.path.splitext(file_name)[0]
+                if image_info.get('dimensions') and image_info.get('shape'):
+                    self.image_dimensions[base_name] = image_info['dimensions']
+                    self.image_shapes[base_name] = image_info['shape']
+            elif not image_info.get('width') or not image_info.get('height'):
+                # Older entries without a size: read it from the file header
+                size = QImageReader(image_path).size()
+                image_info['width'], image_info['height'] = size.width(), size.height()
 
         # Update UI
         self.update_ui()
@@ -438,7 +609,7 @@ class ImageAnnotator(QMainWindow):
             if base_name in self.image_slices:
                 for slice_name, _ in self.image_slices[base_name]:
                     self.all_annotations.pop(slice_name, None)
-                del self.image_slices[base_name]
+                self.discard_image_slices(base_name)
         
         self.update_ui()
         QMessageBox.information(self, "Images Removed", 
@@ -498,9 +669,7 @@ class ImageAnnotator(QMainWindow):
 
 
     def update_image_list(self):
-        self.image_list.clear()
-        for image_info in self.all_images:
-            self.image_list.addItem(image_info['file_name'])
+        self.image_list.set_names(image_info['file_name'] for image_info in self.all_images)
 
     def select_class(self, index):
         if 0 <= index < self.class_list.count():
@@ -513,6 +682,7 @@ class ImageAnnotator(QMainWindow):
     
     
     def close_project(self):
+        self.flush_pending_saves()
         if hasattr(self, 'current_project_file'):
             reply = QMessageBox.question(self, 'Close Project',
                                          "Do you want to save the current project before closing?",
@@ -573,9 +743,10 @@ class ImageAnnotator(QMainWindow):
     
     def save_project(self, show_message=True):
         if not hasattr(self, 'current_project_file') or not self.current_project_file:
-            self.current_project_file, _ = QFileDialog.getSaveFileName(self, "Save Project", "", "Image Annotator Project (*.iap)")
+            self.current_project_file, selected_filter = QFileDialog.getSaveFileName(self, "Save Project", "", SAVE_PROJECT_FILTER)
             if not self.current_project_file:
                 return  # User cancelled the save dialog
+            self.current_project_file = with_project_suffix(self.current_project_file, selected_filter)
             
         self.current_project_dir = os.path.dirname(self.current_project_file)
     
@@ -598,83 +769,269 @@ class ImageAnnotator(QMainWindow):
                                          QMessageBox.Yes | QMessageBox.No, QMessageBox.Yes)
             
             if reply == QMessageBox.Yes:
-                for file_name, src_path, dst_path in images_to_copy:
-                    try:
-                        shutil.copy2(src_path, dst_path)
-                        self.image_paths[file_name] = dst_path
-                    except Exception as e:
-                        QMessageBox.warning(self, "Copy Failed", f"Failed to copy {file_name}: {str(e)}")
-                        return
+                if not self.copy_images_into_project(images_to_copy, images_dir):
+                    return
             else:
                 QMessageBox.warning(self, "Save Cancelled", "Project cannot be saved without the correct directory structure.")
                 return
 
     
-        # Prepare image data
-        images_data = []
-        for image_info in self.all_images:
-            file_name = image_info['file_name']
-            image_data = {
-                'file_name': file_name,
-                'width': image_info['width'],
-                'height': image_info['height'],
-                'is_multi_slice': image_info['is_multi_slice']
-            }
+        metadata = self.build_project_metadata()
+        self.auto_save_timer.stop()
+        changed = self.changed_images()
+        if (os.path.exists(self.current_project_file) and not self.full_save_needed
+                and not self.project_journal().record_count() and metadata == self.journaled_metadata
+                and not changed):
+            print("Project unchanged, nothing to save.")
+        else:
+            # Snapshot on this thread; serializing and the atomic write happen on the saver thread,
+            # which then drops the journal records the snapshot includes
+            project_data = self.build_project_data()
+            self.project_saver.write_project(self.current_project_file, project_data, self.project_journal())
+        # The baselines now describe what was written. A class rename or deletion may have changed
+        # any image, so then only those of the dirty images are known to match; the others are taken
+        # again when the images are shown.
+        if self.full_save_needed:
+            self.saved_digests = {name: digest for name, digest in self.saved_digests.items()
+                                  if name in self.dirty_images}
+        self.saved_digests.update(changed)
+        self.dirty_images.clear()
+        self.full_save_needed = False
+        self.journaled_metadata = metadata
+        if not self.project_saver.pending():
+            self.set_project_modified(False)
     
-            if image_data['is_multi_slice']:
-                base_name_without_ext = os.path.splitext(file_name)[0]
-                image_data['slices'] = []
-                for slice_name, _ in self.image_slices.get(base_name_without_ext, []):
-                    slice_data = {
-                        'name': slice_name,
-                        'annotations': self.convert_to_serializable(self.all_annotations.get(slice_name, {}))
-                    }
-                    image_data['slices'].append(slice_data)
-                
-                image_data['dimensions'] = self.convert_to_serializable(self.image_dimensions.get(base_name_without_ext, []))
-                image_data['shape'] = self.convert_to_serializable(self.image_shapes.get(base_name_without_ext, []))
+        if show_message:
+            errors = self.project_saver.flush()
+            if errors:
+                QMessageBox.critical(self, "Save Failed", f"Failed to save the project:\n{errors[-1]}")
             else:
-                image_data['annotations'] = {}
-                for class_name, annotations in self.all_annotations.get(file_name, {}).items():
-                    image_data['annotations'][class_name] = [ann.copy() for ann in annotations]
-    
-            images_data.append(image_data)
+                self.show_info("Project Saved", f"Project saved to {self.current_project_file}")
     
-        # Create project data
-        project_data = {
+        # Update the window title
+        self.update_window_title()
+        
+        # Update image_paths to reflect the correct locations
+        for file_name in self.image_paths.keys():
+            self.image_paths[file_name] = os.path.join(images_dir, file_name)
+        
+
+
+    def copy_images_into_project(self, images_to_copy, images_dir):
+        """Copy (or link) images into images/ on worker threads, showing progress. Returns True on success."""
+        worker = ImageCopyWorker(images_to_copy, images_dir, self.image_hashes, self)
+        progress = QProgressDialog("Copying images into the project...", "Cancel", 0, len(images_to_copy), self)
+        progress.setWindowModality(Qt.WindowModal)
+        progress.setMinimumDuration(0)
+        progress.setAutoReset(False)
+        progress.canceled.connect(worker.cancel)
+        worker.progress.connect(lambda done, total, message: (progress.setValue(done), progress.setLabelText(message)))
+    
+        # Keep the window painting while the worker runs
+        loop = QEventLoop()
+        worker.finished.connect(loop.quit)
+        worker.start()
+        loop.exec_()
+        # Closing the dialog emits canceled as well
+        progress.canceled.disconnect(worker.cancel)
+        progress.close()
+    
+        self.image_hashes = worker.image_hashes
+        for file_name, dst_path in worker.copied:
+            self.image_paths[file_name] = dst_path
+        print(f"Images placed in project: {worker.methods}")
+    
+        if worker.errors:
+            QMessageBox.warning(self, "Copy Failed", "Failed to copy:\n" + "\n".join(worker.errors[:10]))
+            return False
+        if worker.was_cancelled():
+            QMessageBox.warning(self, "Save Cancelled", "Copying images was cancelled; the project was not saved.")
+            return False
+        return True
+
+    def build_image_data(self, image_info, include_annotations=True):
+        file_name = image_info['file_name']
+        image_data = {
+            'file_name': file_name,
+            'width': image_info['width'],
+            'height': image_info['height'],
+            'is_multi_slice': image_info['is_multi_slice']
+        }
+
+        if image_data['is_multi_slice']:
+            base_name_without_ext = os.path.splitext(file_name)[0]
+            image_data['slices'] = []
+            for slice_name in self.slice_names(image_info):
+                slice_data = {'name': slice_name}
+                if include_annotations:
+                    slice_data['annotations'] = self.all_annotations.copy_of(slice_name, {})
+                image_data['slices'].append(slice_data)
+            
+            image_data['dimensions'] = self.convert_to_serializable(self.image_dimensions.get(base_name_without_ext, []))
+            image_data['shape'] = self.convert_to_serializable(self.image_shapes.get(base_name_without_ext, []))
+        elif include_annotations:
+            image_data['annotations'] = self.all_annotations.copy_of(file_name, {})
+        return image_data
+
+    def slice_names(self, image_info):
+        """Slice names of a multi-slice image, from its stack or, if it was not opened yet, the project."""
+        base_name = os.path.splitext(image_info['file_name'])[0]
+        if base_name in self.image_slices:
+            return [slice_name for slice_name, _ in self.image_slices[base_name]]
+        return [slice_info['name'] for slice_info in image_info.get('slices', [])]
+
+    def stack_slices(self, file_name):
+        """Slices of a multi-slice image, opening its stack (without decoding pixels) if it was not viewed yet."""
+        base_name = os.path.splitext(file_name)[0]
+        if base_name not in self.image_slices:
+            image_path = self.image_paths.get(file_name)
+            dimensions = self.image_dimensions.get(base_name)
+            shape = self.image_shapes.get(base_name)
+            if not (image_path and os.path.exists(image_path) and dimensions and shape):
+                return []
+            if image_path.lower().endswith('.czi'):
+                image_array = open_czi_stack(image_path)
+            else:
+                image_array = open_tiff_stack(image_path)
+            self.image_slices[base_name] = self.build_slice_stack(base_name, image_array.reshape(shape), dimensions)
+        return self.image_slices[base_name]
+
+    def discard_image_slices(self, base_name):
+        """Drop a stack from image_slices, with its cached slices, and close the file it reads from."""
+        self.slice_prefetcher.cancel()
+        self.slice_cache.discard_stack(base_name)
+        close_slices(self.image_slices.pop(base_name))
+
+    def ensure_stacks_loaded(self):
+        """Open the stacks that were not viewed yet; exports and training read slices from image_slices."""
+        for image_info in self.all_images:
+            if image_info.get('is_multi_slice', False):
+                self.stack_slices(image_info['file_name'])
+
+    def build_project_data(self):
+        return {
             'classes': [
                 {'name': name, 'color': color.name()} 
                 for name, color in self.image_label.class_colors.items()
             ],
-            'images': images_data,
+            'images': [self.build_image_data(image_info) for image_info in self.all_images],
             'image_paths': {k: v for k, v in self.image_paths.items() if os.path.exists(v)},
+            'image_hashes': dict(self.image_hashes),
             'notes': getattr(self, 'project_notes', ''),
             'creation_date': getattr(self, 'project_creation_date', datetime.now().isoformat()),
             'last_modified': datetime.now().isoformat()
         }
-    
-        # Save project data
-        with open(self.current_project_file, 'w') as f:
-            json.dump(self.convert_to_serializable(project_data), f, indent=2)
-    
-        if show_message:
-            self.show_info("Project Saved", f"Project saved to {self.current_project_file}")
-    
-        # Update the window title
-        self.update_window_title()
-        
-        # Update image_paths to reflect the correct locations
-        for file_name in self.image_paths.keys():
-            self.image_paths[file_name] = os.path.join(images_dir, file_name)
-        
 
+    def stored_project_metadata(self, project_data):
+        """The metadata of a loaded project file, shaped like build_project_metadata."""
+        images = []
+        for image_info in project_data.get('images', []):
+            image_data = {key: value for key, value in image_info.items() if key != 'annotations'}
+            if 'slices' in image_data:
+                image_data['slices'] = [{'name': slice_info['name']} for slice_info in image_data['slices']]
+            images.append(image_data)
+        return {
+            'classes': project_data.get('classes', []),
+            'images': images,
+            'image_paths': {k: v for k, v in project_data.get('image_paths', {}).items() if os.path.exists(v)},
+            'image_hashes': project_data.get('image_hashes', {}),
+            'notes': project_data.get('notes', ''),
+        }
+
+    def build_project_metadata(self):
+        """Everything in the project file except annotations (for the journal)."""
+        return self.convert_to_serializable({
+            'classes': [
+                {'name': name, 'color': color.name()}
+                for name, color in self.image_label.class_colors.items()
+            ],
+            'images': [self.build_image_data(image_info, include_annotations=False) for image_info in self.all_images],
+            'image_paths': {k: v for k, v in self.image_paths.items() if os.path.exists(v)},
+            'image_hashes': dict(self.image_hashes),
+            'notes': getattr(self, 'project_notes', ''),
+        })
+
+    def project_journal(self):
+        if self.journal is None or self.journal.project_file != self.current_project_file:
+            self.journal = ProjectJournal(self.current_project_file)
+        return self.journal
+
+    def mark_image_dirty(self, image_name=None):
+        image_name = image_name or self.current_slice or self.image_file_name
+        if image_name:
+            self.dirty_images.add(image_name)
+
+    def mark_all_annotations_dirty(self):
+        """For changes spanning every image (class rename/delete, import): the next save rewrites the project."""
+        self.full_save_needed = True
+        self.set_project_modified(True)
+
+    def changed_images(self):
+        """{name: digest} of the dirty-marked images whose annotations differ from what was last written."""
+        changed = {}
+        for image_name in sorted(self.dirty_images):
+            digest = annotations_digest(self.all_annotations.peek(image_name, {}))
+            if digest != self.saved_digests.get(image_name):
+                changed[image_name] = digest
+        return changed
+
+    def set_project_modified(self, modified):
+        if '[*]' not in self.windowTitle():
+            self.update_window_title()
+        if '[*]' in self.windowTitle():
+            self.setWindowModified(modified)
+
+    def reset_save_state(self):
+        self.auto_save_timer.stop()
+        self.dirty_images.clear()
+        self.full_save_needed = False
+        self.journaled_metadata = None
+        self.saved_digests = {}
+        self.set_project_modified(False)
+
+    def save_project_changes(self):
+        """Append what changed since the last save to the journal, compacting into the .iap when it grows."""
+        if not hasattr(self, 'current_project_file'):
+            return
+        if self.full_save_needed or not os.path.exists(self.current_project_file):
+            self.save_project(show_message=False)
+            return
+    
+        records = []
+        metadata = self.build_project_metadata()
+        if metadata != self.journaled_metadata:
+            records.append({'op': 'project', 'data': metadata})
+        changed = self.changed_images()
+        for image_name in changed:
+            records.append({
+                'op': 'annotations',
+                'name': image_name,
+                'annotations': self.all_annotations.copy_of(image_name, {}),
+            })
+    
+        journal = self.project_journal()
+        if records:
+            self.project_saver.append_journal(journal, records)
+            print("Project auto-saved.")
+        elif not self.project_saver.pending():
+            self.set_project_modified(False)
+        self.dirty_images.clear()
+        self.saved_digests.update(changed)
+        self.journaled_metadata = metadata
+    
+        # The record count lags behind by the appends still queued; compaction just happens one save later
+        if journal.needs_compaction():
+            print("Compacting project journal")
+            self.save_project(show_message=False)
 
     def save_project_as(self):
-        new_project_file, _ = QFileDialog.getSaveFileName(self, "Save Project As", "", "Image Annotator Project (*.iap)")
+        # Saving under the other suffix converts between the JSON and binary formats
+        new_project_file, selected_filter = QFileDialog.getSaveFileName(self, "Save Project As", "", SAVE_PROJECT_FILTER)
         if new_project_file:
             # Ensure the file has the correct extension
-            if not new_project_file.lower().endswith('.iap'):
-                new_project_file += '.iap'
+            new_project_file = with_project_suffix(new_project_file, selected_filter)
+            
+            self.flush_pending_saves()
             
             # Store the original project file
             original_project_file = getattr(self, 'current_project_file', None)
@@ -710,8 +1067,32 @@ class ImageAnnotator(QMainWindow):
                 return
             
         if hasattr(self, 'current_project_file'):
-            self.save_project(show_message=False)
-            print("Project auto-saved.")
+            # Auto-saves are journaled; callers mark other changed images before calling this.
+            # Requests arriving in quick succession are combined into one journal append.
+            self.mark_image_dirty()
+            self.set_project_modified(True)
+            self.save_status_label.setText("Unsaved changes")
+            self.auto_save_timer.start()
+
+    def flush_pending_saves(self):
+        """Write pending changes now and wait until the saver thread is idle."""
+        if self.auto_save_timer.isActive() or self.dirty_images:
+            self.auto_save_timer.stop()
+            self.save_project_changes()
+        return self.project_saver.flush()
+
+    def on_project_saving(self, path):
+        self.save_status_label.setText("Saving...")
+
+    def on_project_saved(self, path):
+        if not self.project_saver.pending() and not self.auto_save_timer.isActive():
+            self.save_status_label.setText(f"Saved {datetime.now().strftime('%H:%M:%S')}")
+            if not self.full_save_needed:
+                self.set_project_modified(False)
+
+    def on_project_save_failed(self, message):
+        self.save_status_label.setText("Save failed")
+        self.statusBar().showMessage(f"Save failed: {message}", 10000)
 
     def show_project_details(self):
         if not hasattr(self, 'current_project_file'):
@@ -766,7 +1147,6 @@ class ImageAnnotator(QMainWindow):
         print(f"Number of slices: {len(self.slices)}")
     
         if self.slices:
-            self.current_image = self.slices[0][1]
             self.current_slice = self.slices[0][0]
             
             self.update_slice_list()
@@ -893,7 +1273,8 @@ class ImageAnnotator(QMainWindow):
             print("SAM prediction accepted and added to annotations.")
     
     def setup_slice_list(self):
-        self.slice_list = QListWidget()
+        self.slice_list = NameListView(NameListModel(lambda name: self.all_annotations.has_annotations(name)))
+        self.slice_list.set_dark_mode(self.dark_mode)
         self.slice_list.itemClicked.connect(self.switch_slice)
         self.image_list_layout.addWidget(QLabel("Slices:"))
         self.image_list_layout.addWidget(self.slice_list)
@@ -923,24 +1304,6 @@ class ImageAnnotator(QMainWindow):
             self.add_images_to_list(file_names)
             
             
-    def convert_to_8bit_rgb(self, image_array):
-        if image_array.ndim == 2:
-            # Grayscale image
-            image_8bit = self.normalize_array(image_array)
-            return np.stack((image_8bit,) * 3, axis=-1)
-        elif image_array.ndim == 3:
-            if image_array.shape[2] == 3:
-                # Already RGB, just normalize
-                return self.normalize_array(image_array)
-            elif image_array.shape[2] > 3:
-                # Multi-channel image, use first three channels
-                rgb_array = image_array[:, :, :3]
-                return self.normalize_array(rgb_array)
-        
-        raise ValueError(f"Unsupported image shape: {image_array.shape}")
-            
-                
-        
     def add_images_to_list(self, file_names):
         first_added_item = None
         for file_name in file_names:
@@ -966,16 +1329,15 @@ class ImageAnnotator(QMainWindow):
                         image_info["dimensions"] = self.image_dimensions.get(base_name_without_ext, [])
                         image_info["shape"] = self.image_shapes.get(base_name_without_ext, [])
                 else:
-                    # For regular images
-                    image = QImage(file_name)
-                    image_info["height"] = image.height()
-                    image_info["width"] = image.width()
+                    # For regular images; the size comes from the header, the pixels are decoded when shown
+                    size = QImageReader(file_name).size()
+                    image_info["height"] = size.height()
+                    image_info["width"] = size.width()
                 
                 self.all_images.append(image_info)
-                item = QListWidgetItem(base_name)
-                self.image_list.addItem(item)
+                self.image_list.addItem(base_name)
                 if first_added_item is None:
-                    first_added_item = item
+                    first_added_item = self.image_list.item_named(base_name)
                 
                 # Update image_paths with the original file path
                 self.image_paths[base_name] = file_name
@@ -1013,6 +1375,12 @@ class ImageAnnotator(QMainWindow):
                 return
     
         # Perform any other cleanup or saving operations here
+        self.flush_pending_saves()
+        self.project_saver.stop()
+        self.slice_prefetcher.stop()
+        self.image_label.pyramid_builder.stop()
+        for slices in self.image_slices.values():
+            close_slices(slices)
         event.accept()
 
             
@@ -1042,18 +1410,19 @@ class ImageAnnotator(QMainWindow):
         self.image_label.clear_temp_sam_prediction()
     
         slice_name = item.text()
-        for name, qimage in self.slices:
+        for name, slice_image in self.slices:
             if name == slice_name:
-                self.current_image = qimage
+                self.current_image = materialize_slice(slice_image)
                 self.current_slice = name
                 self.display_image()
                 self.load_image_annotations()
                 self.update_annotation_list()
                 self.clear_highlighted_annotation()
-                self.image_label.highlighted_annotations.clear()  # Add this line
+                self.image_label.set_highlighted_annotations()
                 self.image_label.reset_annotation_state()
                 self.image_label.clear_current_annotation()
                 self.update_image_info()
+                self.prefetch_neighbouring_slices()
                 break
     
         # Ensure the UI is updated
@@ -1081,6 +1450,9 @@ class ImageAnnotator(QMainWindow):
         self.save_current_annotations()
         self.image_label.clear_temp_sam_prediction()
         self.image_label.exit_editing_mode()
+        
+        # Slices queued for the previous image are no longer needed
+        self.slice_prefetcher.cancel()
     
         file_name = item.text()
         print(f"\nSwitching to image: {file_name}")
@@ -1100,7 +1472,6 @@ class ImageAnnotator(QMainWindow):
                     if base_name in self.image_slices:
                         self.slices = self.image_slices[base_name]
                         if self.slices:
-                            self.current_image = self.slices[0][1]
                             self.current_slice = self.slices[0][0]
                             self.update_slice_list()
                             self.activate_slice(self.current_slice)
@@ -1115,7 +1486,7 @@ class ImageAnnotator(QMainWindow):
                 self.update_annotation_list()
                 self.clear_highlighted_annotation()
                 
-                self.image_label.highlighted_annotations.clear()  
+                self.image_label.set_highlighted_annotations()
                 self.image_label.update()
                 self.image_label.reset_annotation_state()
                 self.image_label.clear_current_annotation()
@@ -1142,9 +1513,7 @@ class ImageAnnotator(QMainWindow):
     def activate_current_slice(self):
         if self.current_slice:
             # Ensure the current slice is selected in the slice list
-            items = self.slice_list.findItems(self.current_slice, Qt.MatchExactly)
-            if items:
-                self.slice_list.setCurrentItem(items[0])
+            self.slice_list.setCurrentItem(self.slice_list.item_named(self.current_slice))
             
             # Load annotations for the current slice
             self.load_image_annotations()
@@ -1178,18 +1547,12 @@ class ImageAnnotator(QMainWindow):
             except KeyError:
                 print("No ImageDescription metadata found")
             
-            # Check if it's a multi-page TIFF
-            if len(tif.pages) > 1:
-                print(f"Multi-page TIFF detected. Number of pages: {len(tif.pages)}")
-                # Read all pages into a 3D array
-                image_array = tif.asarray()
-            else:
-                print("Single-page TIFF detected.")
-                image_array = tif.pages[0].asarray()
-            
-            print(f"Image array shape: {image_array.shape}")
-            print(f"Image array dtype: {image_array.dtype}")
-            print(f"Image min: {image_array.min()}, max: {image_array.max()}")
+            print(f"Number of pages: {len(tif.pages)}")
+        
+        # Memory-mapped or page-level view; pixels are read only when a slice is rendered
+        image_array = open_tiff_stack(image_path)
+        print(f"Image array shape: {image_array.shape}")
+        print(f"Image array dtype: {image_array.dtype}")
     
         if dimensions and shape and not force_dimension_dialog:
             # Use stored dimensions and shape
@@ -1205,13 +1568,10 @@ class ImageAnnotator(QMainWindow):
     
     def load_czi(self, image_path, dimensions=None, shape=None, force_dimension_dialog=False):
         print(f"Loading CZI file: {image_path}")
-        with CziFile(image_path) as czi:
-            image_array = czi.asarray()
-            print(f"CZI array shape: {image_array.shape}")
-            print(f"CZI array dtype: {image_array.dtype}")
-            print(f"CZI array min: {image_array.min()}, max: {image_array.max()}")
-            
-
+        # Subblock-level view; only the subblocks of a rendered slice are decoded
+        image_array = open_czi_stack(image_path)
+        print(f"CZI array shape: {image_array.shape}")
+        print(f"CZI array dtype: {image_array.dtype}")
     
         if dimensions and shape and not force_dimension_dialog:
             # Use stored dimensions and shape
@@ -1280,13 +1640,12 @@ class ImageAnnotator(QMainWindow):
         if self.image_dimensions[base_name]:
             self.create_slices(image_array, self.image_dimensions[base_name], image_path)
         else:
-            rgb_image = self.convert_to_8bit_rgb(image_array)
-            self.current_image = self.array_to_qimage(rgb_image)
+            self.current_image = normalize_to_qimage(np.asarray(image_array))
             self.slices = []
             self.slice_list.clear()
     
         if self.slices:
-            self.current_image = self.slices[0][1]
+            # The first slice was already rendered by activate_slice in create_slices
             self.current_slice = self.slices[0][0]
             self.slice_list.setCurrentRow(0)
             self.load_image_annotations()
@@ -1302,61 +1661,26 @@ class ImageAnnotator(QMainWindow):
     
     def create_slices(self, image_array, dimensions, image_path):
         base_name = os.path.splitext(os.path.basename(image_path))[0]
-        slices = []
         self.slice_list.clear()
     
         print(f"Creating slices for {base_name}")
         print(f"Dimensions: {dimensions}")
         print(f"Image array shape: {image_array.shape}")
     
-        # Create and show progress dialog
-        progress = QProgressDialog("Loading slices...", "Cancel", 0, 100, self)
-        progress.setWindowModality(Qt.WindowModal)
-        progress.setMinimumDuration(0)  # Show immediately
-    
-        # Handle 2D images
-        if image_array.ndim == 2:
-            progress.setValue(50)  # Update progress
-            QApplication.processEvents()  # Allow GUI to update
-            normalized_array = self.normalize_array(image_array)
-            qimage = self.array_to_qimage(normalized_array)
-            slice_name = f"{base_name}"
-            slices.append((slice_name, qimage))
-            self.add_slice_to_list(slice_name)
-        else:
-            # For 3D or higher dimensional arrays
-            slice_indices = [i for i, dim in enumerate(dimensions) if dim not in ['H', 'W']]
-    
-            total_slices = np.prod([image_array.shape[i] for i in slice_indices])
-            for idx, _ in enumerate(np.ndindex(tuple(image_array.shape[i] for i in slice_indices))):
-                if progress.wasCanceled():
-                    break
-    
-                full_idx = [slice(None)] * len(dimensions)
-                for i, val in zip(slice_indices, _):
-                    full_idx[i] = val
-                
-                slice_array = image_array[tuple(full_idx)]
-                rgb_slice = self.convert_to_8bit_rgb(slice_array)
-                qimage = self.array_to_qimage(rgb_slice)
-                
-                slice_name = f"{base_name}_{'_'.join([f'{dimensions[i]}{val+1}' for i, val in zip(slice_indices, _)])}"
-                slices.append((slice_name, qimage))
-                
-                self.add_slice_to_list(slice_name)
-    
-                # Update progress
-                progress_value = int((idx + 1) / total_slices * 100)
-                progress.setValue(progress_value)
-                QApplication.processEvents()  # Allow GUI to update
+        slices = self.build_slice_stack(base_name, image_array, dimensions)
+        
+        # A new stack is opening: slices rendered for other stacks are evicted
+        self.slice_cache.evict_stacks(keep=base_name)
     
-        progress.setValue(100)  # Ensure progress reaches 100%
+        self.slice_list.set_names(slice_name for slice_name, _ in slices)
     
+        if base_name in self.image_slices:
+            # Reopened, e.g. with new dimensions: the previous stack's file is not read any more
+            self.discard_image_slices(base_name)
         self.image_slices[base_name] = slices
         self.slices = slices
     
         if slices:
-            self.current_image = slices[0][1]
             self.current_slice = slices[0][0]
             self.slice_list.setCurrentRow(0)
             
@@ -1375,54 +1699,14 @@ class ImageAnnotator(QMainWindow):
 
 
 
-    def add_slice_to_list(self, slice_name):
-        item = QListWidgetItem(slice_name)
-        
-        if self.dark_mode:
-            # Dark mode
-            item.setBackground(QColor(40, 40, 40))  # Very dark gray background for all items
-            if slice_name in self.all_annotations:
-                item.setForeground(QColor(60, 60, 60))  # Dark gray text
-                item.setBackground(QColor(173, 216, 230))  # Light blue background
-            else:
-                item.setForeground(QColor(200, 200, 200))  # Light gray text
-        else:
-            # Light mode
-            item.setBackground(QColor(240, 240, 240))  # Very light gray background for all items
-            if slice_name in self.all_annotations:
-                item.setForeground(QColor(255, 255, 255))  # White text
-                item.setBackground(QColor(70, 130, 180))  # Medium-dark blue background
-            else:
-                item.setForeground(QColor(0, 0, 0))  # Black text
-        
-        self.slice_list.addItem(item)
-
+    def build_slice_stack(self, base_name, image_array, dimensions):
+        # Slices are only described here; pixels are produced when a slice is shown or exported
+        normalizer = SliceNormalizer(self.contrast_mode)
+        stack = SliceStack(base_name, image_array, dimensions, normalizer,
+                           cache=self.slice_cache, display_settings=normalizer.display_settings())
+        normalizer.bind(stack)
+        return stack.slices()
 
-
-
-    
-    def normalize_array(self, array):
-       # print(f"Normalizing array. Shape: {array.shape}, dtype: {array.dtype}")
-       # print(f"Array min: {array.min()}, max: {array.max()}, mean: {array.mean()}")
-        
-        array_float = array.astype(np.float32)
-        
-        if array.dtype == np.uint16:
-            array_normalized = (array_float - array.min()) / (array.max() - array.min())
-        elif array.dtype == np.uint8:
-            # For 8-bit images, use a simple contrast stretching
-            p_low, p_high = np.percentile(array_float, (0, 100)) #Change these to 1, 99 or something to stretch the contrast for visualizing 8 bit images
-            array_normalized = np.clip(array_float, p_low, p_high)
-            array_normalized = (array_normalized - p_low) / (p_high - p_low)
-        else:
-            array_normalized = (array_float - array.min()) / (array.max() - array.min())
-        
-        # Apply gamma correction
-        gamma = 1.0  # Adjust this value to fine-tune brightness (> 1 for darker, < 1 for brighter)
-        array_normalized = np.power(array_normalized, gamma)
-        
-        return (array_normalized * 255).astype(np.uint8)
-            
     def adjust_contrast(self, image, low_percentile=1, high_percentile=99):
         if image.dtype != np.uint8:
             p_low, p_high = np.percentile(image, (low_percentile, high_percentile))
@@ -1439,45 +1723,71 @@ class ImageAnnotator(QMainWindow):
         self.load_image_annotations()
         self.update_annotation_list()
         
-        for name, qimage in self.slices:
+        for name, slice_image in self.slices:
             if name == slice_name:
-                self.current_image = qimage
+                self.current_image = materialize_slice(slice_image)
                 self.display_image()
                 break
+        self.prefetch_neighbouring_slices()
         
         self.image_label.update()
         
-        items = self.slice_list.findItems(slice_name, Qt.MatchExactly)
-        if items:
-            self.slice_list.setCurrentItem(items[0])
+        self.slice_list.setCurrentItem(self.slice_list.item_named(slice_name))
 
     
-    def array_to_qimage(self, array):
-        if array.ndim == 2:
-            height, width = array.shape
-            return QImage(array.data, width, height, width, QImage.Format_Grayscale8)
-        elif array.ndim == 3 and array.shape[2] == 3:
-            height, width, _ = array.shape
-            bytes_per_line = 3 * width
-            return QImage(array.data, width, height, bytes_per_line, QImage.Format_RGB888)
+    def prefetch_neighbouring_slices(self):
+        if not self.slices or not self.current_slice:
+            return
+        position = next((i for i, (name, _) in enumerate(self.slices) if name == self.current_slice), None)
+        if position is not None:
+            self.slice_prefetcher.prefetch(self.slices, position, self.slice_prefetch_radius)
+
+    def toggle_stack_contrast(self, checked):
+        self.contrast_mode = CONTRAST_PER_STACK if checked else CONTRAST_PER_SLICE
+        self.settings.setValue("contrast_mode", self.contrast_mode)
+    
+        # Re-render the open stacks with the new contrast; the cache key changes with the mode
+        stacks = {id(slice_image.stack): slice_image.stack
+                  for slices in self.image_slices.values()
+                  for _, slice_image in slices if isinstance(slice_image, LazySlice)}
+        for stack in stacks.values():
+            normalizer = SliceNormalizer(self.contrast_mode).bind(stack)
+            stack.set_converter(normalizer, normalizer.display_settings())
+        if self.current_slice:
+            for name, slice_image in self.slices:
+                if name == self.current_slice:
+                    self.current_image = materialize_slice(slice_image)
+                    self.display_image()
+                    break
+            self.prefetch_neighbouring_slices()
+
+    def toggle_paint_stats(self, checked):
+        self.image_label.show_paint_stats = checked
+        self.image_label.paint_times.clear()
+        if checked:
+            self.image_label.update()
         else:
-            raise ValueError(f"Unsupported array shape {array.shape} for conversion to QImage")
+            self.statusBar().clearMessage()
+
+    def show_paint_stats(self, text):
+        self.statusBar().showMessage(text)
+
+    def set_slice_cache_budget(self):
+        current_mb = self.slice_cache.budget_bytes // (1024 * 1024)
+        budget_mb, ok = QInputDialog.getInt(self, "Slice Cache Size",
+                                            "Memory budget for rendered slices (MB):",
+                                            current_mb, 16, 65536, 64)
+        if ok:
+            self.slice_cache.set_budget(budget_mb * 1024 * 1024)
+            self.settings.setValue("slice_cache_budget_mb", budget_mb)
+            self.update_image_info()
 
     def update_slice_list(self):
-        self.slice_list.clear()
-        for slice_name, _ in self.slices:
-            item = QListWidgetItem(slice_name)
-            if slice_name in self.all_annotations:
-                item.setForeground(QColor(Qt.green))
-            else:
-                item.setForeground(QColor(Qt.black) if not self.dark_mode else QColor(Qt.white))
-            self.slice_list.addItem(item)
+        self.slice_list.set_names(slice_name for slice_name, _ in self.slices)
         
         # Select the current slice
         if self.current_slice:
-            items = self.slice_list.findItems(self.current_slice, Qt.MatchExactly)
-            if items:
-                self.slice_list.setCurrentItem(items[0])
+            self.slice_list.setCurrentItem(self.slice_list.item_named(self.current_slice))
                 
     def clear_slice_list(self):
         self.slice_list.clear()
@@ -1500,7 +1810,7 @@ class ImageAnnotator(QMainWindow):
             # Handle deletions
             if self.class_list.hasFocus() and self.class_list.currentItem():
                 self.delete_class(self.class_list.currentItem())
-            elif self.annotation_list.hasFocus() and self.annotation_list.selectedItems():
+            elif self.annotation_list.hasFocus() and self.annotation_list.selected_annotations():
                 self.delete_selected_annotations()
             elif self.image_list.hasFocus() and self.image_list.currentItem():
                 self.delete_selected_image()
@@ -1624,13 +1934,13 @@ class ImageAnnotator(QMainWindow):
                                         "Import cancelled. Please ensure all images are in the 'images' directory and try again.")
                 return
     
-        # Update annotations (only for found images)
+        # Update annotations (only for found images); each image is packed once it is complete
         for image_name, annotations in imported_annotations.items():
             if image_name not in self.image_paths:
                 continue
-            self.all_annotations[image_name] = {}
+            image_annotations = {}
             for category_name, category_annotations in annotations.items():
-                self.all_annotations[image_name][category_name] = []
+                image_annotations[category_name] = []
                 for i, ann in enumerate(category_annotations, start=1):
                     new_ann = {
                         "segmentation": ann.get("segmentation"),
@@ -1640,15 +1950,15 @@ class ImageAnnotator(QMainWindow):
                         "number": i,
                         "type": ann.get("type", "polygon")
                     }
-                    self.all_annotations[image_name][category_name].append(new_ann)
+                    image_annotations[category_name].append(new_ann)
+            self.all_annotations.load(image_name, image_annotations)
     
         # Update class mapping and colors
-        for annotations in self.all_annotations.values():
-            for category_name in annotations.keys():
-                if category_name not in self.class_mapping:
-                    new_id = len(self.class_mapping) + 1
-                    self.class_mapping[category_name] = new_id
-                    self.image_label.class_colors[category_name] = QColor(Qt.GlobalColor(new_id % 16 + 7))
+        for category_name in self.all_annotations.class_names():
+            if category_name not in self.class_mapping:
+                new_id = len(self.class_mapping) + 1
+                self.class_mapping[category_name] = new_id
+                self.image_label.class_colors[category_name] = QColor(Qt.GlobalColor(new_id % 16 + 7))
     
         print("Updating UI")
         # Update UI
@@ -1675,6 +1985,7 @@ class ImageAnnotator(QMainWindow):
     
         print("Import complete, showing message")
         QMessageBox.information(self, "Import Complete", message)
+        self.mark_all_annotations_dirty()
         self.auto_save()  # Auto-save after importing annotations
         
     
@@ -1702,6 +2013,7 @@ class ImageAnnotator(QMainWindow):
             return
     
         self.save_current_annotations()
+        self.ensure_stacks_loaded()
     
         if export_format == "COCO JSON":
             output_dir = os.path.dirname(file_name)
@@ -1752,10 +2064,11 @@ class ImageAnnotator(QMainWindow):
     
 
     def save_slices(self, directory):
+        self.ensure_stacks_loaded()
         slices_saved = False
         for image_file, image_slices in self.image_slices.items():
             for slice_name, qimage in image_slices:
-                if slice_name in self.all_annotations and self.all_annotations[slice_name]:
+                if self.all_annotations.has_annotations(slice_name):
                     file_path = os.path.join(directory, f"{slice_name}.png")
                     qimage.save(file_path, "PNG")
                     slices_saved = True
@@ -1780,72 +2093,61 @@ class ImageAnnotator(QMainWindow):
         
         return coco_ann
 
-    def update_all_annotation_lists(self):
-        for image_name in self.all_annotations.keys():
-            self.update_annotation_list(image_name)
-        self.update_annotation_list()  # Update for the current image/slice
-    
+    def on_annotations_committed(self, changed):
+        """Refresh the UI and save once after a batch of annotation changes (see AnnotationStore.batch)."""
+        current_name = self.current_slice or self.image_file_name
+        if current_name in changed:
+            # Reload the image being edited; its class lists are shared with the store, as after a save
+            current = self.all_annotations[current_name] if current_name in self.all_annotations else {}
+            self.image_label.annotations = dict(current)
+        self.update_annotation_list()
+        self.image_label.set_highlighted_annotations()
+        self.slice_list.model().refresh(changed)
+        self.image_label.update()
+        if changed - {current_name}:
+            self.mark_all_annotations_dirty()
+        self.auto_save()
+        self.annotation_history.checkpoint(current_name, self.image_label.annotations)
+
+    @contextmanager
+    def annotation_step(self):
+        """Make the annotation changes inside one AnnotationStore batch and one undo step."""
+        with self.all_annotations.batch():
+            yield
+        # Nothing may have changed in the store (a class no annotation used): close the step anyway
+        if self.annotation_history.needs_checkpoint():
+            self.annotation_history.checkpoint(self.current_slice or self.image_file_name, self.image_label.annotations)
+
     def update_annotation_list(self, image_name=None):
-        self.annotation_list.clear()
-        current_name = image_name or self.current_slice or self.image_file_name
-        annotations = self.all_annotations.get(current_name, {})
-        for class_name, class_annotations in annotations.items():
-            if not class_name.startswith("Temp-"):  # Only show non-temporary annotations
-                color = self.image_label.class_colors.get(class_name, QColor(Qt.white))
-                for annotation in class_annotations:
-                    number = annotation.get('number', 0)
-                    area = calculate_area(annotation)
-                    item_text = f"{class_name} - {number:<3} Area: {area:.2f}"
-                    item = QListWidgetItem(item_text)
-                    item.setData(Qt.UserRole, annotation)
-                    item.setForeground(color)
-                    self.annotation_list.addItem(item)
-        
-        # Force the annotation list to repaint
-        self.annotation_list.repaint()
+        # Annotations were committed or reloaded: hit-testing rebuilds its index on next use
+        self.image_label.spatial_index.mark_dirty()
+        current_name = self.current_slice or self.image_file_name
+        if image_name and image_name != current_name:
+            annotations = self.all_annotations.peek(image_name, {})
+        else:
+            # Rows are the dicts being edited, so the list and the image agree on identity
+            annotations = self.image_label.annotations
+            # Selection and removal go by ID, so new annotations get theirs before they are listed
+            self.all_annotations.assign_ids(annotations)
+        self.annotation_model.set_annotations(
+            [annotation for class_annotations in annotations.values() for annotation in class_annotations])
                     
     
     
     def update_slice_list_colors(self):
-        # Set the background color of the entire list widget
-        if self.dark_mode:
-            self.slice_list.setStyleSheet("QListWidget { background-color: rgb(40, 40, 40); }")
-        else:
-            self.slice_list.setStyleSheet("QListWidget { background-color: rgb(240, 240, 240); }")
-    
-        for i in range(self.slice_list.count()):
-            item = self.slice_list.item(i)
-            slice_name = item.text()
-            
-            if self.dark_mode:
-                # Dark mode
-                if slice_name in self.all_annotations and any(self.all_annotations[slice_name].values()):
-                    item.setForeground(QColor(60, 60, 60))  # Dark gray text
-                    item.setBackground(QColor(173, 216, 230))  # Light blue background
-                else:
-                    item.setForeground(QColor(200, 200, 200))  # Light gray text
-                    item.setBackground(QColor(40, 40, 40))  # Very dark gray background
-            else:
-                # Light mode
-                if slice_name in self.all_annotations and any(self.all_annotations[slice_name].values()):
-                    item.setForeground(QColor(255, 255, 255))  # White text
-                    item.setBackground(QColor(70, 130, 180))  # Medium-dark blue background
-                else:
-                    item.setForeground(QColor(0, 0, 0))  # Black text
-                    item.setBackground(QColor(240, 240, 240))  # Very light gray background
-    
-        # Force the list to repaint
-        self.slice_list.repaint()
-                
+        """Recolour the slice row of the image on screen, if whether it has annotations changed."""
+        current_name = self.current_slice or self.image_file_name
+        if current_name:
+            self.slice_list.model().refresh([current_name])
+
+    def refresh_slice_list_colors(self):
+        """Recolour every slice row, after a theme change or a change to annotations of other slices."""
+        self.slice_list.set_dark_mode(self.dark_mode)
+        self.slice_list.model().refresh()
 
     def update_annotation_list_colors(self, class_name=None, color=None):
-        for i in range(self.annotation_list.count()):
-            item = self.annotation_list.item(i)
-            annotation = item.data(Qt.UserRole)
-            # Update only the item for the specific class if class_name is provided
-            if class_name is None or annotation['category_name'] == class_name:
-                item_color = color if class_name else self.image_label.class_colors.get(annotation['category_name'], QColor(Qt.white))
-                item.setForeground(item_color)
+        # Row colours are read from the class colours when painted
+        self.annotation_model.colors_changed()
 
     def load_image_annotations(self):
         #print(f"Loading annotations for: {self.current_slice or self.image_file_name}")
@@ -1853,11 +2155,17 @@ class ImageAnnotator(QMainWindow):
         current_name = self.current_slice or self.image_file_name
         #print(f"Current name for annotations: {current_name}")
         #print(f"All annotations keys: {list(self.all_annotations.keys())}")
+        if current_name and current_name not in self.saved_digests:
+            # Baseline for detecting changes; images can only be edited while shown
+            self.saved_digests[current_name] = annotations_digest(self.all_annotations.peek(current_name, {}))
         if current_name in self.all_annotations:
-            self.image_label.annotations = copy.deepcopy(self.all_annotations[current_name])
+            self.image_label.annotations = self.all_annotations.copy_of(current_name)
             #print(f"Loaded annotations: {self.image_label.annotations}")
         else:
             print(f"No annotations found for {current_name}")
+        # Only the image on screen is kept as dicts
+        self.all_annotations.pack(keep=(current_name,))
+        self.annotation_history.set_baseline(current_name, self.image_label.annotations)
         self.image_label.update()
 
     def save_current_annotations(self):
@@ -1870,6 +2178,7 @@ class ImageAnnotator(QMainWindow):
             return
     
         #print(f"Saving annotations for: {current_name}")
+        self.mark_image_dirty(current_name)
         if self.image_label.annotations:
             self.all_annotations[current_name] = self.image_label.annotations.copy()
             #print(f"Saved {len(self.image_label.annotations)} annotations for {current_name}")
@@ -1877,6 +2186,9 @@ class ImageAnnotator(QMainWindow):
             del self.all_annotations[current_name]
             #print(f"Removed annotations for {current_name}")
     
+        # Inside a batch the step is closed when the batch ends
+        if not self.all_annotations.in_batch():
+            self.annotation_history.checkpoint(current_name, self.image_label.annotations)
         self.update_slice_list_colors()
     
         #print(f"All annotations now: {self.all_annotations.keys()}")
@@ -1951,10 +2263,10 @@ class ImageAnnotator(QMainWindow):
             button.setFixedSize(100, 30)  
 
     def setup_annotation_list(self):
-        """Set up the annotation list widget."""
-        self.annotation_list = QListWidget()
-        self.annotation_list.setSelectionMode(QAbstractItemView.ExtendedSelection)
-        self.annotation_list.itemSelectionChanged.connect(self.update_highlighted_annotations)
+        """Set up the annotation list view and its model."""
+        self.annotation_model = AnnotationListModel(self.image_label.class_colors, self)
+        self.annotation_list = AnnotationListView(self.annotation_model)
+        self.annotation_list.selection_changed.connect(self.update_highlighted_annotations)
         
         
             
@@ -1990,6 +2302,10 @@ class ImageAnnotator(QMainWindow):
         close_project_action.triggered.connect(self.close_project)
         project_menu.addAction(close_project_action)
         
+        restore_backup_action = QAction("&Restore from Backup...", self)
+        restore_backup_action.triggered.connect(self.restore_from_backup)
+        project_menu.addAction(restore_backup_action)
+        
 
         project_details_action = QAction("Project &Details", self)
         project_details_action.setShortcut(QKeySequence("Ctrl+I"))
@@ -2000,6 +2316,19 @@ class ImageAnnotator(QMainWindow):
         search_projects_action.setShortcut(QKeySequence("Ctrl+F"))
         search_projects_action.triggered.connect(self.show_project_search)
         project_menu.addAction(search_projects_action)
+        
+        # Edit Menu
+        edit_menu = menu_bar.addMenu("&Edit")
+        
+        undo_action = QAction("&Undo", self)
+        undo_action.setShortcut(QKeySequence.Undo)
+        undo_action.triggered.connect(self.undo)
+        edit_menu.addAction(undo_action)
+        
+        redo_action = QAction("&Redo", self)
+        redo_action.setShortcut(QKeySequence.Redo)
+        redo_action.triggered.connect(self.redo)
+        edit_menu.addAction(redo_action)
             
         # Settings Menu
         settings_menu = menu_bar.addMenu("&Settings")
@@ -2015,6 +2344,29 @@ class ImageAnnotator(QMainWindow):
         toggle_dark_mode_action.triggered.connect(self.toggle_dark_mode)
         settings_menu.addAction(toggle_dark_mode_action)
         
+        backup_retention_action = QAction("&Backup Retention...", self)
+        backup_retention_action.triggered.connect(self.set_backup_retention)
+        settings_menu.addAction(backup_retention_action)
+        
+        slice_cache_action = QAction("Slice &Cache Size...", self)
+        slice_cache_action.triggered.connect(self.set_slice_cache_budget)
+        settings_menu.addAction(slice_cache_action)
+        
+        undo_budget_action = QAction("&Undo Memory...", self)
+        undo_budget_action.triggered.connect(self.set_undo_budget)
+        settings_menu.addAction(undo_budget_action)
+        
+        paint_stats_action = QAction("Show &Paint Timing", self)
+        paint_stats_action.setCheckable(True)
+        paint_stats_action.toggled.connect(self.toggle_paint_stats)
+        settings_menu.addAction(paint_stats_action)
+        
+        stack_contrast_action = QAction("Stack-Wide &Contrast", self)
+        stack_contrast_action.setCheckable(True)
+        stack_contrast_action.setChecked(self.contrast_mode == CONTRAST_PER_STACK)
+        stack_contrast_action.toggled.connect(self.toggle_stack_contrast)
+        settings_menu.addAction(stack_contrast_action)
+        
         # Tools Menu
         tools_menu = menu_bar.addMenu("&Tools")
         
@@ -2178,9 +2530,7 @@ class ImageAnnotator(QMainWindow):
     
         # Annotations list subsection
         annotation_layout.addWidget(QLabel("Annotations"))
-        self.annotation_list = QListWidget()
-        self.annotation_list.setSelectionMode(QAbstractItemView.ExtendedSelection)
-        self.annotation_list.itemSelectionChanged.connect(self.update_highlighted_annotations)
+        self.setup_annotation_list()
         annotation_layout.addWidget(self.annotation_list)
         
         # Create a horizontal layout for the sort buttons
@@ -2241,7 +2591,7 @@ class ImageAnnotator(QMainWindow):
             QMessageBox.information(self, "No Annotations", "There are no annotations to sort for this image.")
             return
     
-        annotations = self.all_annotations[current_name]
+        annotations = self.image_label.annotations
         sorted_annotations = []
         for class_name in sorted(annotations.keys()):
             if not class_name.startswith("Temp-"):  # Skip temporary classes
@@ -2256,7 +2606,7 @@ class ImageAnnotator(QMainWindow):
             QMessageBox.information(self, "No Annotations", "There are no annotations to sort for this image.")
             return
     
-        annotations = self.all_annotations[current_name]
+        annotations = self.image_label.annotations
         sorted_annotations = []
         for class_name in annotations.keys():
             if not class_name.startswith("Temp-"):  # Skip temporary classes
@@ -2266,19 +2616,7 @@ class ImageAnnotator(QMainWindow):
         self.update_annotation_list_with_sorted(sorted_annotations)
 
     def update_annotation_list_with_sorted(self, sorted_annotations):
-        self.annotation_list.clear()
-        for annotation in sorted_annotations:
-            class_name = annotation['category_name']
-            if not class_name.startswith("Temp-"):  # Only add non-temporary annotations
-                number = annotation.get('number', 0)
-                area = calculate_area(annotation)
-                item_text = f"{class_name} - {number:<3} Area: {area:.2f}"
-                item = QListWidgetItem(item_text)
-                item.setData(Qt.UserRole, annotation)
-                color = self.image_label.class_colors.get(class_name, QColor(Qt.white))
-                item.setForeground(color)
-                self.annotation_list.addItem(item)
-    
+        self.annotation_model.set_annotations(sorted_annotations)
         self.image_label.update()
     
         
@@ -2345,7 +2683,7 @@ class ImageAnnotator(QMainWindow):
         self.apply_theme_and_font()
         
         # Update slice list colors
-        self.update_slice_list_colors()
+        self.refresh_slice_list_colors()
         
         # Update other UI elements if necessary
         self.update_class_list()
@@ -2363,7 +2701,7 @@ class ImageAnnotator(QMainWindow):
     def update_ui_colors(self):
         # Update colors for elements that need to retain their functionality
         self.update_annotation_list_colors()
-        self.update_slice_list_colors()
+        self.refresh_slice_list_colors()
         self.image_label.update()
         
     def setup_image_area(self):
@@ -2404,7 +2742,7 @@ class ImageAnnotator(QMainWindow):
         self.image_list_label = QLabel("Images:")
         self.image_list_layout.addWidget(self.image_list_label)
 
-        self.image_list = QListWidget()
+        self.image_list = NameListView(NameListModel())
         self.image_list.itemClicked.connect(self.switch_image)
         self.image_list.setContextMenuPolicy(Qt.CustomContextMenu)
         self.image_list.customContextMenuRequested.connect(self.show_image_context_menu)
@@ -2481,6 +2819,7 @@ class ImageAnnotator(QMainWindow):
         # Clear images
         self.image_list.clear()
         self.image_paths.clear()
+        self.image_hashes = {}
         self.all_images.clear()
         self.current_image = None
         self.image_file_name = ""
@@ -2490,12 +2829,17 @@ class ImageAnnotator(QMainWindow):
         self.image_label.setPixmap(QPixmap())  # Set an empty pixmap
         self.image_label.original_pixmap = None
         self.image_label.scaled_pixmap = None
+        self.image_label.pyramid = None
+        self.image_label.pending_pyramid = None
+        self.image_label.display_size = None
     
         # Clear annotations
         self.all_annotations.clear()
+        self.annotation_history.clear()
+        self.reset_save_state()
         self.annotation_list.clear()
         self.image_label.annotations.clear()
-        self.image_label.highlighted_annotations.clear()
+        self.image_label.set_highlighted_annotations()
     
         # Clear current class
         self.current_class = None
@@ -2506,7 +2850,11 @@ class ImageAnnotator(QMainWindow):
         self.class_mapping.clear()
     
         # Clear slices
+        self.slice_prefetcher.cancel()
+        for slices in self.image_slices.values():
+            close_slices(slices)
         self.image_slices.clear()
+        self.slice_cache.clear()
         self.slices = []
         self.slice_list.clear()
         self.current_slice = None
@@ -2564,6 +2912,8 @@ class ImageAnnotator(QMainWindow):
             info = f"Image: {width}x{height}"
             if additional_info:
                 info += f", {additional_info}"
+            if self.current_slice:
+                info += f" | {self.slice_cache.stats_text()}"
             self.image_info_label.setText(info)
         else:
             self.image_info_label.setText("No image loaded")
@@ -2651,7 +3001,7 @@ class ImageAnnotator(QMainWindow):
             
             # Remove existing slices
             if base_name in self.image_slices:
-                del self.image_slices[base_name]
+                self.discard_image_slices(base_name)
             
             # Clear current image if it's the one being redefined
             if self.image_file_name == file_name:
@@ -2683,6 +3033,11 @@ class ImageAnnotator(QMainWindow):
             # Remove from all data structures
             self.image_list.takeItem(self.image_list.row(current_item))
             self.image_paths.pop(file_name, None)
+            for image_info in self.all_images:
+                if image_info["file_name"] == file_name and image_info.get("is_multi_slice", False):
+                    # Stacks that were never opened only know their slices from the project
+                    for slice_name in self.slice_names(image_info):
+                        self.all_annotations.pop(slice_name, None)
             self.all_images = [img for img in self.all_images if img["file_name"] != file_name]
             
             # Remove annotations
@@ -2694,7 +3049,7 @@ class ImageAnnotator(QMainWindow):
                 # Remove slices
                 for slice_name, _ in self.image_slices[base_name]:
                     self.all_annotations.pop(slice_name, None)
-                del self.image_slices[base_name]
+                self.discard_image_slices(base_name)
                 
                 # Clear slice list
                 self.slice_list.clear()
@@ -2776,20 +3131,20 @@ class ImageAnnotator(QMainWindow):
             
             self.all_images = updated_all_images
             
-            # Load annotations
+            # Load annotations, gathered per image and then packed
             self.all_annotations.clear()
+            loaded_annotations = {}
             for annotation in self.loaded_json["annotations"]:
                 image_id = annotation["image_id"]
                 file_name = image_id_to_filename.get(image_id)
                 if file_name:
-                    if file_name not in self.all_annotations:
-                        self.all_annotations[file_name] = {}
+                    image_annotations = loaded_annotations.setdefault(file_name, {})
                     
                     category = next((cat for cat in self.loaded_json["categories"] if cat["id"] == annotation["category_id"]), None)
                     if category:
                         category_name = category["name"]
-                        if category_name not in self.all_annotations[file_name]:
-                            self.all_annotations[file_name][category_name] = []
+                        if category_name not in image_annotations:
+                            image_annotations[category_name] = []
                         
                         ann = {
                             "category_id": annotation["category_id"],
@@ -2805,9 +3160,11 @@ class ImageAnnotator(QMainWindow):
                         
                         # Add number field if it's missing
                         if "number" not in ann:
-                            ann["number"] = len(self.all_annotations[file_name][category_name]) + 1
+                            ann["number"] = len(image_annotations[category_name]) + 1
                         
-                        self.all_annotations[file_name][category_name].append(ann)
+                        image_annotations[category_name].append(ann)
+            for file_name, image_annotations in loaded_annotations.items():
+                self.all_annotations.load(file_name, image_annotations)
             
             # Check for missing images
             missing_images = [img["file_name"] for img in self.loaded_json["images"] if img["file_name"] not in self.image_paths]
@@ -2816,11 +3173,11 @@ class ImageAnnotator(QMainWindow):
             
             # Reload the current image if it exists, otherwise load the first image
             if self.image_file_name and self.image_file_name in self.all_annotations:
-                self.switch_image(self.image_list.findItems(self.image_file_name, Qt.MatchExactly)[0])
+                self.switch_image(self.image_list.item_named(self.image_file_name))
             elif self.all_images:
                 self.switch_image(self.image_list.item(0))
                 
-            self.image_label.highlighted_annotations = []  # Clear existing highlights
+            self.image_label.set_highlighted_annotations()  # Clear existing highlights
             self.update_annotation_list()  # This will repopulate the annotation list
             self.image_label.update()  # Force a redraw of the image label
 
@@ -2832,61 +3189,44 @@ class ImageAnnotator(QMainWindow):
         self.image_label.update()
         
     def update_highlighted_annotations(self):
-        selected_items = self.annotation_list.selectedItems()
-        self.image_label.highlighted_annotations = [item.data(Qt.UserRole) for item in selected_items]
+        selected_annotations = self.annotation_list.selected_annotations()
+        self.image_label.set_highlighted_annotations(selected_annotations)
         self.image_label.update()  # Force a redraw of the image label
         
         # Enable/disable merge and change class buttons based on selection
-        self.merge_button.setEnabled(len(selected_items) >= 2)
-        self.change_class_button.setEnabled(len(selected_items) > 0)
+        self.merge_button.setEnabled(len(selected_annotations) >= 2)
+        self.change_class_button.setEnabled(len(selected_annotations) > 0)
 
     def renumber_annotations(self):
         current_name = self.current_slice or self.image_file_name
-        if current_name in self.all_annotations:
-            for class_name, annotations in self.all_annotations[current_name].items():
-                for i, ann in enumerate(annotations, start=1):
-                    ann['number'] = i
-        self.update_annotation_list()
+        with self.all_annotations.batch():
+            self.all_annotations.renumber(current_name)
 
     def delete_selected_annotations(self):
-        selected_items = self.annotation_list.selectedItems()
-        if not selected_items:
+        selected_annotations = self.annotation_list.selected_annotations()
+        if not selected_annotations:
             QMessageBox.warning(self, "No Selection", "Please select an annotation to delete.")
             return
         
         reply = QMessageBox.question(self, 'Delete Annotations',
-                                     f"Are you sure you want to delete {len(selected_items)} annotation(s)?",
+                                     f"Are you sure you want to delete {len(selected_annotations)} annotation(s)?",
                                      QMessageBox.Yes | QMessageBox.No, QMessageBox.No)
         if reply == QMessageBox.Yes:
-            # Create a list of annotations to remove
-            annotations_to_remove = []
-            for item in selected_items:
-                annotation = item.data(Qt.UserRole)
-                annotations_to_remove.append((annotation['category_name'], annotation))
-            
             # Remove annotations from image_label.annotations
-            for category_name, annotation in annotations_to_remove:
-                if category_name in self.image_label.annotations:
-                    if annotation in self.image_label.annotations[category_name]:
-                        self.image_label.annotations[category_name].remove(annotation)
-            
-            # Update all_annotations
-            current_name = self.current_slice or self.image_file_name
-            self.all_annotations[current_name] = self.image_label.annotations
-            
-            # Sort and update the annotation list based on the current sorting method
-            if self.current_sort_method == "area":
-                self.sort_annotations_by_area()
-            else:
-                self.sort_annotations_by_class()
+            self.image_label.remove_annotations(selected_annotations)
             
-            self.image_label.highlighted_annotations.clear()
+            # Removing rows keeps the current sort order; the selection is dropped first so
+            # the removal does not report a selection change for every row
+            self.annotation_list.clearSelection()
+            self.annotation_model.remove(selected_annotations)
+            
+            self.image_label.set_highlighted_annotations()
             self.image_label.update()
             
-            # Update slice list colors
-            self.update_slice_list_colors()
+            # Update all_annotations (and the slice list colors)
+            self.save_current_annotations()
     
-            QMessageBox.information(self, "Annotations Deleted", f"{len(selected_items)} annotation(s) have been deleted.")  
+            QMessageBox.information(self, "Annotations Deleted", f"{len(selected_annotations)} annotation(s) have been deleted.")  
             self.auto_save()  # Auto-save after deleting annotations
 
 
@@ -2896,20 +3236,19 @@ class ImageAnnotator(QMainWindow):
                                 "Please exit the annotation edit mode before merging annotations.")
             return
     
-        selected_items = self.annotation_list.selectedItems()
-        if len(selected_items) < 2:
+        selected_annotations = self.annotation_list.selected_annotations()
+        if len(selected_annotations) < 2:
             QMessageBox.warning(self, "Not Enough Annotations", "Please select at least two annotations to merge.")
             return
     
-        class_name = selected_items[0].data(Qt.UserRole)['category_name']
-        if not all(item.data(Qt.UserRole)['category_name'] == class_name for item in selected_items):
+        class_name = selected_annotations[0]['category_name']
+        if not all(annotation['category_name'] == class_name for annotation in selected_annotations):
             QMessageBox.warning(self, "Mixed Classes", "All selected annotations must be from the same class.")
             return
     
         polygons = []
         original_annotations = []
-        for item in selected_items:
-            annotation = item.data(Qt.UserRole)
+        for annotation in selected_annotations:
             original_annotations.append(annotation)
             if 'segmentation' in annotation:
                 points = zip(annotation['segmentation'][0::2], annotation['segmentation'][1::2])
@@ -2918,29 +3257,8 @@ class ImageAnnotator(QMainWindow):
                     polygon = polygon.buffer(0)
                 polygons.append(polygon)
     
-        def are_all_polygons_connected(polygons):
-            if len(polygons) < 2:
-                return True
-            
-            connected = set([0])  # Start with the first polygon
-            to_check = set(range(1, len(polygons)))
-            
-            while to_check:
-                newly_connected = set()
-                for i in connected:
-                    for j in to_check:
-                        if polygons[i].intersects(polygons[j]) or polygons[i].touches(polygons[j]):
-                            newly_connected.add(j)
-                
-                if not newly_connected:
-                    return False  # If no new connections found, they're not all connected
-                
-                connected.update(newly_connected)
-                to_check -= newly_connected
-            
-            return True  # All polygons are connected
-    
-        if not are_all_polygons_connected(polygons):
+        # Connectivity is checked through an STRtree of the selected polygons
+        if not polygons_connected(polygons):
             QMessageBox.warning(self, "Disconnected Polygons", "Not all selected annotations are connected. Please select only connected annotations to merge.")
             return
     
@@ -2980,24 +3298,16 @@ class ImageAnnotator(QMainWindow):
         if msg_box.clickedButton() == cancel_button:
             return
     
-        if msg_box.clickedButton() == delete_button:
-            for annotation in original_annotations:
-                if annotation in self.image_label.annotations[class_name]:
-                    self.image_label.annotations[class_name].remove(annotation)
-    
-        self.image_label.annotations.setdefault(class_name, []).append(new_annotation)
+        # The lists are refreshed and the project saved once, when the step ends
+        with self.annotation_step():
+            if msg_box.clickedButton() == delete_button:
+                self.image_label.remove_annotations(original_annotations)
     
-        current_name = self.current_slice or self.image_file_name
-        self.all_annotations[current_name] = self.image_label.annotations
-    
-        self.renumber_annotations()
-        self.update_annotation_list()
-        self.save_current_annotations()
-        self.update_slice_list_colors()
-        self.image_label.update()
+            self.image_label.annotations.setdefault(class_name, []).append(new_annotation)
+            self.save_current_annotations()
+            self.renumber_annotations()
     
         QMessageBox.information(self, "Merge Complete", "Annotations have been merged successfully.")
-        self.auto_save()  # Auto-save after merging annotations
     
     
         
@@ -3014,6 +3324,11 @@ class ImageAnnotator(QMainWindow):
                 # Remove from all data structures
                 self.image_list.takeItem(self.image_list.row(current_item))
                 self.image_paths.pop(file_name, None)
+                for image_info in self.all_images:
+                    if image_info["file_name"] == file_name and image_info.get("is_multi_slice", False):
+                        # Stacks that were never opened only know their slices from the project
+                        for slice_name in self.slice_names(image_info):
+                            self.all_annotations.pop(slice_name, None)
                 self.all_images = [img for img in self.all_images if img["file_name"] != file_name]
                 
                 # Remove annotations
@@ -3025,7 +3340,7 @@ class ImageAnnotator(QMainWindow):
                     # Remove slices
                     for slice_name, _ in self.image_slices[base_name]:
                         self.all_annotations.pop(slice_name, None)
-                    del self.image_slices[base_name]
+                    self.discard_image_slices(base_name)
                     
                     # Clear slice list
                     self.slice_list.clear()
@@ -3060,16 +3375,16 @@ class ImageAnnotator(QMainWindow):
 
     def display_image(self):
         if self.current_image:
-            if isinstance(self.current_image, QImage):
-                pixmap = QPixmap.fromImage(self.current_image)
-            elif isinstance(self.current_image, QPixmap):
+            # QImages are passed through so large images can build their pyramid without a copy
+            if isinstance(self.current_image, (QImage, QPixmap)):
                 pixmap = self.current_image
             else:
                 print(f"Unexpected image type: {type(self.current_image)}")
                 return
             
             if not pixmap.isNull():
-                self.image_label.setPixmap(pixmap)
+                source = (self.image_paths.get(self.image_file_name), self.current_slice)
+                self.image_label.setPixmap(pixmap, source=source)
                 self.image_label.adjustSize()
             else:
                 print("Error: Null pixmap")
@@ -3210,8 +3525,8 @@ class ImageAnnotator(QMainWindow):
     
         
     def change_annotation_class(self):
-        selected_items = self.annotation_list.selectedItems()
-        if not selected_items:
+        selected_annotations = self.annotation_list.selected_annotations()
+        if not selected_annotations:
             QMessageBox.warning(self, "No Selection", "Please select one or more annotations to change class.")
             return
     
@@ -3231,40 +3546,23 @@ class ImageAnnotator(QMainWindow):
     
         if class_dialog.exec_() == QDialog.Accepted:
             new_class = class_combo.currentText()
-            current_name = self.current_slice or self.image_file_name
-            
-            # Get the current maximum number for the new class
-            max_number = max([ann.get('number', 0) for ann in self.image_label.annotations.get(new_class, [])] + [0])
             
-            for item in selected_items:
-                annotation = item.data(Qt.UserRole)
-                old_class = annotation['category_name']
-                
-                # Remove from old class
-                self.image_label.annotations[old_class].remove(annotation)
-                if not self.image_label.annotations[old_class]:
-                    del self.image_label.annotations[old_class]
+            with self.annotation_step():
+                # Remove from the old classes
+                self.image_label.remove_annotations(selected_annotations)
+                for old_class in {annotation['category_name'] for annotation in selected_annotations}:
+                    if not self.image_label.annotations.get(old_class):
+                        self.image_label.annotations.pop(old_class, None)
                 
-                # Add to new class with updated number
-                annotation['category_name'] = new_class
-                annotation['category_id'] = self.class_mapping[new_class]
-                max_number += 1
-                annotation['number'] = max_number
-                if new_class not in self.image_label.annotations:
-                    self.image_label.annotations[new_class] = []
-                self.image_label.annotations[new_class].append(annotation)
-    
-            # Update all_annotations
-            self.all_annotations[current_name] = self.image_label.annotations
-    
-            # Renumber all annotations for consistency
-            self.renumber_annotations()
+                # Add to the new class; numbers follow from the renumbering below
+                for annotation in selected_annotations:
+                    annotation['category_name'] = new_class
+                    annotation['category_id'] = self.class_mapping[new_class]
+                    self.image_label.annotations.setdefault(new_class, []).append(annotation)
     
-            self.update_annotation_list()
-            self.image_label.update()
-            self.save_current_annotations()
-            self.update_slice_list_colors()
-            self.auto_save()
+                # Update all_annotations and renumber all annotations for consistency
+                self.save_current_annotations()
+                self.renumber_annotations()
     
             QMessageBox.information(self, "Class Changed", f"Selected annotations have been changed to class '{new_class}'.")
 
@@ -3429,50 +3727,52 @@ class ImageAnnotator(QMainWindow):
         old_name = item.text()
         new_name, ok = QInputDialog.getText(self, "Rename Class", "Enter new class name:", text=old_name)
         if ok and new_name and new_name != old_name:
-            # Update class mapping
-            if old_name in self.class_mapping:
-                old_id = self.class_mapping[old_name]
-                self.class_mapping[new_name] = old_id
-                del self.class_mapping[old_name]
-            else:
-                print(f"Warning: Class '{old_name}' not found in class_mapping")
-                return
-    
-            # Update class colors
-            if old_name in self.image_label.class_colors:
-                self.image_label.class_colors[new_name] = self.image_label.class_colors.pop(old_name)
-            else:
-                print(f"Warning: Class '{old_name}' not found in class_colors")
-                return
-    
-            # Update annotations for all images and slices
-            for image_name, image_annotations in self.all_annotations.items():
-                if old_name in image_annotations:
-                    image_annotations[new_name] = image_annotations.pop(old_name)
-                    for annotation in image_annotations[new_name]:
-                        annotation['category_name'] = new_name
-    
-            # Update current image annotations
-            if old_name in self.image_label.annotations:
-                self.image_label.annotations[new_name] = self.image_label.annotations.pop(old_name)
-                for annotation in self.image_label.annotations[new_name]:
-                    annotation['category_name'] = new_name
-    
-            # Update current class if it's the renamed one
-            if self.current_class == old_name:
-                self.current_class = new_name
-    
-            # Update annotation list for all images and slices
-            self.update_all_annotation_lists()
+            # The annotation list and slice colours are refreshed when the step ends
+            with self.annotation_step():
+                if not self.apply_class_rename(old_name, new_name):
+                    return
+                self.annotation_history.record(ClassRename(old_name, new_name))
     
             # Update class list
             item.setText(new_name)
     
             # Update the image label
             self.image_label.update()
+            # The class list changed even if no annotation used the class; this joins the batch's save
+            self.mark_all_annotations_dirty()
             self.auto_save()  # Auto-save after renaming a class
     
             print(f"Class renamed from '{old_name}' to '{new_name}'")
+
+    def apply_class_rename(self, old_name, new_name):
+        """Rename a class in the mapping, the colours and every annotation; False if it is unknown."""
+        # Update class mapping
+        if old_name in self.class_mapping:
+            old_id = self.class_mapping[old_name]
+            self.class_mapping[new_name] = old_id
+            del self.class_mapping[old_name]
+        else:
+            print(f"Warning: Class '{old_name}' not found in class_mapping")
+            return False
+
+        # Update class colors, keeping the class in its place in the list
+        class_colors = self.image_label.class_colors
+        if old_name in class_colors:
+            renamed = [(new_name if name == old_name else name, color) for name, color in class_colors.items()]
+            class_colors.clear()
+            class_colors.update(renamed)
+        else:
+            print(f"Warning: Class '{old_name}' not found in class_colors")
+            return False
+
+        # Update current class if it's the renamed one
+        if self.current_class == old_name:
+            self.current_class = new_name
+
+        # Update annotations for all images and slices (the current one included, once saved)
+        self.save_current_annotations()
+        self.all_annotations.rename_class(old_name, new_name)
+        return True
     
     def delete_class(self, item=None):
         if item is None:
@@ -3491,22 +3791,14 @@ class ImageAnnotator(QMainWindow):
                                      QMessageBox.Yes | QMessageBox.No, QMessageBox.No)
         
         if reply == QMessageBox.Yes:
-            # Proceed with deletion
-            # Remove class color
-            self.image_label.class_colors.pop(class_name, None)
-            
-            # Remove class from mapping
-            self.class_mapping.pop(class_name, None)
-            
-            # Remove annotations for this class from all images
-            for image_annotations in self.all_annotations.values():
-                image_annotations.pop(class_name, None)
-            
-            # Remove annotations for this class from current image
-            self.image_label.annotations.pop(class_name, None)
-            
-            # Update annotation list
-            self.update_annotation_list()
+            # Proceed with deletion; what is removed is kept for undo
+            with self.annotation_step():
+                color = self.image_label.class_colors.get(class_name)
+                class_id = self.class_mapping.get(class_name)
+                self.save_current_annotations()
+                self.annotation_history.record(ClassDelete(class_name, color.name() if color else None, class_id,
+                                                           self.all_annotations.extract_class(class_name)))
+                self.apply_class_delete(class_name)
     
             # Remove class from list
             row = self.class_list.row(item)
@@ -3525,10 +3817,109 @@ class ImageAnnotator(QMainWindow):
             
             # Inform the user
             QMessageBox.information(self, "Class Deleted", f"The class '{class_name}' has been deleted.")
+            self.mark_all_annotations_dirty()
             self.auto_save()  # Auto-save after deleting a class
         else:
             # User cancelled the operation
             QMessageBox.information(self, "Deletion Cancelled", "The class deletion was cancelled.")
+
+    def apply_class_delete(self, class_name):
+        # Remove class color and mapping
+        self.image_label.class_colors.pop(class_name, None)
+        self.class_mapping.pop(class_name, None)
+
+        # Remove annotations for this class from all images (the current one included, once saved)
+        self.save_current_annotations()
+        self.all_annotations.remove_classes(lambda name: name == class_name)
+
+    def restore_deleted_class(self, change, project_names):
+        """Undo a ClassDelete: bring back the class and its annotations in every image."""
+        if change.color is not None:
+            self.image_label.class_colors[change.class_name] = QColor(change.color)
+        if change.class_id is not None:
+            self.class_mapping[change.class_name] = change.class_id
+        for name, packed in change.removed.items():
+            # Images removed from the project since are left alone
+            if name in project_names:
+                self.all_annotations.add_classes(name, packed)
+
+    def undo(self):
+        if not self.image_label.check_unsaved_changes():
+            return
+        changes = self.annotation_history.undo_step()
+        if changes is None:
+            self.statusBar().showMessage("Nothing to undo", 3000)
+            return
+        self.apply_history_step(changes, undo=True)
+        self.statusBar().showMessage("Undone", 3000)
+
+    def redo(self):
+        if not self.image_label.check_unsaved_changes():
+            return
+        changes = self.annotation_history.redo_step()
+        if changes is None:
+            self.statusBar().showMessage("Nothing to redo", 3000)
+            return
+        self.apply_history_step(changes, undo=False)
+        self.statusBar().showMessage("Redone", 3000)
+
+    def apply_history_step(self, changes, undo):
+        """Revert (or reapply) the changes of one undo step, as one batch that is not itself recorded."""
+        project_names = self.project_image_names()
+        with self.annotation_step():
+            self.save_current_annotations()
+            for change in (reversed(changes) if undo else changes):
+                if isinstance(change, ImageChange):
+                    # Images removed from the project since are left alone
+                    if change.name in project_names:
+                        self.apply_image_change(change, undo)
+                elif isinstance(change, ClassRename):
+                    if undo:
+                        self.apply_class_rename(change.new_name, change.old_name)
+                    else:
+                        self.apply_class_rename(change.old_name, change.new_name)
+                elif isinstance(change, ClassDelete):
+                    if undo:
+                        self.restore_deleted_class(change, project_names)
+                    else:
+                        self.apply_class_delete(change.class_name)
+            self.annotation_history.ignore_changes()
+        if self.current_class not in self.class_mapping:
+            self.current_class = None
+        self.update_class_list()
+        self.image_label.update()
+        # Class changes are saved even if no annotation used the class
+        self.mark_all_annotations_dirty()
+        self.auto_save()
+
+    def apply_image_change(self, change, undo):
+        annotations = self.all_annotations.copy_of(change.name, {})
+        change.apply(annotations, undo)
+        if change.name == (self.current_slice or self.image_file_name):
+            self.all_annotations[change.name] = annotations
+        else:
+            # Other images stay packed
+            self.all_annotations.load(change.name, annotations)
+        self.all_annotations.touch(change.name)
+
+    def project_image_names(self):
+        """Names of every image and slice in the project."""
+        names = set()
+        for image_info in self.all_images:
+            if image_info.get('is_multi_slice', False):
+                names.update(self.slice_names(image_info))
+            else:
+                names.add(image_info['file_name'])
+        return names
+
+    def set_undo_budget(self):
+        current_mb = self.annotation_history.budget_bytes // (1024 * 1024)
+        budget_mb, ok = QInputDialog.getInt(self, "Undo Memory",
+                                            "Memory budget for undo steps (MB):",
+                                            current_mb, 1, 65536, 16)
+        if ok:
+            self.annotation_history.set_budget(budget_mb * 1024 * 1024)
+            self.settings.setValue("undo_budget_mb", budget_mb)
             
         
     def finish_polygon(self):
@@ -3557,37 +3948,31 @@ class ImageAnnotator(QMainWindow):
             self.auto_save()  # Auto-save after adding a polygon annotation
 
 
-    def highlight_annotation(self, item):
-        self.image_label.highlighted_annotation = item.data(Qt.UserRole)
+    def highlight_annotation(self, annotation):
+        self.image_label.highlighted_annotation = annotation
         self.image_label.update()
 
     def delete_annotation(self):
-        current_item = self.annotation_list.currentItem()
-        if current_item:
-            annotation = current_item.data(Qt.UserRole)
-            category_name = annotation['category_name']
-            self.image_label.annotations[category_name].remove(annotation)
-            self.annotation_list.takeItem(self.annotation_list.row(current_item))
+        annotation = self.annotation_list.current_annotation()
+        if annotation:
+            self.image_label.remove_annotations([annotation])
+            self.annotation_model.remove([annotation])
             self.image_label.highlighted_annotation = None
             self.image_label.update()
+            self.save_current_annotations()
 
     def add_annotation_to_list(self, annotation):
         class_name = annotation['category_name']
-        color = self.image_label.class_colors.get(class_name, QColor(Qt.white))
         annotations = self.image_label.annotations.get(class_name, [])
         number = max([ann.get('number', 0) for ann in annotations] + [0]) + 1
         annotation['number'] = number
-        area = calculate_area(annotation)
-        item_text = f"{class_name} - {number:<3} Area: {area:.2f}"
-        
-        item = QListWidgetItem(item_text)
-        item.setData(Qt.UserRole, annotation)
-        item.setForeground(color)
-        self.annotation_list.addItem(item)
+        if 'id' not in annotation:
+            annotation['id'] = self.all_annotations.new_id()
+        self.annotation_model.append(annotation)
         
         # Clear the current selection
         self.annotation_list.clearSelection()
-        self.image_label.highlighted_annotations.clear()
+        self.image_label.set_highlighted_annotations()
         self.image_label.update()
             
     
@@ -3656,21 +4041,14 @@ class ImageAnnotator(QMainWindow):
         self.image_label.editing_point_index = None
         self.image_label.hover_point_index = None
         self.update_annotation_list()
+        self.save_current_annotations()
         self.image_label.update()
 
     def highlight_annotation_in_list(self, annotation):
-        for i in range(self.annotation_list.count()):
-            item = self.annotation_list.item(i)
-            if item.data(Qt.UserRole) == annotation:
-                self.annotation_list.setCurrentItem(item)
-                break
+        self.annotation_list.select_annotation(annotation)
 
     def select_annotation_in_list(self, annotation):
-        for i in range(self.annotation_list.count()):
-            item = self.annotation_list.item(i)
-            if item.data(Qt.UserRole) == annotation:
-                self.annotation_list.setCurrentItem(item)
-                break
+        self.annotation_list.select_annotation(annotation)
             
 ################################################################
             
@@ -4119,12 +4497,7 @@ class ImageAnnotator(QMainWindow):
         return True
 
     def remove_all_temp_annotations(self):
-        for image_name in list(self.all_annotations.keys()):
-            for class_name in list(self.all_annotations[image_name].keys()):
-                if class_name.startswith("Temp-"):
-                    del self.all_annotations[image_name][class_name]
-            if not self.all_annotations[image_name]:
-                del self.all_annotations[image_name]
+        self.all_annotations.remove_classes(lambda class_name: class_name.startswith("Temp-"), drop_empty=True)
         
         for class_name in list(self.image_label.class_colors.keys()):
             if class_name.startswith("Temp-"):
@@ -4132,4 +4505,5 @@ class ImageAnnotator(QMainWindow):
         
         self.update_class_list()
         self.update_annotation_list()
+        self.refresh_slice_list_colors()
         self.image_label.update()
\ No newline at end of file
@@ -142,6 +142,8 @@ class HelpWindow(QDialog):
             <li><strong>Ctrl + O:</strong> Open an existing project</li>
             <li><strong>Ctrl + S:</strong> Save the current project</li>
             <li><strong>Ctrl + W:</strong> Close the current project</li>
+            <li><strong>Ctrl + Z:</strong> Undo the last annotation or class change</li>
+            <li><strong>Ctrl + Y:</strong> Redo the last undone change</li>
             <li><strong>Ctrl + Shift + S:</strong> Open Annotation Statistics</li>
             <li><strong>F1:</strong> Open this help window</li>
             <li><strong>Ctrl + Wheel:</strong> Zoom in/out</li>
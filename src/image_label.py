@@ -10,17 +10,136 @@ Dr. Sreenivas Bhattiprolu
 
 from PyQt5.QtWidgets import QLabel, QApplication, QMessageBox
 from PyQt5.QtGui import (QPainter, QPen, QColor, QFont, QPolygonF, QBrush, QPolygon,
-                         QPixmap, QImage, QWheelEvent, QMouseEvent, QKeyEvent)
+                         QPixmap, QImage, QWheelEvent, QMouseEvent, QKeyEvent, QFontMetricsF)
 from PyQt5.QtCore import Qt, QPoint, QPointF, QRectF, QSize
 from PIL import Image
 import os
+import time
 import warnings
+from collections import deque
 import cv2
 import numpy as np
 
+from src.image_pyramid import ImagePyramid, PyramidBuilder, is_built, needs_pyramid, pyramid_cache_dir
+from src.spatial_index import AnnotationGridIndex
+
 warnings.filterwarnings("ignore", category=UserWarning)
 
 
+# Annotation labels are not drawn when the annotation is smaller than this on screen (pixels)
+LABEL_MIN_SCREEN_SIZE = 24
+# Extra screen pixels around a moving overlay (pen width, vertex markers, antialiasing)
+OVERLAY_MARGIN = 8
+# Image pixels added around a stroke overlay whenever it has to grow
+STROKE_GROW_STEP = 256
+
+
+class AnnotationGeometry:
+    """QPolygonF, bounds and label anchor of one annotation, built once and reused by every paint."""
+
+    __slots__ = ('source', 'length', 'polygons', 'bounds', 'centroid')
+
+    def __init__(self, annotation):
+        if "segmentation" in annotation:
+            segmentation = annotation["segmentation"]
+            self.source = segmentation
+            self.length = len(segmentation)
+            if not isinstance(segmentation, list):
+                polygons = []
+            elif segmentation and isinstance(segmentation[0], list):  # Multiple polygons
+                polygons = segmentation
+            else:
+                polygons = [segmentation]
+            self.polygons = []
+            points = []
+            for polygon in polygons:
+                points = [QPointF(float(x), float(y)) for x, y in zip(polygon[0::2], polygon[1::2])]
+                if points:
+                    self.polygons.append(QPolygonF(points))
+            self.bounds = QRectF()
+            for polygon in self.polygons:
+                self.bounds = self.bounds.united(polygon.boundingRect())
+            # Label anchor: vertex mean of the last polygon
+            if points:
+                self.centroid = QPointF(sum(p.x() for p in points) / len(points),
+                                        sum(p.y() for p in points) / len(points))
+            else:
+                self.centroid = None
+        else:
+            x, y, width, height = annotation["bbox"]
+            self.source = annotation["bbox"]
+            self.length = len(self.source)
+            self.polygons = []
+            self.bounds = QRectF(x, y, width, height)
+            self.centroid = QPointF(x, y)
+
+    def is_current(self, annotation):
+        source = annotation["segmentation"] if "segmentation" in annotation else annotation.get("bbox")
+        return source is self.source and len(source) == self.length
+
+
+class StrokeOverlay:
+    """
+    ARGB image of a brush/eraser stroke, updated one dab at a time.
+
+    The image only covers the area painted so far (grown in STROKE_GROW_STEP
+    chunks), so drawing the overlay never converts the full-resolution mask.
+    """
+
+    def __init__(self, image_width, image_height, color):
+        self.image_width = image_width
+        self.image_height = image_height
+        self.color = color
+        self.image = None
+        self.origin = QPoint(0, 0)
+        # Painted area in image coordinates: [x0, y0, x1, y1] (inclusive)
+        self.bounds = None
+
+    def add_dab(self, x, y, radius):
+        x0, y0 = max(0, x - radius), max(0, y - radius)
+        x1, y1 = min(self.image_width - 1, x + radius), min(self.image_height - 1, y + radius)
+        if x0 > x1 or y0 > y1:
+            return
+        if self.bounds is None:
+            self.bounds = [x0, y0, x1, y1]
+        else:
+            self.bounds = [min(self.bounds[0], x0), min(self.bounds[1], y0),
+                           max(self.bounds[2], x1), max(self.bounds[3], y1)]
+        self.ensure_covers(x0, y0, x1, y1)
+
+        painter = QPainter(self.image)
+        painter.setRenderHint(QPainter.Antialiasing)
+        painter.setPen(Qt.NoPen)
+        painter.setBrush(self.color)
+        painter.drawEllipse(QPointF(x - self.origin.x(), y - self.origin.y()), radius, radius)
+        painter.end()
+
+    def ensure_covers(self, x0, y0, x1, y1):
+        if self.image is not None:
+            left, top = self.origin.x(), self.origin.y()
+            if (x0 >= left and y0 >= top and x1 < left + self.image.width()
+                    and y1 < top + self.image.height()):
+                return
+            x0, y0 = min(x0, left), min(y0, top)
+            x1 = max(x1, left + self.image.width() - 1)
+            y1 = max(y1, top + self.image.height() - 1)
+        x0, y0 = max(0, x0 - STROKE_GROW_STEP), max(0, y0 - STROKE_GROW_STEP)
+        x1 = min(self.image_width - 1, x1 + STROKE_GROW_STEP)
+        y1 = min(self.image_height - 1, y1 + STROKE_GROW_STEP)
+
+        image = QImage(x1 - x0 + 1, y1 - y0 + 1, QImage.Format_ARGB32_Premultiplied)
+        image.fill(Qt.transparent)
+        if self.image is not None:
+            painter = QPainter(image)
+            painter.drawImage(self.origin.x() - x0, self.origin.y() - y0, self.image)
+            painter.end()
+        self.image = image
+        self.origin = QPoint(x0, y0)
+
+    def draw(self, painter):
+        """Draw with `painter` already in image coordinates."""
+        if self.image is not None:
+            painter.drawImage(self.origin, self.image)
 
 
 class ImageLabel(QLabel):
@@ -40,10 +159,19 @@ class ImageLabel(QLabel):
         self.start_point = None
         self.end_point = None
         self.highlighted_annotations = []
+        # IDs of the highlighted annotations, for the per-annotation check when drawing
+        self.highlighted_ids = set()
         self.setMouseTracking(True)
         self.setFocusPolicy(Qt.StrongFocus)
         self.original_pixmap = None
         self.scaled_pixmap = None
+        # Large images are drawn tile by tile from a pyramid instead of a scaled pixmap
+        self.pyramid = None
+        # Cache directory of the pyramid being built for the image on screen
+        self.pending_pyramid = None
+        self.pyramid_builder = PyramidBuilder(self)
+        self.pyramid_builder.built.connect(self.on_pyramid_built)
+        self.display_size = None
         self.pan_start_pos = None
         self.main_window = None
         self.offset_x = 0
@@ -65,6 +193,9 @@ class ImageLabel(QLabel):
         self.is_painting = False
         self.temp_eraser_mask = None
         self.is_erasing = False
+        # Drawn instead of the full-resolution temp masks while a stroke is pending
+        self.paint_overlay = None
+        self.eraser_overlay = None
         self.cursor_pos = None
 
         #SAM
@@ -75,6 +206,16 @@ class ImageLabel(QLabel):
         
         self.temp_annotations = []
 
+        # Cached drawing geometry, keyed by id() of the annotation dict
+        self.annotation_geometry = {}
+        self.label_font = QFont("Arial", 12)
+        # Bounding-box grid over the displayed annotations, rebuilt lazily when dirty
+        self.spatial_index = AnnotationGridIndex()
+
+        # Paint timing (Settings > Show Paint Timing): (timestamp, seconds, repainted area)
+        self.show_paint_stats = False
+        self.paint_times = deque(maxlen=120)
+        self.last_paint_report = 0.0
 
 
         
@@ -85,12 +226,37 @@ class ImageLabel(QLabel):
         self.dark_mode = is_dark
         self.update()
 
-    def setPixmap(self, pixmap):
-        """Set the pixmap and update the scaled version."""
-        if isinstance(pixmap, QImage):
-            pixmap = QPixmap.fromImage(pixmap)
+    def setPixmap(self, pixmap, source=None):
+        """Set the pixmap and update the scaled version.
+
+        `source` is (file path, slice name) of the image, used to key its pyramid cache.
+        """
+        image = pixmap if isinstance(pixmap, QImage) else None
+        if image is not None:
+            pixmap = QPixmap.fromImage(image)
         self.original_pixmap = pixmap
+        self.pyramid = None
+        self.pending_pyramid = None
+        if pixmap and not pixmap.isNull() and needs_pyramid(pixmap.width(), pixmap.height()):
+            if image is None:
+                image = pixmap.toImage()
+            project_dir = getattr(self.main_window, 'current_project_dir', None)
+            cache_dir = pyramid_cache_dir(image, source, project_dir)
+            if is_built(cache_dir):
+                self.pyramid = ImagePyramid.load(pixmap, cache_dir)
+            else:
+                # Shown scaled until the pyramid is ready
+                self.pending_pyramid = cache_dir
+                self.pyramid_builder.build(image, cache_dir)
+        self.update_scaled_pixmap()
+
+    def on_pyramid_built(self, cache_dir):
+        if cache_dir != self.pending_pyramid or not self.original_pixmap:
+            return
+        self.pending_pyramid = None
+        self.pyramid = ImagePyramid.load(self.original_pixmap, cache_dir)
         self.update_scaled_pixmap()
+        self.update()
         
     def detect_bit_depth(self):
         """Detect and store the actual image bit depth using PIL."""
@@ -113,7 +279,14 @@ class ImageLabel(QLabel):
                     self.main_window.update_image_info()
 
     def update_scaled_pixmap(self):
-        if self.original_pixmap and not self.original_pixmap.isNull():
+        if self.original_pixmap and not self.original_pixmap.isNull() and self.pyramid:
+            # Only the visible tiles are drawn in paintEvent; nothing is rescaled here
+            self.scaled_pixmap = None
+            self.display_size = self.original_pixmap.size() * self.zoom_factor
+            super().setPixmap(QPixmap())
+            self.setMinimumSize(self.display_size)
+            self.update_offset()
+        elif self.original_pixmap and not self.original_pixmap.isNull():
             scaled_size = self.original_pixmap.size() * self.zoom_factor
             self.scaled_pixmap = self.original_pixmap.scaled(
                 scaled_size.width(),
@@ -121,19 +294,21 @@ class ImageLabel(QLabel):
                 Qt.KeepAspectRatio,
                 Qt.SmoothTransformation
             )
+            self.display_size = self.scaled_pixmap.size()
             super().setPixmap(self.scaled_pixmap)
-            self.setMinimumSize(self.scaled_pixmap.size())
+            self.setMinimumSize(self.display_size)
             self.update_offset()
         else:
             self.scaled_pixmap = None
+            self.display_size = None
             super().setPixmap(QPixmap())
             self.setMinimumSize(QSize(0, 0))
 
     def update_offset(self):
         """Update the offset for centered image display."""
-        if self.scaled_pixmap:
-            self.offset_x = int((self.width() - self.scaled_pixmap.width()) / 2)
-            self.offset_y = int((self.height() - self.scaled_pixmap.height()) / 2)
+        if self.display_size:
+            self.offset_x = int((self.width() - self.display_size.width()) / 2)
+            self.offset_y = int((self.height() - self.display_size.height()) / 2)
             
     def reset_annotation_state(self):
         """Reset the annotation state."""
@@ -154,6 +329,8 @@ class ImageLabel(QLabel):
     def start_painting(self, pos):
         if self.temp_paint_mask is None:
             self.temp_paint_mask = np.zeros((self.original_pixmap.height(), self.original_pixmap.width()), dtype=np.uint8)
+            self.paint_overlay = StrokeOverlay(self.original_pixmap.width(), self.original_pixmap.height(),
+                                               QColor(255, 255, 255, 128))
         self.is_painting = True
         self.continue_painting(pos)
 
@@ -162,7 +339,7 @@ class ImageLabel(QLabel):
             return
         brush_size = self.main_window.paint_brush_size
         cv2.circle(self.temp_paint_mask, (int(pos[0]), int(pos[1])), brush_size, 255, -1)
-        self.update()
+        self.paint_overlay.add_dab(int(pos[0]), int(pos[1]), brush_size)
 
     def finish_painting(self):
         if not self.is_painting:
@@ -174,7 +351,12 @@ class ImageLabel(QLabel):
     def commit_paint_annotation(self):
         if self.temp_paint_mask is not None and self.main_window.current_class:
             class_name = self.main_window.current_class
-            contours, _ = cv2.findContours(self.temp_paint_mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+            contours = []
+            if self.paint_overlay.bounds:
+                # Only the painted area of the mask is traced
+                x0, y0, x1, y1 = self.paint_overlay.bounds
+                roi = np.ascontiguousarray(self.temp_paint_mask[y0:y1 + 1, x0:x1 + 1])
+                contours, _ = cv2.findContours(roi, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE, offset=(x0, y0))
             for contour in contours:
                 if cv2.contourArea(contour) > 10:  # Minimum area threshold
                     segmentation = contour.flatten().tolist()
@@ -186,6 +368,7 @@ class ImageLabel(QLabel):
                     self.annotations.setdefault(class_name, []).append(new_annotation)
                     self.main_window.add_annotation_to_list(new_annotation)
             self.temp_paint_mask = None
+            self.paint_overlay = None
             self.main_window.save_current_annotations()
             self.main_window.update_slice_list_colors()
             self.update()
@@ -193,12 +376,15 @@ class ImageLabel(QLabel):
     
     def discard_paint_annotation(self):
         self.temp_paint_mask = None
+        self.paint_overlay = None
         self.update()     
         
 
     def start_erasing(self, pos):
         if self.temp_eraser_mask is None:
             self.temp_eraser_mask = np.zeros((self.original_pixmap.height(), self.original_pixmap.width()), dtype=np.uint8)
+            self.eraser_overlay = StrokeOverlay(self.original_pixmap.width(), self.original_pixmap.height(),
+                                                QColor(255, 255, 255, 128))
         self.is_erasing = True
         self.continue_erasing(pos)
 
@@ -207,7 +393,7 @@ class ImageLabel(QLabel):
             return
         eraser_size = self.main_window.eraser_size
         cv2.circle(self.temp_eraser_mask, (int(pos[0]), int(pos[1])), eraser_size, 255, -1)
-        self.update()
+        self.eraser_overlay.add_dab(int(pos[0]), int(pos[1]), eraser_size)
 
     def finish_erasing(self):
         if not self.is_erasing:
@@ -217,21 +403,40 @@ class ImageLabel(QLabel):
 
     def commit_eraser_changes(self):
         if self.temp_eraser_mask is not None:
-            eraser_mask = self.temp_eraser_mask.astype(bool)
             current_name = self.main_window.current_slice or self.main_window.image_file_name
             annotations_changed = False
+            stroke = self.eraser_overlay.bounds if self.eraser_overlay else None
+            image_height, image_width = self.temp_eraser_mask.shape
+            # Candidates come from the spatial index: annotations whose bounds meet the stroke's
+            touched = set()
+            if stroke is not None:
+                touched = {id(annotation) for _, annotation in self.annotations_in_rect(
+                    stroke[0] - 1, stroke[1] - 1, stroke[2] + 1, stroke[3] + 1)}
             
             for class_name, annotations in self.annotations.items():
                 updated_annotations = []
                 max_number = max([ann.get('number', 0) for ann in annotations] + [0])
                 for annotation in annotations:
                     if "segmentation" in annotation:
+                        # Annotations away from the stroke's bounding box are left untouched
+                        if id(annotation) not in touched:
+                            updated_annotations.append(annotation)
+                            continue
                         points = np.array(annotation["segmentation"]).reshape(-1, 2).astype(int)
-                        mask = np.zeros_like(self.temp_eraser_mask)
-                        cv2.fillPoly(mask, [points], 255)
-                        mask = mask.astype(bool)
-                        mask[eraser_mask] = False
-                        contours, _ = cv2.findContours(mask.astype(np.uint8), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+                        x0, y0 = max(0, points[:, 0].min()), max(0, points[:, 1].min())
+                        x1, y1 = min(image_width - 1, points[:, 0].max()), min(image_height - 1, points[:, 1].max())
+                        if x0 > stroke[2] or x1 < stroke[0] or y0 > stroke[3] or y1 < stroke[1]:
+                            updated_annotations.append(annotation)
+                            continue
+                        eraser_roi = self.temp_eraser_mask[y0:y1 + 1, x0:x1 + 1].astype(bool)
+                        if not eraser_roi.any():
+                            updated_annotations.append(annotation)
+                            continue
+                        # Rasterize, subtract and re-trace inside the annotation's own bounding box
+                        mask = np.zeros(eraser_roi.shape, dtype=np.uint8)
+                        cv2.fillPoly(mask, [points - [x0, y0]], 255)
+                        mask[eraser_roi] = 0
+                        contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE, offset=(int(x0), int(y0)))
                         for i, contour in enumerate(contours):
                             if cv2.contourArea(contour) > 10:  # Minimum area threshold
                                 new_segmentation = contour.flatten().tolist()
@@ -250,6 +455,7 @@ class ImageLabel(QLabel):
                 self.annotations[class_name] = updated_annotations
             
             self.temp_eraser_mask = None
+            self.eraser_overlay = None
             
             # Update the all_annotations dictionary in the main window
             self.main_window.all_annotations[current_name] = self.annotations
@@ -266,20 +472,25 @@ class ImageLabel(QLabel):
     
     def discard_eraser_changes(self):
         self.temp_eraser_mask = None
+        self.eraser_overlay = None
         self.update()
         
         
     def paintEvent(self, event):
+        paint_start = time.perf_counter()
         super().paintEvent(event)
-        if self.scaled_pixmap:
+        if self.display_size:
             painter = QPainter(self)
             painter.setRenderHint(QPainter.Antialiasing)
             
             # Draw the image
-            painter.drawPixmap(int(self.offset_x), int(self.offset_y), self.scaled_pixmap)
+            if self.pyramid:
+                self.pyramid.draw(painter, event.rect(), self.offset_x, self.offset_y, self.zoom_factor)
+            else:
+                painter.drawPixmap(int(self.offset_x), int(self.offset_y), self.scaled_pixmap)
             
             # Draw annotations
-            self.draw_annotations(painter)
+            self.draw_annotations(painter, event.rect())
             
             # Draw other elements
             if self.editing_polygon:
@@ -307,6 +518,54 @@ class ImageLabel(QLabel):
                 self.draw_temp_annotations(painter)
             
             painter.end()
+        if self.show_paint_stats:
+            self.record_paint_time(paint_start, event.rect())
+
+    def record_paint_time(self, paint_start, rect):
+        now = time.perf_counter()
+        self.paint_times.append((now, now - paint_start, rect.width() * rect.height()))
+        # Report at most four times per second
+        if self.main_window and now - self.last_paint_report > 0.25:
+            self.last_paint_report = now
+            self.main_window.show_paint_stats(self.paint_stats_text())
+
+    def paint_stats_text(self):
+        if not self.paint_times:
+            return "Paint: no data"
+        now = time.perf_counter()
+        recent = [entry for entry in self.paint_times if now - entry[0] <= 1.0]
+        average_ms = sum(entry[1] for entry in self.paint_times) / len(self.paint_times) * 1000
+        last_time, last_duration, last_area = self.paint_times[-1]
+        full_area = max(1, self.width() * self.height())
+        return (f"Paint: {last_duration * 1000:.1f} ms last, {average_ms:.1f} ms avg, "
+                f"{len(recent)} paints/s, last area {100 * last_area / full_area:.0f}% of canvas")
+
+    def overlay_rect(self):
+        """Widget area covered by the overlays that follow the mouse: tool indicator and rubber bands."""
+        zoom = self.zoom_factor
+        rect = QRectF()
+
+        def image_rect(x0, y0, x1, y1):
+            return QRectF(min(x0, x1) * zoom + self.offset_x, min(y0, y1) * zoom + self.offset_y,
+                          abs(x1 - x0) * zoom, abs(y1 - y0) * zoom)
+
+        if self.current_tool in ["paint_brush", "eraser"] and self.cursor_pos and self.main_window:
+            size = self.main_window.paint_brush_size if self.current_tool == "paint_brush" else self.main_window.eraser_size
+            x, y = self.cursor_pos
+            rect = rect.united(image_rect(x - size, y - size, x + size, y + size))
+            # "Size: n" text drawn right of the circle (see draw_tool_size_indicator)
+            rect = rect.united(QRectF(x * zoom + self.offset_x + size * zoom,
+                                      y * zoom + self.offset_y - size * zoom, 100, 20))
+        if self.drawing_rectangle and self.current_rectangle:
+            rect = rect.united(image_rect(*self.current_rectangle))
+        if self.sam_magic_wand_active and self.sam_bbox:
+            rect = rect.united(image_rect(*self.sam_bbox))
+        if self.current_annotation and self.temp_point:
+            last_x, last_y = self.current_annotation[-1]
+            rect = rect.united(image_rect(last_x, last_y, self.temp_point[0], self.temp_point[1]))
+        if rect.isNull():
+            return rect.toAlignedRect()
+        return rect.adjusted(-OVERLAY_MARGIN, -OVERLAY_MARGIN, OVERLAY_MARGIN, OVERLAY_MARGIN).toAlignedRect()
 
     def draw_temp_annotations(self, painter):
         painter.save()
@@ -326,7 +585,7 @@ class ImageLabel(QLabel):
                 painter.drawPolygon(QPolygonF(points))
 
             # Draw label and score
-            painter.setFont(QFont("Arial", int(12 / self.zoom_factor)))
+            painter.setFont(self.scaled_label_font())
             label = f"{annotation['category_name']} {annotation['score']:.2f}"
             if "bbox" in annotation:
                 x, y, _, _ = annotation["bbox"]
@@ -364,42 +623,23 @@ class ImageLabel(QLabel):
         self.update()
             
     def draw_temp_paint_mask(self, painter):
-        if self.temp_paint_mask is not None:
+        if self.paint_overlay is not None:
             painter.save()
             painter.translate(self.offset_x, self.offset_y)
             painter.scale(self.zoom_factor, self.zoom_factor)
-            
-            mask_image = QImage(self.temp_paint_mask.data, self.temp_paint_mask.shape[1], self.temp_paint_mask.shape[0], self.temp_paint_mask.shape[1], QImage.Format_Grayscale8)
-            mask_pixmap = QPixmap.fromImage(mask_image)
-            painter.setOpacity(0.5)
-            painter.drawPixmap(0, 0, mask_pixmap)
-            painter.setOpacity(1.0)
-            
+            self.paint_overlay.draw(painter)
             painter.restore()
-            
-            
-        
     
     def draw_temp_eraser_mask(self, painter):
-        if self.temp_eraser_mask is not None:
+        if self.eraser_overlay is not None:
             painter.save()
             painter.translate(self.offset_x, self.offset_y)
             painter.scale(self.zoom_factor, self.zoom_factor)
-            
-            mask_image = QImage(self.temp_eraser_mask.data, self.temp_eraser_mask.shape[1], self.temp_eraser_mask.shape[0], self.temp_eraser_mask.shape[1], QImage.Format_Grayscale8)
-            mask_pixmap = QPixmap.fromImage(mask_image)
-            painter.setOpacity(0.5)
-            painter.drawPixmap(0, 0, mask_pixmap)
-            painter.setOpacity(1.0)
-            
+            self.eraser_overlay.draw(painter)
             painter.restore()
-    
-    
-
-        
 
     def draw_tool_size_indicator(self, painter):
-        if self.current_tool in ["paint_brush", "eraser"] and hasattr(self, 'cursor_pos'):
+        if self.current_tool in ["paint_brush", "eraser"] and self.cursor_pos:
             painter.save()
             painter.translate(self.offset_x, self.offset_y)
             painter.scale(self.zoom_factor, self.zoom_factor)
@@ -451,7 +691,7 @@ class ImageLabel(QLabel):
             mask_image = QImage(self.paint_mask.data, self.paint_mask.shape[1], self.paint_mask.shape[0], self.paint_mask.shape[1], QImage.Format_Grayscale8)
             mask_pixmap = QPixmap.fromImage(mask_image)
             painter.setOpacity(0.5)
-            painter.drawPixmap(self.offset_x, self.offset_y, mask_pixmap.scaled(self.scaled_pixmap.size()))
+            painter.drawPixmap(self.offset_x, self.offset_y, mask_pixmap.scaled(self.display_size))
             painter.setOpacity(1.0)
     
     def draw_eraser_mask(self, painter):
@@ -459,7 +699,7 @@ class ImageLabel(QLabel):
             mask_image = QImage(self.eraser_mask.data, self.eraser_mask.shape[1], self.eraser_mask.shape[0], self.eraser_mask.shape[1], QImage.Format_Grayscale8)
             mask_pixmap = QPixmap.fromImage(mask_image)
             painter.setOpacity(0.5)
-            painter.drawPixmap(self.offset_x, self.offset_y, mask_pixmap.scaled(self.scaled_pixmap.size()))
+            painter.drawPixmap(self.offset_x, self.offset_y, mask_pixmap.scaled(self.display_size))
             painter.setOpacity(1.0)
         
 
@@ -505,22 +745,76 @@ class ImageLabel(QLabel):
         self.current_tool = None
         self.start_point = None
         self.end_point = None
-        self.highlighted_annotations.clear()
+        self.set_highlighted_annotations()
         self.original_pixmap = None
         self.scaled_pixmap = None
+        self.pyramid = None
+        self.pending_pyramid = None
+        self.display_size = None
         self.editing_polygon = None
         self.editing_point_index = None
         self.hover_point_index = None
         self.current_rectangle = None
         self.sam_bbox = None
         self.temp_sam_prediction = None
+        self.annotation_geometry.clear()
+        self.spatial_index.mark_dirty()
         self.update()
 
 
     def set_class_visibility(self, class_name, is_visible):
         self.class_visibility[class_name] = is_visible
 
-    def draw_annotations(self, painter):
+    def geometry_for(self, annotation):
+        geometry = self.annotation_geometry.get(id(annotation))
+        if geometry is None or not geometry.is_current(annotation):
+            geometry = AnnotationGeometry(annotation)
+            self.annotation_geometry[id(annotation)] = geometry
+        return geometry
+
+    def invalidate_annotation_geometry(self, annotation=None):
+        """Drop cached geometry after an annotation was edited in place (or all of it if None)."""
+        if annotation is None:
+            self.annotation_geometry.clear()
+        else:
+            self.annotation_geometry.pop(id(annotation), None)
+        self.spatial_index.mark_dirty()
+
+    def set_highlighted_annotations(self, annotations=()):
+        self.highlighted_annotations = list(annotations)
+        self.highlighted_ids = {annotation['id'] for annotation in self.highlighted_annotations if 'id' in annotation}
+
+    def remove_annotations(self, annotations):
+        """Remove these annotations, matched by ID, with one pass over each class they belong to."""
+        ids_by_class = {}
+        for annotation in annotations:
+            ids_by_class.setdefault(annotation['category_name'], set()).add(annotation['id'])
+        for class_name, ids in ids_by_class.items():
+            class_annotations = self.annotations.get(class_name)
+            if class_annotations:
+                class_annotations[:] = [a for a in class_annotations if a.get('id') not in ids]
+        self.spatial_index.mark_dirty()
+
+    def annotation_bounds(self, annotation):
+        if "segmentation" not in annotation and "bbox" not in annotation:
+            return None
+        return self.geometry_for(annotation).bounds
+
+    def annotations_at(self, x, y):
+        """(class_name, annotation) pairs whose bounding box contains the image point, in drawing order."""
+        self.spatial_index.ensure_current(self.annotations, self.annotation_bounds)
+        return [(class_name, annotation) for class_name, annotation, _ in self.spatial_index.query_point(x, y)]
+
+    def annotations_in_rect(self, x0, y0, x1, y1):
+        self.spatial_index.ensure_current(self.annotations, self.annotation_bounds)
+        return [(class_name, annotation) for class_name, annotation, _ in self.spatial_index.query_rect(x0, y0, x1, y1)]
+
+    def scaled_label_font(self):
+        # Labels keep a constant on-screen size whatever the zoom
+        self.label_font.setPointSizeF(max(12 / self.zoom_factor, 0.1))
+        return self.label_font
+
+    def draw_annotations(self, painter, exposed=None):
         """Draw all annotations on the image."""
         if not self.original_pixmap:
             return
@@ -529,51 +823,82 @@ class ImageLabel(QLabel):
         painter.translate(self.offset_x, self.offset_y)
         painter.scale(self.zoom_factor, self.zoom_factor)
     
+        # Only annotations intersecting the repainted area are drawn
+        if exposed is not None:
+            visible = QRectF((exposed.x() - self.offset_x) / self.zoom_factor,
+                             (exposed.y() - self.offset_y) / self.zoom_factor,
+                             exposed.width() / self.zoom_factor,
+                             exposed.height() / self.zoom_factor)
+        else:
+            visible = None
+        min_label_size = LABEL_MIN_SCREEN_SIZE / self.zoom_factor
+        painter.setFont(self.scaled_label_font())
+        # Strokes and labels reach outside an annotation's bounds, so the cull test allows for both
+        pen_margin = 2 / self.zoom_factor
+        if visible is not None:
+            stroke_visible = visible.adjusted(-pen_margin, -pen_margin, pen_margin, pen_margin)
+            label_metrics = QFontMetricsF(painter.font(), painter.device())
+            # Labels are drawn right of their anchor around the baseline, so only annotations meeting
+            # this strip (the repainted area extended without limit to the left) can appear in it
+            label_band = QRectF(QPointF(-1e9, stroke_visible.top() - label_metrics.descent()),
+                                QPointF(stroke_visible.right(), stroke_visible.bottom() + label_metrics.ascent()))
+        text_color = Qt.white if self.dark_mode else Qt.black
+        text_pen = QPen(text_color, 2 / self.zoom_factor, Qt.SolidLine)
+        highlighted = self.highlighted_ids
+        highlight_pen = QPen(Qt.red, 2 / self.zoom_factor, Qt.SolidLine)
+        highlight_fill = QColor(Qt.red)
+        highlight_fill.setAlphaF(self.fill_opacity)
+        seen = 0
+    
         for class_name, class_annotations in self.annotations.items():
             if not self.main_window.is_class_visible(class_name):
                 continue           
             
             color = self.class_colors.get(class_name, QColor(Qt.white))
+            class_pen = QPen(color, 2 / self.zoom_factor, Qt.SolidLine)
+            class_fill = QColor(color)
+            class_fill.setAlphaF(self.fill_opacity)
             for annotation in class_annotations:
-                if annotation in self.highlighted_annotations:
-                    border_color = Qt.red
-                    fill_color = QColor(Qt.red)
+                if "segmentation" not in annotation and "bbox" not in annotation:
+                    continue
+                seen += 1
+                geometry = self.geometry_for(annotation)
+                bounds = geometry.bounds
+                if visible is not None and not bounds.intersects(label_band):
+                    continue
+                if visible is not None and not bounds.intersects(stroke_visible):
+                    # Its label runs right from the centroid and may still reach the repainted area
+                    if (geometry.centroid is None or not label_band.contains(geometry.centroid)
+                            or max(bounds.width(), bounds.height()) < min_label_size):
+                        continue
+                    label_width = label_metrics.horizontalAdvance(f"{class_name} {annotation.get('number', '')}")
+                    if geometry.centroid.x() + label_width < stroke_visible.left():
+                        continue
+    
+                if highlighted and annotation.get('id') in highlighted:
+                    painter.setPen(highlight_pen)
+                    painter.setBrush(QBrush(highlight_fill))
                 else:
-                    border_color = color
-                    fill_color = QColor(color)
-                
-                fill_color.setAlphaF(self.fill_opacity)
-                
-                text_color = Qt.white if self.dark_mode else Qt.black
-                painter.setPen(QPen(border_color, 2 / self.zoom_factor, Qt.SolidLine))
-                painter.setBrush(QBrush(fill_color))
+                    painter.setPen(class_pen)
+                    painter.setBrush(QBrush(class_fill))
     
-                if "segmentation" in annotation:
-                    segmentation = annotation["segmentation"]
-                    if isinstance(segmentation, list) and len(segmentation) > 0:
-                        if isinstance(segmentation[0], list):  # Multiple polygons
-                            for polygon in segmentation:
-                                points = [QPointF(float(x), float(y)) for x, y in zip(polygon[0::2], polygon[1::2])]
-                                if points:
-                                    painter.drawPolygon(QPolygonF(points))
-                        else:  # Single polygon
-                            points = [QPointF(float(x), float(y)) for x, y in zip(segmentation[0::2], segmentation[1::2])]
-                            if points:
-                                painter.drawPolygon(QPolygonF(points))
-                        
-                        # Draw centroid and label
-                        if points:
-                            centroid = self.calculate_centroid(points)
-                            if centroid:
-                                painter.setFont(QFont("Arial", int(12 / self.zoom_factor)))
-                                painter.setPen(QPen(text_color, 2 / self.zoom_factor, Qt.SolidLine))
-                                painter.drawText(centroid, f"{class_name} {annotation.get('number', '')}")
+                if geometry.polygons:
+                    for polygon in geometry.polygons:
+                        painter.drawPolygon(polygon)
+                elif "bbox" in annotation and "segmentation" not in annotation:
+                    painter.drawRect(geometry.bounds)
+                else:
+                    continue
+                
+                # Labels of annotations too small to read at this zoom are skipped
+                if geometry.centroid and max(bounds.width(), bounds.height()) >= min_label_size:
+                    painter.setPen(text_pen)
+                    painter.drawText(geometry.centroid, f"{class_name} {annotation.get('number', '')}")
     
-                elif "bbox" in annotation:
-                    x, y, width, height = annotation["bbox"]
-                    painter.drawRect(QRectF(x, y, width, height))
-                    painter.setPen(QPen(text_color, 2 / self.zoom_factor, Qt.SolidLine))
-                    painter.drawText(QPointF(x, y), f"{class_name} {annotation.get('number', '')}")
+        # Forget geometry of annotations that no longer exist
+        if len(self.annotation_geometry) > 2 * seen + 64:
+            live = {id(annotation) for annotations in self.annotations.values() for annotation in annotations}
+            self.annotation_geometry = {key: value for key, value in self.annotation_geometry.items() if key in live}
     
         if self.current_annotation:
             painter.setPen(QPen(Qt.red, 2 / self.zoom_factor, Qt.SolidLine))
@@ -597,7 +922,7 @@ class ImageLabel(QLabel):
                 painter.drawPolygon(QPolygonF(points))
                 centroid = self.calculate_centroid(points)
                 if centroid:
-                    painter.setFont(QFont("Arial", int(12 / self.zoom_factor)))
+                    painter.setFont(self.scaled_label_font())
                     painter.drawText(centroid, f"SAM: {self.temp_sam_prediction['score']:.2f}")
     
         painter.restore()
@@ -711,6 +1036,7 @@ class ImageLabel(QLabel):
     def mouseMoveEvent(self, event: QMouseEvent):
         if not self.original_pixmap:
             return
+        dirty_before = self.overlay_rect()
         self.cursor_pos = self.get_image_coordinates(event.pos())
         
         if event.modifiers() == Qt.ControlModifier and event.buttons() == Qt.LeftButton:
@@ -738,7 +1064,14 @@ class ImageLabel(QLabel):
                 self.continue_painting(pos)
             elif self.current_tool == "eraser" and event.buttons() == Qt.LeftButton:
                 self.continue_erasing(pos)
-        self.update()
+    
+        if self.pan_start_pos or self.editing_polygon:
+            self.update()
+        else:
+            # Only the overlays following the mouse changed (brush strokes stay inside the indicator circles)
+            dirty = dirty_before.united(self.overlay_rect())
+            if not dirty.isEmpty():
+                self.update(dirty)
 
     def mouseReleaseEvent(self, event: QMouseEvent):
         if not self.original_pixmap:
@@ -783,7 +1116,7 @@ class ImageLabel(QLabel):
         self.update()
 
     def get_image_coordinates(self, pos):
-        if not self.scaled_pixmap:
+        if not self.display_size:
             return (0, 0)
         x = (pos.x() - self.offset_x) / self.zoom_factor
         y = (pos.y() - self.offset_y) / self.zoom_factor
@@ -801,6 +1134,7 @@ class ImageLabel(QLabel):
                 self.hover_point_index = None
                 self.main_window.enable_tools()
                 self.main_window.update_annotation_list()
+                self.main_window.save_current_annotations()
             elif self.current_tool == "polygon" and self.drawing_polygon:
                 self.finish_polygon()
             elif self.current_tool == "paint_brush":
@@ -820,6 +1154,8 @@ class ImageLabel(QLabel):
                 self.editing_point_index = None
                 self.hover_point_index = None
                 self.main_window.enable_tools()
+                # Point edits are already applied; this closes their undo step
+                self.main_window.save_current_annotations()
             elif self.current_tool == "paint_brush":
                 self.discard_paint_annotation()
             elif self.current_tool == "eraser":
@@ -877,16 +1213,19 @@ class ImageLabel(QLabel):
 
 
     def start_polygon_edit(self, pos):
-        for class_name, annotations in self.annotations.items():
-            for annotation in annotations:
-                if "segmentation" in annotation:
-                    points = [QPoint(int(x), int(y)) for x, y in zip(annotation["segmentation"][0::2], annotation["segmentation"][1::2])]
-                    if self.point_in_polygon(pos, points):
-                        self.editing_polygon = annotation
-                        self.current_tool = None
-                        self.main_window.disable_tools()
-                        self.main_window.reset_tool_buttons()
-                        return annotation
+        point = QPointF(float(pos[0]), float(pos[1]))
+        # Only annotations whose bounding box contains the point are tested against their polygon
+        for class_name, annotation in self.annotations_at(pos[0], pos[1]):
+            if "segmentation" in annotation:
+                polygons = self.geometry_for(annotation).polygons
+                if any(polygon.containsPoint(point, Qt.OddEvenFill) for polygon in polygons):
+                    # Edited in a list of its own, so the undo history sees the polygon change
+                    annotation["segmentation"] = list(annotation["segmentation"])
+                    self.editing_polygon = annotation
+                    self.current_tool = None
+                    self.main_window.disable_tools()
+                    self.main_window.reset_tool_buttons()
+                    return annotation
         return None
 
     def handle_editing_click(self, pos, event):
@@ -897,6 +1236,7 @@ class ImageLabel(QLabel):
                 if event.modifiers() & Qt.ShiftModifier:
                     # Delete point
                     del self.editing_polygon["segmentation"][i*2:i*2+2]
+                    self.invalidate_annotation_geometry(self.editing_polygon)
                 else:
                     # Start moving point
                     self.editing_point_index = i
@@ -905,6 +1245,7 @@ class ImageLabel(QLabel):
         for i in range(len(points)):
             if self.point_on_line(pos, points[i], points[(i+1) % len(points)]):
                 self.editing_polygon["segmentation"][i*2+2:i*2+2] = [pos[0], pos[1]]
+                self.invalidate_annotation_geometry(self.editing_polygon)
                 self.editing_point_index = i + 1
                 return
 
@@ -919,6 +1260,7 @@ class ImageLabel(QLabel):
         if self.editing_point_index is not None:
             self.editing_polygon["segmentation"][self.editing_point_index*2] = pos[0]
             self.editing_polygon["segmentation"][self.editing_point_index*2+1] = pos[1]
+            self.invalidate_annotation_geometry(self.editing_polygon)
             
             
     def exit_editing_mode(self):
@@ -927,24 +1269,6 @@ class ImageLabel(QLabel):
         self.hover_point_index = None
         self.update()
 
-    @staticmethod
-    def point_in_polygon(point, polygon):
-        """Check if a point is inside a polygon."""
-        n = len(polygon)
-        inside = False
-        p1x, p1y = polygon[0].x(), polygon[0].y()
-        for i in range(n + 1):
-            p2x, p2y = polygon[i % n].x(), polygon[i % n].y()
-            if point[1] > min(p1y, p2y):
-                if point[1] <= max(p1y, p2y):
-                    if point[0] <= max(p1x, p2x):
-                        if p1y != p2y:
-                            xinters = (point[1] - p1y) * (p2x - p1x) / (p2y - p1y) + p1x
-                        if p1x == p2x or point[0] <= xinters:
-                            inside = not inside
-            p1x, p1y = p2x, p2y
-        return inside
-
     @staticmethod
     def point_to_tuple(point):
         """Convert QPoint to tuple."""
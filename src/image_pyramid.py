@@ -0,0 +1,247 @@
+"""
+Tiled multi-resolution pyramid for very large 2D images.
+
+Rescaling a 20k x 20k pixmap on every zoom change is slow and, at high
+zoom, allocates gigabytes. For large images the ImageLabel instead draws
+only the tiles covering the visible viewport, from the pyramid level that
+matches the zoom factor:
+
+- level 0 is the original pixmap, drawn through a source rectangle
+- level k (k >= 1) is the image downsampled 2^k times, stored as a .npy
+  memory map and cut into TILE_SIZE tiles when drawn
+
+The downsampled levels are built once per image and cached on disk, next
+to the project when one is open and in the temp directory otherwise. The
+cache is keyed by the image's source file (path, size, mtime), its slice
+and a hash of sampled scanlines read straight from the QImage, so finding
+an existing pyramid needs no copy of the image. Building one runs on a
+PyramidBuilder thread; the image is shown scaled until it is done.
+"""
+
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+from PyQt5.QtCore import QRectF, QThread, pyqtSignal
+from PyQt5.QtGui import QImage, QPixmap, QPainter
+
+
+# Images whose width or height reach this size are drawn through a pyramid
+PYRAMID_MIN_SIZE = 4096
+TILE_SIZE = 512
+# Tiles kept as QPixmaps (512 x 512 RGBA tiles: about 1 MB each)
+MAX_CACHED_TILES = 192
+
+PYRAMID_CACHE_DIR_NAME = "pyramid_cache"
+
+
+def needs_pyramid(width, height):
+    return max(width, height) >= PYRAMID_MIN_SIZE
+
+
+def pyramid_cache_root(project_dir=None):
+    if project_dir and os.path.isdir(project_dir):
+        return os.path.join(project_dir, PYRAMID_CACHE_DIR_NAME)
+    return os.path.join(tempfile.gettempdir(), "zoravision_" + PYRAMID_CACHE_DIR_NAME)
+
+
+def qimage_to_array(image):
+    """Return a read-only (H, W, C) uint8 view of a QImage, converting uncommon formats first."""
+    if image.format() == QImage.Format_Grayscale8:
+        channels = 1
+    elif image.format() == QImage.Format_RGB888:
+        channels = 3
+    else:
+        image = image.convertToFormat(QImage.Format_ARGB32)
+        channels = 4
+    width, height = image.width(), image.height()
+    buffer = image.constBits()
+    buffer.setsize(image.sizeInBytes())
+    rows = np.frombuffer(buffer, np.uint8).reshape(height, image.bytesPerLine())
+    # Keep a reference to the image so the buffer stays alive as long as the view
+    array = rows[:, :width * channels].reshape(height, width, channels)
+    return array, image
+
+
+def array_to_qimage(array):
+    height, width, channels = array.shape
+    array = np.ascontiguousarray(array)
+    fmt = {1: QImage.Format_Grayscale8, 3: QImage.Format_RGB888, 4: QImage.Format_ARGB32}[channels]
+    return QImage(array.data, width, height, width * channels, fmt).copy()
+
+
+def image_fingerprint(image, source=None):
+    """Cache key of a QImage: its source (file path, size and mtime; slice) plus a hash of sampled scanlines.
+
+    The scanlines are hashed in the image's own format, without converting
+    or copying the image.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(f"{image.width()}x{image.height()}:{int(image.format())}".encode())
+    if source is not None:
+        path, part = source
+        if path:
+            try:
+                stat = os.stat(path)
+                digest.update(f"{os.path.abspath(path)}|{stat.st_size}|{stat.st_mtime_ns}".encode())
+            except OSError:
+                digest.update(os.path.abspath(path).encode())
+        if part:
+            digest.update(str(part).encode())
+    # Only the pixel bytes: the padding at the end of a scanline is not initialized
+    row_bytes = (image.width() * image.depth() + 7) // 8
+    step = max(1, image.height() // 256)
+    for row in list(range(0, image.height(), step)) + [image.height() - 1]:
+        digest.update(image.constScanLine(row).asstring(row_bytes))
+    return digest.hexdigest()
+
+
+def pyramid_cache_dir(image, source=None, project_dir=None):
+    return os.path.join(pyramid_cache_root(project_dir), image_fingerprint(image, source))
+
+
+def is_built(cache_dir):
+    return os.path.exists(os.path.join(cache_dir, "complete"))
+
+
+class ImagePyramid:
+    def __init__(self, pixmap, levels):
+        self.base = pixmap
+        self.width = pixmap.width()
+        self.height = pixmap.height()
+        self.levels = levels
+        self._tiles = OrderedDict()
+
+    @classmethod
+    def load(cls, pixmap, cache_dir):
+        """Open a pyramid built into `cache_dir` (see is_built()); the levels are memory-mapped."""
+        levels = []
+        index = 1
+        while os.path.exists(os.path.join(cache_dir, f"level_{index}.npy")):
+            levels.append(np.load(os.path.join(cache_dir, f"level_{index}.npy"), mmap_mode='r'))
+            index += 1
+        return cls(pixmap, levels)
+
+    @staticmethod
+    def build(image, cache_dir):
+        """Build the downsampled levels of a QImage into `cache_dir` (slow: run on a PyramidBuilder)."""
+        print(f"Building image pyramid in {cache_dir}")
+        array, _image = qimage_to_array(image)
+        shutil.rmtree(cache_dir, ignore_errors=True)
+        os.makedirs(cache_dir, exist_ok=True)
+        level = array
+        index = 1
+        while max(level.shape[:2]) > TILE_SIZE:
+            height, width = (level.shape[0] + 1) // 2, (level.shape[1] + 1) // 2
+            smaller = cv2.resize(level, (width, height), interpolation=cv2.INTER_AREA)
+            smaller = smaller.reshape(height, width, level.shape[2])
+            stored = np.lib.format.open_memmap(os.path.join(cache_dir, f"level_{index}.npy"),
+                                               mode='w+', dtype=np.uint8, shape=smaller.shape)
+            stored[:] = smaller
+            stored.flush()
+            level = stored
+            index += 1
+        open(os.path.join(cache_dir, "complete"), "w").close()
+
+    def level_for_zoom(self, zoom_factor):
+        """Coarsest level that still has at least one level pixel per screen pixel."""
+        level = 0
+        while level < len(self.levels) and 2 ** (level + 1) <= 1 / zoom_factor:
+            level += 1
+        return level
+
+    def tile(self, level, tx, ty):
+        key = (level, tx, ty)
+        pixmap = self._tiles.get(key)
+        if pixmap is None:
+            data = self.levels[level - 1][ty * TILE_SIZE:(ty + 1) * TILE_SIZE,
+                                          tx * TILE_SIZE:(tx + 1) * TILE_SIZE]
+            pixmap = QPixmap.fromImage(array_to_qimage(data))
+            self._tiles[key] = pixmap
+            if len(self._tiles) > MAX_CACHED_TILES:
+                self._tiles.popitem(last=False)
+        else:
+            self._tiles.move_to_end(key)
+        return pixmap
+
+    def draw(self, painter, exposed, offset_x, offset_y, zoom_factor):
+        """Draw the part of the image inside the widget rectangle `exposed`."""
+        # Visible area in full-resolution image coordinates
+        left = max(0.0, (exposed.left() - offset_x) / zoom_factor)
+        top = max(0.0, (exposed.top() - offset_y) / zoom_factor)
+        right = min(float(self.width), (exposed.right() + 1 - offset_x) / zoom_factor)
+        bottom = min(float(self.height), (exposed.bottom() + 1 - offset_y) / zoom_factor)
+        if left >= right or top >= bottom:
+            return
+
+        painter.save()
+        painter.setRenderHint(QPainter.SmoothPixmapTransform)
+        level = self.level_for_zoom(zoom_factor)
+        if level == 0:
+            source = QRectF(left, top, right - left, bottom - top)
+            target = QRectF(offset_x + left * zoom_factor, offset_y + top * zoom_factor,
+                            source.width() * zoom_factor, source.height() * zoom_factor)
+            painter.drawPixmap(target, self.base, source)
+        else:
+            data = self.levels[level - 1]
+            scale_x = self.width / data.shape[1]
+            scale_y = self.height / data.shape[0]
+            first_tx, last_tx = int(left / scale_x) // TILE_SIZE, int((right - 1) / scale_x) // TILE_SIZE
+            first_ty, last_ty = int(top / scale_y) // TILE_SIZE, int((bottom - 1) / scale_y) // TILE_SIZE
+            for ty in range(first_ty, last_ty + 1):
+                for tx in range(first_tx, last_tx + 1):
+                    pixmap = self.tile(level, tx, ty)
+                    target = QRectF(offset_x + tx * TILE_SIZE * scale_x * zoom_factor,
+                                    offset_y + ty * TILE_SIZE * scale_y * zoom_factor,
+                                    pixmap.width() * scale_x * zoom_factor,
+                                    pixmap.height() * scale_y * zoom_factor)
+                    painter.drawPixmap(target, pixmap, QRectF(pixmap.rect()))
+        painter.restore()
+
+
+class PyramidBuilder(QThread):
+    """Builds pyramids on a worker thread, the most recently requested image only."""
+
+    built = pyqtSignal(str)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._pending = None
+        self._condition = threading.Condition()
+        self._stopping = False
+
+    def build(self, image, cache_dir):
+        """Build the pyramid of a QImage; `built(cache_dir)` is emitted when it is ready."""
+        with self._condition:
+            # A request that has not started yet is replaced rather than kept (and its image with it)
+            self._pending = (image, cache_dir)
+            self._condition.notify()
+        if not self.isRunning():
+            self.start(QThread.LowPriority)
+
+    def stop(self):
+        with self._condition:
+            self._stopping = True
+            self._pending = None
+            self._condition.notify()
+        self.wait()
+
+    def run(self):
+        while True:
+            with self._condition:
+                while self._pending is None and not self._stopping:
+                    self._condition.wait()
+                if self._stopping:
+                    return
+                (image, cache_dir), self._pending = self._pending, None
+            try:
+                if not is_built(cache_dir):
+                    ImagePyramid.build(image, cache_dir)
+                self.built.emit(cache_dir)
+            except Exception as e:
+                print(f"Failed to build image pyramid: {e}")
@@ -0,0 +1,184 @@
+"""
+Copying images into a project's images/ directory.
+
+Each image is hashed (SHA-256) and the hashes are kept in the project as
+{file name: {'sha256', 'size', 'mtime'}}, so content that is already in the
+project under another name is linked instead of copied again. Files are
+placed with the cheapest method the filesystem supports: a reflink
+(copy-on-write clone), then a hard link, then a plain copy. Hard-linked
+images share their data with the source file, which is fine for images the
+annotator only reads.
+
+ImageCopyWorker does the hashing and copying on a thread pool so the window
+stays responsive while large projects are saved.
+"""
+
+import hashlib
+import os
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from PyQt5.QtCore import QThread, pyqtSignal
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+
+HASH_CHUNK_SIZE = 4 * 1024 * 1024
+COPY_WORKERS = 4
+# ioctl request for a copy-on-write clone of a whole file (Linux: btrfs, XFS, ...)
+FICLONE = 0x40049409
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def hash_entry(path, sha256=None):
+    stat = os.stat(path)
+    return {'sha256': sha256 or file_sha256(path), 'size': stat.st_size, 'mtime': stat.st_mtime}
+
+
+def is_current(entry, path):
+    """True if a stored hash entry still describes the file at `path`."""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return False
+    return bool(entry) and entry.get('size') == stat.st_size and entry.get('mtime') == stat.st_mtime
+
+
+def reflink(src, dst):
+    if fcntl is None:
+        raise OSError("reflinks are not supported on this platform")
+    with open(src, 'rb') as source, open(dst, 'wb') as target:
+        try:
+            fcntl.ioctl(target.fileno(), FICLONE, source.fileno())
+        except OSError:
+            target.close()
+            os.remove(dst)
+            raise
+    shutil.copystat(src, dst)
+
+
+def link_or_copy(src, dst):
+    """Place `src` at `dst` as a reflink, hard link or copy. Returns the method used."""
+    for method, place in (("reflink", reflink), ("hardlink", os.link)):
+        try:
+            place(src, dst)
+            return method
+        except OSError:
+            continue
+    shutil.copy2(src, dst)
+    return "copy"
+
+
+class ImageCopyWorker(QThread):
+    progress = pyqtSignal(int, int, str)
+
+    def __init__(self, images_to_copy, images_dir, image_hashes, parent=None):
+        """`images_to_copy` holds (file_name, src_path, dst_path); `image_hashes` is the project's index."""
+        super().__init__(parent)
+        self.images_to_copy = images_to_copy
+        self.images_dir = images_dir
+        self.image_hashes = dict(image_hashes)
+        self.copied = []
+        self.errors = []
+        self.methods = {}
+        self._cancelled = threading.Event()
+        self._lock = threading.Lock()
+        self._done = 0
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def was_cancelled(self):
+        return self._cancelled.is_set()
+
+    def run(self):
+        with ThreadPoolExecutor(max_workers=COPY_WORKERS) as pool:
+            known = self.project_content(pool)
+            source_hashes = self.hash_all(pool, [src for _, src, _ in self.images_to_copy])
+
+            # Content seen earlier in this batch is linked to its first copy
+            jobs = []
+            for file_name, src_path, dst_path in self.images_to_copy:
+                sha256 = source_hashes.get(src_path)
+                if sha256 is None:
+                    continue
+                existing = known.get(sha256)
+                if existing is None:
+                    known[sha256] = dst_path
+                    jobs.append((file_name, src_path, dst_path, sha256, None))
+                else:
+                    jobs.append((file_name, existing, dst_path, sha256, existing))
+
+            # Unique content first, so duplicates can link to the finished files
+            for duplicates in (False, True):
+                futures = [pool.submit(self.place, *job) for job in jobs if (job[4] is not None) == duplicates]
+                for future in as_completed(futures):
+                    future.result()
+
+    def project_content(self, pool):
+        """{sha256: path} of images already in the project whose size matches an image to copy."""
+        sizes = set()
+        for _, src_path, _ in self.images_to_copy:
+            try:
+                sizes.add(os.path.getsize(src_path))
+            except OSError:
+                pass
+        candidates = []
+        for entry in os.scandir(self.images_dir):
+            # Only files of the same size can have the same content
+            if entry.is_file() and entry.stat().st_size in sizes:
+                candidates.append(entry.path)
+        hashes = self.hash_all(pool, candidates, count_progress=False)
+        for path, sha256 in hashes.items():
+            self.image_hashes[os.path.basename(path)] = hash_entry(path, sha256)
+        return {sha256: path for path, sha256 in hashes.items()}
+
+    def hash_all(self, pool, paths, count_progress=True):
+        def hash_one(path):
+            if self._cancelled.is_set():
+                return path, None
+            entry = self.image_hashes.get(os.path.basename(path))
+            if os.path.dirname(os.path.abspath(path)) == os.path.abspath(self.images_dir) and is_current(entry, path):
+                return path, entry['sha256']
+            if count_progress:
+                self.progress.emit(self._done, len(self.images_to_copy), f"Hashing {os.path.basename(path)}")
+            try:
+                return path, file_sha256(path)
+            except OSError as e:
+                with self._lock:
+                    self.errors.append(f"{os.path.basename(path)}: {e}")
+                return path, None
+
+        return {path: sha256 for path, sha256 in pool.map(hash_one, paths) if sha256 is not None}
+
+    def place(self, file_name, src_path, dst_path, sha256, duplicate_of):
+        if self._cancelled.is_set():
+            return
+        try:
+            if os.path.exists(dst_path):
+                os.remove(dst_path)
+            method = link_or_copy(src_path, dst_path)
+            entry = hash_entry(dst_path, sha256)
+            with self._lock:
+                self.copied.append((file_name, dst_path))
+                self.image_hashes[file_name] = entry
+                method = f"{method} (duplicate)" if duplicate_of else method
+                self.methods[method] = self.methods.get(method, 0) + 1
+        except OSError as e:
+            with self._lock:
+                self.errors.append(f"{file_name}: {e}")
+        with self._lock:
+            self._done += 1
+            done = self._done
+        self.progress.emit(done, len(self.images_to_copy), f"Copied {file_name}")
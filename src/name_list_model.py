@@ -0,0 +1,193 @@
+"""
+Model/view image and slice lists.
+
+The image and slice lists used to be QListWidgets holding one
+QListWidgetItem per entry, and the slice list was restyled by walking every
+row and checking its annotations after each annotation commit, which for a
+stack of tens of thousands of slices made every commit scan the whole
+project. NameListModel holds the names only; the view asks for the rows on
+screen when it paints them. Whether a row has annotations is kept in a set
+that is updated for the rows named in refresh(), so an annotation commit
+repaints at most the row of the image being edited.
+
+NameListView offers the part of the QListWidget interface the annotator
+uses (item(), currentItem(), itemClicked...), with NameItem standing in for
+QListWidgetItem.
+"""
+
+from PyQt5.QtCore import Qt, QAbstractListModel, QModelIndex, QItemSelectionModel, pyqtSignal
+from PyQt5.QtGui import QColor
+from PyQt5.QtWidgets import QListView
+
+
+# (text, background) of a row, by (dark mode, row has annotations)
+ROW_COLORS = {
+    (True, True): (QColor(60, 60, 60), QColor(173, 216, 230)),      # Dark gray on light blue
+    (True, False): (QColor(200, 200, 200), QColor(40, 40, 40)),     # Light gray on very dark gray
+    (False, True): (QColor(255, 255, 255), QColor(70, 130, 180)),   # White on medium-dark blue
+    (False, False): (QColor(0, 0, 0), QColor(240, 240, 240)),       # Black on very light gray
+}
+
+
+class NameItem:
+    """The entry in one row of a NameListView, in place of a QListWidgetItem."""
+
+    __slots__ = ('name',)
+
+    def __init__(self, name):
+        self.name = name
+
+    def text(self):
+        return self.name
+
+    def __eq__(self, other):
+        return isinstance(other, NameItem) and other.name == self.name
+
+    def __hash__(self):
+        return hash(self.name)
+
+
+class NameListModel(QAbstractListModel):
+    def __init__(self, is_annotated=None, parent=None):
+        """`is_annotated(name)` tells whether an entry has annotations; without it rows are not coloured."""
+        super().__init__(parent)
+        self.is_annotated = is_annotated
+        self.names = []
+        self.rows = {}
+        self.annotated = set()
+        self.dark_mode = False
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.names)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or index.row() >= len(self.names):
+            return None
+        name = self.names[index.row()]
+        if role == Qt.DisplayRole:
+            return name
+        if self.is_annotated is not None and role in (Qt.ForegroundRole, Qt.BackgroundRole):
+            text, background = ROW_COLORS[(self.dark_mode, name in self.annotated)]
+            return text if role == Qt.ForegroundRole else background
+        return None
+
+    def row_of(self, name):
+        return self.rows.get(name, -1)
+
+    def set_names(self, names):
+        self.beginResetModel()
+        self.names = list(names)
+        self.rows = {name: row for row, name in enumerate(self.names)}
+        if self.is_annotated is not None:
+            self.annotated = {name for name in self.names if self.is_annotated(name)}
+        self.endResetModel()
+
+    def clear(self):
+        self.set_names([])
+
+    def append(self, name):
+        row = len(self.names)
+        self.beginInsertRows(QModelIndex(), row, row)
+        self.names.append(name)
+        self.rows[name] = row
+        if self.is_annotated is not None and self.is_annotated(name):
+            self.annotated.add(name)
+        self.endInsertRows()
+
+    def remove_row(self, row):
+        self.beginRemoveRows(QModelIndex(), row, row)
+        name = self.names.pop(row)
+        self.annotated.discard(name)
+        del self.rows[name]
+        for later_row in range(row, len(self.names)):
+            self.rows[self.names[later_row]] = later_row
+        self.endRemoveRows()
+        return name
+
+    def refresh(self, names=None):
+        """Re-check whether these entries (default: all) have annotations; repaint the rows that changed."""
+        if self.is_annotated is None:
+            return
+        for name in self.names if names is None else names:
+            row = self.rows.get(name)
+            if row is None:
+                continue
+            annotated = self.is_annotated(name)
+            if annotated != (name in self.annotated):
+                if annotated:
+                    self.annotated.add(name)
+                else:
+                    self.annotated.discard(name)
+                index = self.index(row)
+                self.dataChanged.emit(index, index, [Qt.ForegroundRole, Qt.BackgroundRole])
+
+    def set_dark_mode(self, dark_mode):
+        if dark_mode != self.dark_mode:
+            self.dark_mode = dark_mode
+            if self.names:
+                self.dataChanged.emit(self.index(0), self.index(len(self.names) - 1),
+                                      [Qt.ForegroundRole, Qt.BackgroundRole])
+
+
+class NameListView(QListView):
+    """List view over a NameListModel with the QListWidget calls the annotator makes."""
+
+    itemClicked = pyqtSignal(object)
+
+    def __init__(self, model, parent=None):
+        super().__init__(parent)
+        self.setModel(model)
+        # Rows have the same height, so only the visible ones are measured and painted
+        self.setUniformItemSizes(True)
+        self.clicked.connect(lambda index: self.itemClicked.emit(self.item(index.row())))
+
+    def count(self):
+        return self.model().rowCount()
+
+    def item(self, row):
+        names = self.model().names
+        return NameItem(names[row]) if 0 <= row < len(names) else None
+
+    def item_named(self, name):
+        return NameItem(name) if self.model().row_of(name) >= 0 else None
+
+    def row(self, item):
+        return self.model().row_of(item.text()) if item is not None else -1
+
+    def itemAt(self, position):
+        return self.item(self.indexAt(position).row())
+
+    def currentRow(self):
+        index = self.currentIndex()
+        return index.row() if index.isValid() else -1
+
+    def currentItem(self):
+        return self.item(self.currentRow())
+
+    def setCurrentRow(self, row):
+        if 0 <= row < self.count():
+            index = self.model().index(row)
+            self.selectionModel().setCurrentIndex(index, QItemSelectionModel.ClearAndSelect)
+            self.scrollTo(index)
+
+    def setCurrentItem(self, item):
+        self.setCurrentRow(self.row(item))
+
+    def addItem(self, name):
+        self.model().append(name)
+
+    def takeItem(self, row):
+        if 0 <= row < self.count():
+            return NameItem(self.model().remove_row(row))
+        return None
+
+    def set_names(self, names):
+        self.model().set_names(names)
+
+    def clear(self):
+        self.model().clear()
+
+    def set_dark_mode(self, dark_mode):
+        self.model().set_dark_mode(dark_mode)
+        background = "rgb(40, 40, 40)" if dark_mode else "rgb(240, 240, 240)"
+        self.setStyleSheet(f"QListView {{ background-color: {background}; }}")
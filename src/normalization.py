@@ -0,0 +1,148 @@
+"""
+Intensity normalization for displaying microscopy slices.
+
+uint8 and uint16 data are mapped to 8-bit display values through a lookup
+table, so a slice costs one gather instead of several float32 passes. The
+intensity window is either computed per slice (the original behaviour) or
+once per stack from a sample of its slices and reused for every slice.
+Grayscale slices become Grayscale8/Grayscale16 QImages directly instead of
+being stacked into three identical RGB channels.
+"""
+
+import threading
+
+import numpy as np
+from PyQt5.QtGui import QImage
+
+
+CONTRAST_PER_SLICE = "slice"
+CONTRAST_PER_STACK = "stack"
+
+# Number of slices sampled to estimate the intensity range of a whole stack
+STACK_STATS_SAMPLES = 64
+
+_LUT_DTYPES = (np.uint8, np.uint16)
+
+
+def intensity_range(array):
+    return array.min(), array.max()
+
+
+def stack_intensity_range(stack, max_samples=STACK_STATS_SAMPLES):
+    """Intensity range of a SliceStack, estimated from evenly spaced slices."""
+    indices = stack.slice_indices()
+    if len(indices) > max_samples:
+        picks = np.linspace(0, len(indices) - 1, max_samples).round().astype(int)
+        indices = [indices[i] for i in picks]
+    low, high = None, None
+    for index in indices:
+        slice_low, slice_high = intensity_range(stack.slice_array(index))
+        low = slice_low if low is None else min(low, slice_low)
+        high = slice_high if high is None else max(high, slice_high)
+    return low, high
+
+
+def build_lut(low, high, dtype, gamma=1.0, out_dtype=np.uint8):
+    """Lookup table mapping every value of an integer dtype onto the [low, high] window."""
+    values = np.arange(np.iinfo(dtype).max + 1, dtype=np.float32)
+    span = float(high) - float(low)
+    if span <= 0:
+        return np.zeros(values.shape, dtype=out_dtype)
+    scaled = np.clip((values - float(low)) / span, 0, 1)
+    if gamma != 1.0:
+        scaled = np.power(scaled, gamma)
+    return (scaled * np.iinfo(out_dtype).max).astype(out_dtype)
+
+
+def normalize(array, window=None, gamma=1.0, lut=None):
+    """Map an array to uint8 using `window` (low, high), or the array's own range if None."""
+    if lut is not None:
+        return lut[array]
+    low, high = window if window is not None else intensity_range(array)
+    if array.dtype.type in _LUT_DTYPES:
+        return build_lut(low, high, array.dtype, gamma)[array]
+
+    # Other dtypes (float, int32, ...) cannot be indexed into a table
+    span = float(high) - float(low)
+    if span <= 0:
+        return np.zeros(array.shape, dtype=np.uint8)
+    scaled = np.subtract(array, low, dtype=np.float32)
+    scaled *= 1.0 / span
+    np.clip(scaled, 0, 1, out=scaled)
+    if gamma != 1.0:
+        np.power(scaled, gamma, out=scaled)
+    scaled *= 255
+    return scaled.astype(np.uint8)
+
+
+def to_qimage(array):
+    """
+    Wrap a uint8/uint16 grayscale or uint8 RGB array in a QImage that owns its pixels.
+
+    Grayscale data is never expanded to three channels.
+    """
+    array = np.ascontiguousarray(array)
+    height, width = array.shape[:2]
+    if array.ndim == 2 and array.dtype == np.uint8:
+        image = QImage(array.data, width, height, width, QImage.Format_Grayscale8)
+    elif array.ndim == 2 and array.dtype == np.uint16:
+        image = QImage(array.data, width, height, 2 * width, QImage.Format_Grayscale16)
+    elif array.ndim == 3 and array.shape[2] == 3 and array.dtype == np.uint8:
+        image = QImage(array.data, width, height, 3 * width, QImage.Format_RGB888)
+    else:
+        raise ValueError(f"Unsupported array shape {array.shape} / dtype {array.dtype} for conversion to QImage")
+    return image.copy()
+
+
+def normalize_to_qimage(array, window=None, gamma=1.0):
+    """Normalize a 2D or multi-channel image for display and wrap it in a QImage."""
+    if array.ndim == 3:
+        if array.shape[2] == 1:
+            array = array[:, :, 0]
+        elif array.shape[2] >= 3:
+            # Multi-channel image, use first three channels
+            array = array[:, :, :3]
+        else:
+            raise ValueError(f"Unsupported image shape: {array.shape}")
+    elif array.ndim != 2:
+        raise ValueError(f"Unsupported image shape: {array.shape}")
+    return to_qimage(normalize(array, window, gamma))
+
+
+class SliceNormalizer:
+    """
+    Converter for SliceStack: turns a raw slice into a display QImage.
+
+    In stack mode the intensity window and its lookup table are computed on the
+    first slice rendered and shared by every later slice of the stack.
+    """
+
+    def __init__(self, mode=CONTRAST_PER_SLICE, gamma=1.0):
+        self.mode = mode
+        self.gamma = gamma
+        self.stack = None
+        self.window = None
+        self._lut = None
+        self._lock = threading.Lock()
+
+    def display_settings(self):
+        return ("contrast", self.mode, "gamma", self.gamma)
+
+    def bind(self, stack):
+        self.stack = stack
+        return self
+
+    def stack_window(self, dtype):
+        with self._lock:
+            if self.window is None:
+                self.window = stack_intensity_range(self.stack)
+                print(f"Stack intensity range: {self.window}")
+                if np.dtype(dtype).type in _LUT_DTYPES:
+                    self._lut = build_lut(*self.window, dtype, self.gamma)
+            return self.window, self._lut
+
+    def __call__(self, array):
+        if self.mode == CONTRAST_PER_STACK and self.stack is not None and array.ndim == 2:
+            window, lut = self.stack_window(array.dtype)
+            return to_qimage(normalize(array, window, self.gamma, lut))
+        return normalize_to_qimage(array, gamma=self.gamma)
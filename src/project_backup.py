@@ -0,0 +1,212 @@
+"""
+Versioned, deduplicated project backups.
+
+A snapshot is a small manifest naming the content hash of the project
+metadata and of each image's (or slice's) annotations. The chunks
+themselves are stored once, compressed, under their hash, and shared by
+every snapshot of every project in the directory, so a new snapshot only
+writes the images whose annotations changed since any earlier one. A
+snapshot of a project that has not changed since the last one (project
+file and journal untouched) is not taken at all.
+
+Layout, next to the project files:
+
+    .project_backups/objects/<2 hex>/<hash>           zlib-compressed JSON chunk
+    .project_backups/snapshots/<project>/<time>.json   manifest
+
+Old snapshots are pruned by a retention policy (the newest `keep_last`,
+plus the newest of each of the last `keep_daily` days) and chunks no longer
+named by any manifest are deleted.
+"""
+
+import hashlib
+import json
+import os
+import zlib
+from datetime import datetime
+
+from src.project_journal import journal_path, project_stamp
+from src.project_store import dumps, project_header, read_project_with_journal, write_project_file
+
+
+BACKUP_DIR_NAME = ".project_backups"
+SNAPSHOT_TIME_FORMAT = "%Y%m%d_%H%M%S_%f"
+# Suffix of a project file (and its journal) set aside before restoring over it
+SET_ASIDE_FORMAT = ".broken-%Y%m%d_%H%M%S"
+# Fast zlib level: chunks are written when a project is opened, so speed matters more than ratio
+COMPRESSION_LEVEL = 1
+
+# Default retention policy (overridable in Settings)
+DEFAULT_KEEP_LAST = 10
+DEFAULT_KEEP_DAILY = 14
+
+
+def backup_root(project_file):
+    return os.path.join(os.path.dirname(os.path.abspath(project_file)), BACKUP_DIR_NAME)
+
+
+def chunk_hash(data):
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def write_atomic(path, data):
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, path)
+
+
+class ProjectBackups:
+    """The snapshots of one project file."""
+
+    def __init__(self, project_file):
+        self.project_file = os.path.abspath(project_file)
+        self.root = backup_root(project_file)
+        self.objects_dir = os.path.join(self.root, "objects")
+        self.snapshots_dir = os.path.join(self.root, "snapshots", os.path.basename(project_file))
+
+    def object_path(self, digest):
+        return os.path.join(self.objects_dir, digest[:2], digest)
+
+    def put_chunk(self, value):
+        """Store a JSON value under its content hash. Returns (hash, bytes written)."""
+        data = dumps(value).encode()
+        digest = chunk_hash(data)
+        path = self.object_path(digest)
+        if os.path.exists(path):
+            return digest, 0
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        compressed = zlib.compress(data, COMPRESSION_LEVEL)
+        write_atomic(path, compressed)
+        return digest, len(compressed)
+
+    def get_chunk(self, digest):
+        with open(self.object_path(digest), 'rb') as f:
+            return json.loads(zlib.decompress(f.read()))
+
+    def snapshots(self):
+        """[(manifest path, manifest)], newest first."""
+        if not os.path.isdir(self.snapshots_dir):
+            return []
+        result = []
+        for name in sorted(os.listdir(self.snapshots_dir), reverse=True):
+            if not name.endswith(".json"):
+                continue
+            path = os.path.join(self.snapshots_dir, name)
+            try:
+                with open(path, 'r') as f:
+                    result.append((path, json.load(f)))
+            except (OSError, json.JSONDecodeError) as e:
+                print(f"Ignoring unreadable backup manifest {name}: {str(e)}")
+        return result
+
+    def snapshot(self):
+        """Back up the project as it is on disk (journal included). Returns the manifest path."""
+        stamp = project_stamp(self.project_file)
+        existing = self.snapshots()
+        if existing and existing[0][1].get('stamp') == stamp:
+            print(f"Project unchanged since backup {os.path.basename(existing[0][0])}")
+            return existing[0][0]
+
+        project_data = read_project_with_journal(self.project_file)
+        written = 0
+        annotations = {}
+        for image in project_data.get('images', []):
+            if image.get('is_multi_slice'):
+                chunks = [(s['name'], s.get('annotations', {})) for s in image.get('slices', [])]
+            else:
+                chunks = [(image['file_name'], image.get('annotations', {}))]
+            for name, image_annotations in chunks:
+                annotations[name], size = self.put_chunk(image_annotations)
+                written += size
+        metadata, size = self.put_chunk(project_header(project_data))
+        written += size
+
+        created = datetime.now()
+        manifest = {
+            'project': os.path.basename(self.project_file),
+            'created': created.isoformat(),
+            'stamp': stamp,
+            'metadata': metadata,
+            'annotations': annotations,
+        }
+        os.makedirs(self.snapshots_dir, exist_ok=True)
+        path = os.path.join(self.snapshots_dir, created.strftime(SNAPSHOT_TIME_FORMAT) + ".json")
+        write_atomic(path, dumps(manifest).encode())
+        print(f"Backed up {manifest['project']}: {len(annotations)} annotation chunks, {written} new bytes")
+        return path
+
+    def project_data(self, manifest):
+        """The project data recorded by a snapshot."""
+        project_data = self.get_chunk(manifest['metadata'])
+        project_data.pop('format_version', None)
+        annotations = manifest['annotations']
+        for image in project_data.get('images', []):
+            if image.get('is_multi_slice'):
+                for slice_info in image.get('slices', []):
+                    slice_info['annotations'] = self.get_chunk(annotations[slice_info['name']])
+            else:
+                image['annotations'] = self.get_chunk(annotations[image['file_name']])
+        return project_data
+
+    def restore(self, manifest_path):
+        """Replace the project file (and drop its journal) with the state of a snapshot."""
+        with open(manifest_path, 'r') as f:
+            manifest = json.load(f)
+        write_project_file(self.project_file, self.project_data(manifest))
+        # The snapshot already includes what the journal held at the time
+        if os.path.exists(journal_path(self.project_file)):
+            os.remove(journal_path(self.project_file))
+        print(f"Project restored from backup: {os.path.basename(manifest_path)}")
+
+    def set_aside(self):
+        """Rename the project file and its journal out of the way, keeping both. Returns the new project path."""
+        kept = self.project_file + datetime.now().strftime(SET_ASIDE_FORMAT)
+        if os.path.exists(self.project_file):
+            os.replace(self.project_file, kept)
+        if os.path.exists(journal_path(self.project_file)):
+            # Still paired with the file, so renaming both back recovers the journaled changes
+            os.replace(journal_path(self.project_file), journal_path(kept))
+        print(f"Project file set aside as {os.path.basename(kept)}")
+        return kept
+
+    def prune(self, keep_last=DEFAULT_KEEP_LAST, keep_daily=DEFAULT_KEEP_DAILY):
+        """Apply the retention policy, then delete unreferenced chunks. Returns the snapshots removed."""
+        snapshots = self.snapshots()
+        keep = {path for path, _ in snapshots[:keep_last]}
+        days = []
+        for path, manifest in snapshots:
+            day = manifest.get('created', '')[:10]
+            if day not in days:
+                days.append(day)
+                if len(days) <= keep_daily:
+                    keep.add(path)
+        removed = 0
+        for path, _ in snapshots:
+            if path not in keep:
+                os.remove(path)
+                removed += 1
+        if removed:
+            self.collect_garbage()
+        return removed
+
+    def collect_garbage(self):
+        """Delete chunks no manifest of any project in this directory refers to."""
+        referenced = set()
+        snapshots_root = os.path.dirname(self.snapshots_dir)
+        for project_name in os.listdir(snapshots_root):
+            for _, manifest in ProjectBackups(os.path.join(os.path.dirname(self.root), project_name)).snapshots():
+                referenced.add(manifest['metadata'])
+                referenced.update(manifest['annotations'].values())
+        freed = 0
+        for prefix in os.listdir(self.objects_dir):
+            prefix_dir = os.path.join(self.objects_dir, prefix)
+            for digest in os.listdir(prefix_dir):
+                if digest not in referenced and not digest.endswith(".tmp"):
+                    path = os.path.join(prefix_dir, digest)
+                    freed += os.path.getsize(path)
+                    os.remove(path)
+        print(f"Backup cleanup freed {freed} bytes")
+        return freed
@@ -0,0 +1,174 @@
+"""
+On-disk catalog of the projects below a search directory.
+
+Project search used to walk the tree and parse every project file for every
+query. The catalog keeps the searchable metadata of each project (name,
+classes, image names, notes and dates) in a SQLite database, together with
+the size and mtime of the project file and its journal. A refresh only
+stats the files and re-reads the projects that changed, appeared or
+vanished since the last search; queries then run against the catalog.
+
+Terms are matched as case-insensitive substrings, as before, through an
+FTS5 table with the trigram tokenizer. Terms shorter than three characters
+(which trigrams cannot index) and SQLite builds without FTS5 fall back to
+LIKE over the same text.
+
+The catalog lives in the searched directory, or in the temp directory when
+that one is not writable.
+"""
+
+import hashlib
+import os
+import sqlite3
+import tempfile
+
+from src.project_journal import ProjectJournal, project_stamp
+from src.project_store import read_project_file, PROJECT_SUFFIX, PROJECT_DB_SUFFIX
+
+
+CATALOG_FILE_NAME = ".zoravision_catalog.sqlite"
+CATALOG_VERSION = 1
+
+# Searchable text columns; list values are stored one per line
+TEXT_COLUMNS = ('name', 'classes', 'images', 'notes')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS projects (
+    path TEXT PRIMARY KEY,
+    stamp TEXT NOT NULL,
+    name TEXT NOT NULL,
+    classes TEXT NOT NULL,
+    images TEXT NOT NULL,
+    notes TEXT NOT NULL,
+    creation_date TEXT NOT NULL,
+    last_modified TEXT NOT NULL
+);
+"""
+
+FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS project_text
+USING fts5(path UNINDEXED, name, classes, images, notes, tokenize='trigram');
+"""
+
+
+def catalog_path(directory):
+    path = os.path.join(directory, CATALOG_FILE_NAME)
+    if os.access(directory, os.W_OK):
+        return path
+    key = hashlib.blake2b(os.path.abspath(directory).encode(), digest_size=8).hexdigest()
+    return os.path.join(tempfile.gettempdir(), f"zoravision_catalog_{key}.sqlite")
+
+
+def find_project_files(directory):
+    """{path: stamp} of every project file below `directory`."""
+    found = {}
+    pending = [directory]
+    while pending:
+        try:
+            entries = list(os.scandir(pending.pop()))
+        except OSError:
+            continue
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                pending.append(entry.path)
+            elif entry.name.endswith((PROJECT_SUFFIX, PROJECT_DB_SUFFIX)):
+                found[entry.path] = project_stamp(entry.path)
+    return found
+
+
+def catalog_entry(path):
+    """Searchable fields of one project, including metadata changes still in its journal."""
+    project_data = read_project_file(path, include_annotations=False)
+    ProjectJournal(path).replay(project_data)
+    return {
+        'name': os.path.basename(path),
+        'classes': "\n".join(c.get('name', '') for c in project_data.get('classes', [])),
+        'images': "\n".join(img.get('file_name', '') for img in project_data.get('images', [])),
+        'notes': project_data.get('notes', '') or '',
+        'creation_date': project_data.get('creation_date', '') or '',
+        'last_modified': project_data.get('last_modified', '') or '',
+    }
+
+
+class ProjectCatalog:
+    def __init__(self, directory):
+        self.directory = os.path.abspath(directory)
+        self.path = catalog_path(self.directory)
+        self.connection = sqlite3.connect(self.path)
+        self.has_fts = True
+        self.create_schema()
+
+    def create_schema(self):
+        version = self.connection.execute("PRAGMA user_version").fetchone()[0]
+        if version != CATALOG_VERSION:
+            # Built by another version: start over, it is only a cache
+            self.connection.executescript("DROP TABLE IF EXISTS projects; DROP TABLE IF EXISTS project_text;")
+            self.connection.execute(f"PRAGMA user_version = {CATALOG_VERSION}")
+        self.connection.executescript(SCHEMA)
+        try:
+            self.connection.executescript(FTS_SCHEMA)
+        except sqlite3.OperationalError as e:
+            print(f"Full-text search unavailable, project search falls back to LIKE: {e}")
+            self.has_fts = False
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def refresh(self):
+        """Bring the catalog up to date with the project files on disk. Returns the number re-read."""
+        on_disk = find_project_files(self.directory)
+        cataloged = dict(self.connection.execute("SELECT path, stamp FROM projects"))
+
+        removed = [path for path in cataloged if path not in on_disk]
+        changed = [path for path, stamp in on_disk.items() if cataloged.get(path) != stamp]
+
+        with self.connection:
+            for path in removed:
+                self.delete(path)
+            for path in changed:
+                try:
+                    entry = catalog_entry(path)
+                except Exception as e:
+                    print(f"Error reading project file {os.path.basename(path)}: {str(e)}")
+                    self.delete(path)
+                    continue
+                self.delete(path)
+                self.connection.execute(
+                    "INSERT INTO projects VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (path, on_disk[path], entry['name'], entry['classes'], entry['images'],
+                     entry['notes'], entry['creation_date'], entry['last_modified']))
+                if self.has_fts:
+                    self.connection.execute(
+                        "INSERT INTO project_text VALUES (?, ?, ?, ?, ?)",
+                        (path, *(entry[column] for column in TEXT_COLUMNS)))
+        if removed or changed:
+            print(f"Project catalog: {len(changed)} updated, {len(removed)} removed, {len(on_disk)} total")
+        return len(changed)
+
+    def delete(self, path):
+        self.connection.execute("DELETE FROM projects WHERE path = ?", (path,))
+        if self.has_fts:
+            self.connection.execute("DELETE FROM project_text WHERE path = ?", (path,))
+
+    def projects(self):
+        """[(path, creation_date)] of all cataloged projects."""
+        return self.connection.execute("SELECT path, creation_date FROM projects ORDER BY path").fetchall()
+
+    def matching_paths(self, term):
+        """Paths of the projects whose name, classes, image names or notes contain `term`."""
+        if self.has_fts and len(term) >= 3:
+            phrase = '"' + term.replace('"', '""') + '"'
+            rows = self.connection.execute("SELECT path FROM project_text WHERE project_text MATCH ?", (phrase,))
+        else:
+            pattern = "%" + term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+            condition = " OR ".join(f"{column} LIKE ? ESCAPE '\\'" for column in TEXT_COLUMNS)
+            rows = self.connection.execute(f"SELECT path FROM projects WHERE {condition}",
+                                           (pattern,) * len(TEXT_COLUMNS))
+        return {path for (path,) in rows}
@@ -5,6 +5,8 @@ from PyQt5.QtGui import QFont
 import os
 from datetime import datetime
 
+from src.project_store import read_project_file
+
 class ProjectDetailsDialog(QDialog):
     def __init__(self, parent=None, stats_dialog=None):
         super().__init__(parent)
@@ -40,13 +42,16 @@ class ProjectDetailsDialog(QDialog):
             except ValueError:
                 return date_string  # Return original string if parsing fails
 
-        # Project metadata
+        # Project metadata; the dates of the last full save come from the file's header
+        saved = self.saved_metadata()
         scroll_layout.addWidget(bold_label("Project:"))
         scroll_layout.addWidget(QLabel(os.path.basename(self.parent.current_project_file)))
         scroll_layout.addWidget(bold_label("Creation Date:"))
-        scroll_layout.addWidget(QLabel(format_datetime(getattr(self.parent, 'project_creation_date', 'N/A'))))
+        scroll_layout.addWidget(QLabel(format_datetime(
+            saved.get('creation_date') or getattr(self.parent, 'project_creation_date', 'N/A'))))
         scroll_layout.addWidget(bold_label("Last Modified:"))
-        scroll_layout.addWidget(QLabel(format_datetime(getattr(self.parent, 'last_modified', 'N/A'))))
+        scroll_layout.addWidget(QLabel(format_datetime(
+            saved.get('last_modified') or getattr(self.parent, 'last_modified', 'N/A'))))
 
         # Image information
         image_count = len(self.parent.all_images)
@@ -106,6 +111,17 @@ class ProjectDetailsDialog(QDialog):
         button_box.rejected.connect(self.reject)
         layout.addWidget(button_box)
 
+    def saved_metadata(self):
+        """Metadata of the saved project file, read without its annotations."""
+        project_file = getattr(self.parent, 'current_project_file', None)
+        if not project_file or not os.path.exists(project_file):
+            return {}
+        try:
+            return read_project_file(project_file, include_annotations=False)
+        except Exception as e:
+            print(f"Could not read project metadata: {str(e)}")
+            return {}
+
     def get_notes(self):
         return self.notes_edit.toPlainText()
 
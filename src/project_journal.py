@@ -0,0 +1,167 @@
+"""
+Append-only change journal for .iap projects.
+
+Instead of rewriting the whole project on every auto-save, the annotator
+appends one JSON line per changed image (its complete annotation set) and,
+when classes or image metadata change, one line with the project metadata.
+Records replace state rather than patch it, so replaying the journal onto
+the project file is idempotent. When the journal grows past a threshold the
+project is compacted: the full .iap is written and the journal emptied.
+
+A crash while appending leaves at most one partial line at the end of the
+journal; it is ignored on replay.
+"""
+
+import json
+import os
+import threading
+
+
+JOURNAL_SUFFIX = ".journal"
+# Compact into the .iap once the journal holds this many records or bytes
+COMPACT_RECORDS = 500
+COMPACT_BYTES = 16 * 1024 * 1024
+
+# Keys of the project metadata record
+METADATA_KEYS = ('classes', 'images', 'image_paths', 'image_hashes', 'notes', 'creation_date')
+
+
+def journal_path(project_file):
+    return project_file + JOURNAL_SUFFIX
+
+
+def project_stamp(project_file):
+    """Size and mtime of a project file and its journal; changes whenever either is written."""
+    parts = []
+    for path in (project_file, journal_path(project_file)):
+        try:
+            stat = os.stat(path)
+            parts.append(f"{stat.st_size}:{stat.st_mtime_ns}")
+        except OSError:
+            parts.append("-")
+    return "|".join(parts)
+
+
+class ProjectJournal:
+    def __init__(self, project_file):
+        self.project_file = project_file
+        self.path = journal_path(project_file)
+        # The saver thread writes the journal while the GUI thread checks whether to compact it
+        self._lock = threading.Lock()
+        self.records = 0
+        self.next_seq = 1
+        if os.path.exists(self.path):
+            for record in self.read_records():
+                self.records += 1
+                self.next_seq = max(self.next_seq, record.get('seq', 0) + 1)
+
+    def read_records(self):
+        records = []
+        if not os.path.exists(self.path):
+            return records
+        with open(self.path, 'r') as f:
+            for line_number, line in enumerate(f, 1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:
+                    # Only the last line can be partial (interrupted append); stop there
+                    print(f"Ignoring unreadable journal line {line_number} in {self.path}")
+                    break
+        return records
+
+    def append(self, records):
+        """Append records (dicts) and flush them to disk. Returns the last sequence number written."""
+        with self._lock:
+            first_seq = self.next_seq
+            if not records:
+                return first_seq - 1
+            self.next_seq += len(records)
+        lines = [json.dumps(dict(record, seq=seq), separators=(',', ':'))
+                 for seq, record in enumerate(records, first_seq)]
+        with open(self.path, 'a') as f:
+            f.write("\n".join(lines) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        with self._lock:
+            self.records += len(records)
+        return first_seq + len(records) - 1
+
+    def last_seq(self):
+        with self._lock:
+            return self.next_seq - 1
+
+    def size(self):
+        return os.path.getsize(self.path) if os.path.exists(self.path) else 0
+
+    def record_count(self):
+        with self._lock:
+            return self.records
+
+    def needs_compaction(self):
+        return self.record_count() >= COMPACT_RECORDS or self.size() >= COMPACT_BYTES
+
+    def truncate(self, through_seq=None):
+        """
+        Forget the records the .iap now holds: all of them, or those up to `through_seq`.
+
+        Records appended after the project snapshot was taken are kept.
+        """
+        if through_seq is not None:
+            remaining = [record for record in self.read_records() if record.get('seq', 0) > through_seq]
+            if remaining:
+                temp_path = self.path + ".tmp"
+                with open(temp_path, 'w') as f:
+                    f.write("".join(json.dumps(record, separators=(',', ':')) + "\n" for record in remaining))
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(temp_path, self.path)
+                with self._lock:
+                    self.records = len(remaining)
+                return
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        with self._lock:
+            self.records = 0
+
+    def replay(self, project_data):
+        """
+        Apply the journal to project data loaded from the .iap.
+
+        Returns the annotation overrides: {image or slice name: annotations},
+        applied by the caller after the project's own annotations are loaded.
+        """
+        overrides = {}
+        for record in self.read_records():
+            op = record.get('op')
+            if op == 'annotations':
+                overrides[record['name']] = record.get('annotations', {})
+            elif op == 'project':
+                apply_metadata(project_data, record.get('data', {}))
+        if overrides:
+            print(f"Replayed {len(overrides)} image(s) from {self.path}")
+        return overrides
+
+
+def apply_metadata(project_data, metadata):
+    """Replace classes, image entries and paths, keeping annotations stored in the project file."""
+    stored = {image['file_name']: image for image in project_data.get('images', [])}
+    images = []
+    for image in metadata.get('images', []):
+        # Journaled image entries carry no annotations
+        merged = dict(image)
+        previous = stored.get(image['file_name'], {})
+        if 'annotations' in previous:
+            merged['annotations'] = previous['annotations']
+        if image.get('is_multi_slice'):
+            # Slice annotations come from the project file unless overridden by the journal
+            stored_slices = {s['name']: s.get('annotations', {}) for s in previous.get('slices', [])}
+            names = [s['name'] for s in image.get('slices', [])] or list(stored_slices)
+            merged['slices'] = [{'name': name, 'annotations': stored_slices.get(name, {})} for name in names]
+        images.append(merged)
+    for key in METADATA_KEYS:
+        if key not in metadata:
+            continue
+        project_data[key] = images if key == 'images' else metadata[key]
@@ -0,0 +1,128 @@
+"""
+Background, atomic project saving.
+
+The GUI thread copies the project data (annotations come out of the
+AnnotationStore through copy_of) and hands it to ProjectSaver, a QThread that
+serializes it and writes it to a temporary file next to the project before
+os.replace()-ing it into place (see project_store.write_project_file), so a
+crash mid-write never leaves a truncated project behind. Journal appends
+go through the same queue, so they are written in the order they were
+requested. Backup snapshots (project_backup) are taken on the same thread;
+queued ahead of any save, they record the project as it was before.
+"""
+
+import os
+import threading
+from collections import deque
+
+from PyQt5.QtCore import QThread, pyqtSignal
+
+from src.project_backup import ProjectBackups
+from src.project_store import write_project_file
+
+
+# Auto-save requests arriving within this delay of each other are written once
+AUTO_SAVE_DELAY_MS = 1000
+
+
+class ProjectSaver(QThread):
+    save_started = pyqtSignal(str)
+    save_finished = pyqtSignal(str)
+    save_failed = pyqtSignal(str)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._jobs = deque()
+        self._condition = threading.Condition()
+        self._busy = False
+        self._stopping = False
+        self._errors = []
+
+    def write_project(self, project_file, project_data, journal=None):
+        """Write the full project; journal records up to this point are then dropped."""
+        self._submit(('project', project_file, project_data, journal))
+
+    def append_journal(self, journal, records):
+        self._submit(('journal', journal.path, records, journal))
+
+    def back_up(self, project_file, keep_last, keep_daily):
+        """Snapshot the project as it is on disk, then apply the retention policy."""
+        self._submit(('backup', project_file, (keep_last, keep_daily), None))
+
+    def prune_backups(self, project_file, keep_last, keep_daily):
+        """Apply the retention policy; queued so its cleanup never runs while a snapshot is being written."""
+        self._submit(('prune', project_file, (keep_last, keep_daily), None))
+
+    def _submit(self, job):
+        with self._condition:
+            self._jobs.append(job)
+            self._condition.notify_all()
+        if not self.isRunning():
+            self.start()
+
+    def pending(self):
+        with self._condition:
+            return bool(self._jobs) or self._busy
+
+    def flush(self):
+        """Block until every queued save has been written. Returns the errors since the last flush."""
+        with self._condition:
+            while self._jobs or self._busy:
+                self._condition.wait()
+            errors, self._errors = self._errors, []
+        return errors
+
+    def stop(self):
+        self.flush()
+        with self._condition:
+            self._stopping = True
+            self._condition.notify_all()
+        self.wait()
+
+    def run(self):
+        while True:
+            with self._condition:
+                while not self._jobs and not self._stopping:
+                    self._condition.wait()
+                if not self._jobs:
+                    return
+                kind, path, payload, journal = self._jobs.popleft()
+                self._busy = True
+            if kind in ('backup', 'prune'):
+                self.back_up_now(path, *payload, snapshot=kind == 'backup')
+                with self._condition:
+                    self._busy = False
+                    self._condition.notify_all()
+                continue
+            self.save_started.emit(path)
+            error = None
+            try:
+                if kind == 'project':
+                    last_seq = journal.last_seq() if journal is not None else None
+                    write_project_file(path, payload)
+                    if journal is not None:
+                        journal.truncate(through_seq=last_seq)
+                else:
+                    journal.append(payload)
+            except Exception as e:
+                print(f"Failed to save {path}: {e}")
+                error = f"{os.path.basename(path)}: {e}"
+            with self._condition:
+                if error:
+                    self._errors.append(error)
+                self._busy = False
+                self._condition.notify_all()
+            if error:
+                self.save_failed.emit(error)
+            else:
+                self.save_finished.emit(path)
+
+    def back_up_now(self, project_file, keep_last, keep_daily, snapshot=True):
+        # A failed backup must not hold up saving; it is only reported
+        try:
+            backups = ProjectBackups(project_file)
+            if snapshot:
+                backups.snapshot()
+            backups.prune(keep_last, keep_daily)
+        except Exception as e:
+            print(f"Failed to back up {os.path.basename(project_file)}: {e}")
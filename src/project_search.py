@@ -3,9 +3,11 @@ from PyQt5.QtWidgets import (QDialog, QVBoxLayout, QHBoxLayout, QLineEdit, QPush
                              QFileDialog, QMessageBox)
 from PyQt5.QtCore import Qt, QDate
 import os
-import json
+import sqlite3
 from datetime import datetime
 
+from src.project_catalog import ProjectCatalog
+
 class ProjectSearchDialog(QDialog):
     def __init__(self, parent=None):
         super().__init__(parent)
@@ -14,6 +16,8 @@ class ProjectSearchDialog(QDialog):
         self.setModal(True)
         self.setMinimumSize(600, 400)
         self.search_directory = ""
+        self.catalog = None
+        self.term_cache = {}
         self.setup_ui()
 
     def setup_ui(self):
@@ -78,18 +82,21 @@ class ProjectSearchDialog(QDialog):
 
         self.results_list.clear()
 
-        for root, dirs, files in os.walk(self.search_directory):
-            for filename in files:
-                if filename.endswith('.iap'):
-                    project_path = os.path.join(root, filename)
-                    try:
-                        with open(project_path, 'r') as f:
-                            project_data = json.load(f)
-                        
-                        if self.project_matches(project_data, query, start_date, end_date):
-                            self.results_list.addItem(project_path)
-                    except Exception as e:
-                        print(f"Error reading project file {filename}: {str(e)}")
+        try:
+            with ProjectCatalog(self.search_directory) as catalog:
+                catalog.refresh()
+                # Each term is looked up once in the catalog; the query is then evaluated per project
+                self.term_cache = {}
+                self.catalog = catalog
+                for project_path, creation_date in catalog.projects():
+                    project_data = {'path': project_path, 'creation_date': creation_date}
+                    if self.project_matches(project_data, query, start_date, end_date):
+                        self.results_list.addItem(project_path)
+        except sqlite3.Error as e:
+            QMessageBox.warning(self, "Search Error", f"Could not read the project catalog: {str(e)}")
+            return
+        finally:
+            self.catalog = None
 
         if self.results_list.count() == 0:
             QMessageBox.information(self, "Search Results", "No matching projects found.")
@@ -113,23 +120,10 @@ class ProjectSearchDialog(QDialog):
         return self.evaluate_query(query.lower(), project_data)
 
     def term_matches(self, term, project_data):
-        # Search in project name
-        if term in os.path.basename(project_data.get('current_project_file', '')).lower():
-            return True
-        
-        # Search in classes
-        if any(term in class_info['name'].lower() for class_info in project_data.get('classes', [])):
-            return True
-        
-        # Search in image names
-        if any(term in img['file_name'].lower() for img in project_data.get('images', [])):
-            return True
-        
-        # Search in project notes
-        if term in project_data.get('notes', '').lower():
-            return True
-        
-        return False
+        # Project name, classes, image names and notes, as indexed in the catalog
+        if term not in self.term_cache:
+            self.term_cache[term] = self.catalog.matching_paths(term)
+        return project_data['path'] in self.term_cache[term]
 
 
     def evaluate_query(self, query, project_data):
@@ -0,0 +1,314 @@
+"""
+Reading and writing project files.
+
+Projects are saved either as the original indented JSON document (.iap) or
+as a binary SQLite container (.iapdb). The container keeps the project
+metadata and the image entries as small JSON values, and the annotations of
+each image or slice as a separate chunk: a JSON header with everything but
+the polygon coordinates, plus all coordinates of the chunk packed into one
+float32 blob. Chunks can be read one image at a time (BinaryProject) and the
+metadata without touching any annotations.
+
+JSON projects start with a "header" object holding the same metadata, so
+it can be read from the top of the file without parsing any annotations;
+files written before the header existed are parsed in full.
+
+Both formats hold the same project data, so a project converts either way
+by reading it with read_project_file and writing it under the other suffix.
+"""
+
+import hashlib
+import json
+import os
+import re
+import sqlite3
+from pathlib import Path
+
+import numpy as np
+
+from src.project_journal import ProjectJournal
+
+
+PROJECT_SUFFIX = ".iap"
+PROJECT_DB_SUFFIX = ".iapdb"
+FORMAT_VERSION = 1
+
+# File dialog filters
+SAVE_PROJECT_FILTER = "Image Annotator Project (*.iap);;Image Annotator Binary Project (*.iapdb)"
+OPEN_PROJECT_FILTER = "Image Annotator Project (*.iap *.iapdb)"
+
+# float32 keeps about 7 significant digits; decoded coordinates are rounded to this many decimals
+COORD_DECIMALS = 3
+
+# Metadata section at the top of JSON projects, and the read size used to find it
+HEADER_KEY = "header"
+HEADER_READ_SIZE = 64 * 1024
+
+# Keys of the project data stored in the meta table (and in the JSON header)
+META_KEYS = ('classes', 'image_paths', 'image_hashes', 'notes', 'creation_date', 'last_modified')
+
+SCHEMA = """
+CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+CREATE TABLE images (position INTEGER PRIMARY KEY, file_name TEXT NOT NULL, info TEXT NOT NULL);
+CREATE TABLE annotations (name TEXT PRIMARY KEY, header TEXT NOT NULL, coords BLOB NOT NULL);
+"""
+
+
+def is_binary_project(path):
+    return path.lower().endswith(PROJECT_DB_SUFFIX)
+
+
+def with_project_suffix(path, selected_filter=""):
+    """Add the suffix of the format picked in a save dialog unless the path already has one."""
+    if path.lower().endswith((PROJECT_SUFFIX, PROJECT_DB_SUFFIX)):
+        return path
+    return path + (PROJECT_DB_SUFFIX if PROJECT_DB_SUFFIX in selected_filter else PROJECT_SUFFIX)
+
+
+def to_builtin(obj):
+    """json `default` hook for the NumPy values that end up in annotations."""
+    if isinstance(obj, np.integer):
+        return int(obj)
+    if isinstance(obj, np.floating):
+        return float(obj)
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def dumps(value):
+    return json.dumps(value, separators=(',', ':'), default=to_builtin)
+
+
+def annotations_digest(annotations):
+    """Content hash of one image's annotations, to tell real changes from no-op saves."""
+    return hashlib.blake2b(dumps(annotations).encode(), digest_size=16).digest()
+
+
+def encode_annotations(annotations):
+    """{class: [annotation]} -> (JSON header, float32 coordinate blob)."""
+    header = {}
+    coords = []
+    for class_name, items in annotations.items():
+        entries = []
+        for annotation in items:
+            entry = dict(annotation)
+            segmentation = entry.get('segmentation')
+            if segmentation is not None:
+                values = np.asarray(segmentation)
+                # Only flat numeric polygons are packed; anything else stays in the header
+                if values.ndim == 1 and values.dtype.kind in 'iuf':
+                    del entry['segmentation']
+                    entry['_n'] = len(values)
+                    entry['_int'] = bool(values.dtype.kind in 'iu' or np.all(values == np.round(values)))
+                    coords.append(values.astype('<f4'))
+            entries.append(entry)
+        header[class_name] = entries
+    blob = np.concatenate(coords).tobytes() if coords else b''
+    return dumps(header), blob
+
+
+def decode_annotations(header, blob):
+    coords = np.frombuffer(blob, dtype='<f4')
+    offset = 0
+    annotations = {}
+    for class_name, entries in json.loads(header).items():
+        items = []
+        for entry in entries:
+            count = entry.pop('_n', None)
+            if count is None:
+                items.append(entry)
+                continue
+            values = coords[offset:offset + count]
+            offset += count
+            if entry.pop('_int'):
+                segmentation = values.astype(np.int64).tolist()
+            else:
+                segmentation = np.round(values.astype(np.float64), COORD_DECIMALS).tolist()
+            annotation = {'segmentation': segmentation}
+            annotation.update(entry)
+            items.append(annotation)
+        annotations[class_name] = items
+    return annotations
+
+
+def image_info(image):
+    """An image entry without annotations; stacks keep only their slice names."""
+    info = {key: value for key, value in image.items() if key != 'annotations'}
+    if image.get('is_multi_slice'):
+        info['slices'] = [{'name': s['name']} for s in image.get('slices', [])]
+    return info
+
+
+def project_header(project_data):
+    header = {'format_version': FORMAT_VERSION}
+    header.update((key, project_data[key]) for key in META_KEYS if key in project_data)
+    header['images'] = [image_info(image) for image in project_data.get('images', [])]
+    return header
+
+
+def read_json_header(path):
+    """
+    The header of a JSON project, read from the start of the file only.
+
+    Returns None for files without a header. Memory use depends on the size
+    of the metadata, not on the number of annotations.
+    """
+    decoder = json.JSONDecoder()
+    start = re.compile(r'\s*\{\s*"' + HEADER_KEY + r'"\s*:\s*')
+    buffer = ""
+    read_size = HEADER_READ_SIZE
+    with open(path, 'r') as f:
+        while True:
+            chunk = f.read(read_size)
+            buffer += chunk
+            match = start.match(buffer)
+            if match is None:
+                return None
+            try:
+                header, _ = decoder.raw_decode(buffer, match.end())
+            except json.JSONDecodeError:
+                if not chunk:
+                    raise
+                # Header not complete yet: read more, doubling the read size to keep re-parsing cheap
+                read_size *= 2
+                continue
+            version = header.pop('format_version', FORMAT_VERSION)
+            if version > FORMAT_VERSION:
+                raise ValueError(f"{path} was written by a newer version (format {version})")
+            return header
+
+
+def write_binary_project(path, project_data):
+    if os.path.exists(path):
+        os.remove(path)
+    connection = sqlite3.connect(path)
+    try:
+        connection.executescript(SCHEMA)
+        meta = [('format_version', dumps(FORMAT_VERSION))]
+        meta += [(key, dumps(project_data[key])) for key in META_KEYS if key in project_data]
+        connection.executemany("INSERT INTO meta VALUES (?, ?)", meta)
+
+        images = []
+        chunks = []
+        for position, image in enumerate(project_data.get('images', [])):
+            info = image_info(image)
+            if image.get('is_multi_slice'):
+                for slice_info in image.get('slices', []):
+                    chunks.append((slice_info['name'], slice_info.get('annotations', {})))
+            else:
+                chunks.append((image['file_name'], image.get('annotations', {})))
+            images.append((position, image['file_name'], dumps(info)))
+        connection.executemany("INSERT INTO images VALUES (?, ?, ?)", images)
+        connection.executemany("INSERT OR REPLACE INTO annotations VALUES (?, ?, ?)",
+                               ((name, *encode_annotations(annotations)) for name, annotations in chunks))
+        connection.commit()
+    finally:
+        connection.close()
+
+
+class BinaryProject:
+    """Read access to a .iapdb container; annotations are decoded per image on request."""
+
+    def __init__(self, path):
+        self.path = path
+        # as_uri() escapes '?', '#' and '%' and handles Windows drive paths
+        self.connection = sqlite3.connect(Path(path).absolute().as_uri() + "?mode=ro", uri=True)
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def metadata(self):
+        """Project data without any annotations."""
+        data = {key: json.loads(value) for key, value in self.connection.execute("SELECT key, value FROM meta")}
+        version = data.pop('format_version', FORMAT_VERSION)
+        if version > FORMAT_VERSION:
+            raise ValueError(f"{self.path} was written by a newer version (format {version})")
+        data['images'] = [json.loads(info) for (info,) in
+                          self.connection.execute("SELECT info FROM images ORDER BY position")]
+        return data
+
+    def annotation_names(self):
+        return [name for (name,) in self.connection.execute("SELECT name FROM annotations")]
+
+    def annotations(self, name):
+        row = self.connection.execute("SELECT header, coords FROM annotations WHERE name = ?", (name,)).fetchone()
+        return decode_annotations(*row) if row else {}
+
+    def all_annotations(self):
+        return {name: decode_annotations(header, coords) for name, header, coords in
+                self.connection.execute("SELECT name, header, coords FROM annotations")}
+
+    def project_data(self, include_annotations=True):
+        data = self.metadata()
+        if not include_annotations:
+            return data
+        annotations = self.all_annotations()
+        for image in data['images']:
+            if image.get('is_multi_slice'):
+                for slice_info in image.get('slices', []):
+                    slice_info['annotations'] = annotations.get(slice_info['name'], {})
+            else:
+                image['annotations'] = annotations.get(image['file_name'], {})
+        return data
+
+
+def read_project_file(path, include_annotations=True):
+    """Load a project in either format as the JSON-shaped project data dict."""
+    if is_binary_project(path):
+        with BinaryProject(path) as project:
+            return project.project_data(include_annotations)
+    if not include_annotations:
+        header = read_json_header(path)
+        if header is not None:
+            return header
+    with open(path, 'r') as f:
+        project_data = json.load(f)
+    project_data.pop(HEADER_KEY, None)
+    if not include_annotations:
+        project_data['images'] = [image_info(image) for image in project_data.get('images', [])]
+    return project_data
+
+
+def write_project_file(path, project_data):
+    """Write a project in the format given by its suffix, replacing the old file atomically."""
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        if is_binary_project(path):
+            write_binary_project(temp_path, project_data)
+        else:
+            # The header goes first so metadata can be read without parsing the annotations
+            document = {HEADER_KEY: project_header(project_data)}
+            document.update((key, value) for key, value in project_data.items() if key != HEADER_KEY)
+            with open(temp_path, 'w') as f:
+                json.dump(document, f, indent=2, default=to_builtin)
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(temp_path, path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+def read_project_with_journal(path):
+    """Project data with the changes still in the journal applied, as the annotator would load it."""
+    project_data = read_project_file(path)
+    overrides = ProjectJournal(path).replay(project_data)
+    for image in project_data.get('images', []):
+        if image.get('is_multi_slice'):
+            for slice_info in image.get('slices', []):
+                slice_info['annotations'] = overrides.get(slice_info['name'], slice_info.get('annotations', {}))
+        elif image['file_name'] in overrides:
+            image['annotations'] = overrides[image['file_name']]
+    return project_data
+
+
+def convert_project(source, destination):
+    """Write the project `source` (including its pending journal) to `destination`."""
+    write_project_file(destination, read_project_with_journal(source))
@@ -0,0 +1,96 @@
+"""
+Bounded LRU cache for rendered stack slices.
+
+Entries are keyed by (stack name, slice index, display settings) and the
+cache is limited by the number of bytes held by the cached QImages rather
+than by an entry count, so large and small stacks share the same budget.
+"""
+
+import threading
+from collections import OrderedDict
+
+
+DEFAULT_BUDGET_MB = 512
+
+
+def image_nbytes(image):
+    if hasattr(image, 'sizeInBytes'):
+        return image.sizeInBytes()
+    return image.byteCount()
+
+
+class SliceCache:
+    def __init__(self, budget_bytes=DEFAULT_BUDGET_MB * 1024 * 1024):
+        self.budget_bytes = budget_bytes
+        self.used_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries
+
+    def get(self, key):
+        with self._lock:
+            image = self._entries.get(key)
+            if image is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return image
+
+    def put(self, key, image):
+        size = image_nbytes(image)
+        with self._lock:
+            if key in self._entries:
+                self.used_bytes -= image_nbytes(self._entries.pop(key))
+            if size > self.budget_bytes:
+                return
+            self._entries[key] = image
+            self.used_bytes += size
+            self._trim()
+
+    def get_or_render(self, key, render):
+        image = self.get(key)
+        if image is None:
+            image = render()
+            self.put(key, image)
+        return image
+
+    def set_budget(self, budget_bytes):
+        with self._lock:
+            self.budget_bytes = budget_bytes
+            self._trim()
+
+    def evict_stacks(self, keep=None):
+        """Drop every entry that does not belong to the stack named `keep`."""
+        with self._lock:
+            for key in [key for key in self._entries if key[0] != keep]:
+                self.used_bytes -= image_nbytes(self._entries.pop(key))
+
+    def discard_stack(self, stack_name):
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == stack_name]:
+                self.used_bytes -= image_nbytes(self._entries.pop(key))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.used_bytes = 0
+
+    def stats_text(self):
+        used_mb = self.used_bytes / (1024 * 1024)
+        budget_mb = self.budget_bytes / (1024 * 1024)
+        return (f"Slice cache: {self.hits} hits / {self.misses} misses, "
+                f"{len(self._entries)} slices, {used_mb:.0f}/{budget_mb:.0f} MB")
+
+    def _trim(self):
+        while self.used_bytes > self.budget_bytes and self._entries:
+            _, image = self._entries.popitem(last=False)
+            self.used_bytes -= image_nbytes(image)
@@ -0,0 +1,69 @@
+"""
+Background prefetching of stack slices.
+
+While the annotator works on one slice, the neighbouring slices are decoded,
+normalized and converted to QImages on a worker thread and stored in the
+slice cache, so stepping to the next slice is only a cache lookup.
+"""
+
+import threading
+from collections import deque
+
+from PyQt5.QtCore import QThread
+
+from src.slice_stack import LazySlice
+
+
+DEFAULT_PREFETCH_RADIUS = 3
+
+
+class SlicePrefetcher(QThread):
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._queue = deque()
+        self._condition = threading.Condition()
+        self._generation = 0
+        self._stopping = False
+
+    def prefetch(self, slices, position, radius=DEFAULT_PREFETCH_RADIUS):
+        """Queue the slices within `radius` of `position`, nearest first, replacing older requests."""
+        order = []
+        for distance in range(1, radius + 1):
+            for i in (position + distance, position - distance):
+                if 0 <= i < len(slices) and isinstance(slices[i][1], LazySlice):
+                    order.append(slices[i])
+        with self._condition:
+            self._generation += 1
+            self._queue.clear()
+            self._queue.extend((self._generation, name, slice_image) for name, slice_image in order)
+            self._condition.notify()
+        if order and not self.isRunning():
+            self.start(QThread.LowPriority)
+
+    def cancel(self):
+        """Drop every pending request, e.g. when the user switches to another image."""
+        with self._condition:
+            self._generation += 1
+            self._queue.clear()
+
+    def stop(self):
+        with self._condition:
+            self._stopping = True
+            self._queue.clear()
+            self._condition.notify()
+        self.wait()
+
+    def run(self):
+        while True:
+            with self._condition:
+                while not self._queue and not self._stopping:
+                    self._condition.wait()
+                if self._stopping:
+                    return
+                generation, name, slice_image = self._queue.popleft()
+                if generation != self._generation:
+                    continue
+            try:
+                slice_image.stack.prefetch(slice_image.index)
+            except Exception as e:
+                print(f"Failed to prefetch slice {name}: {e}")
@@ -0,0 +1,137 @@
+"""
+Lazy slice descriptors for multi-dimensional images.
+
+A stack is described by its source array, the assigned dimension labels and
+the index of every slice. Pixels are only produced when a slice is displayed
+or exported, so opening a stack costs nothing beyond reading its shape.
+"""
+
+import numpy as np
+
+
+SPATIAL_DIMENSIONS = ('H', 'W')
+
+
+class SliceStack:
+    """A multi-dimensional image split into 2D slices by its non-spatial axes."""
+
+    def __init__(self, base_name, source, dimensions, converter, cache=None, display_settings=()):
+        self.base_name = base_name
+        self.source = source
+        self.dimensions = list(dimensions)
+        self.converter = converter
+        self.cache = cache
+        self.display_settings = tuple(display_settings)
+        self.slice_axes = [i for i, dim in enumerate(self.dimensions) if dim not in SPATIAL_DIMENSIONS]
+
+    @property
+    def shape(self):
+        return tuple(self.source.shape)
+
+    @property
+    def height(self):
+        return self.shape[self.dimensions.index('H')] if 'H' in self.dimensions else self.shape[0]
+
+    @property
+    def width(self):
+        return self.shape[self.dimensions.index('W')] if 'W' in self.dimensions else self.shape[1]
+
+    def slice_name(self, index):
+        if not self.slice_axes:
+            return self.base_name
+        labels = '_'.join(f"{self.dimensions[axis]}{value + 1}" for axis, value in zip(self.slice_axes, index))
+        return f"{self.base_name}_{labels}"
+
+    def slice_indices(self):
+        if not self.slice_axes:
+            return [()]
+        return list(np.ndindex(tuple(self.shape[axis] for axis in self.slice_axes)))
+
+    def slices(self):
+        """Return (slice_name, LazySlice) pairs without touching any pixel data."""
+        return [(self.slice_name(index), LazySlice(self, index)) for index in self.slice_indices()]
+
+    def slice_array(self, index):
+        full_idx = [slice(None)] * len(self.shape)
+        for axis, value in zip(self.slice_axes, index):
+            full_idx[axis] = value
+        return np.asarray(self.source[tuple(full_idx)])
+
+    def cache_key(self, index):
+        return (self.base_name, tuple(index), self.display_settings)
+
+    def render(self, index):
+        if self.cache is None:
+            return self._render(index)
+        return self.cache.get_or_render(self.cache_key(index), lambda: self._render(index))
+
+    def prefetch(self, index):
+        """Render a slice into the cache unless it is already there. Returns True if rendered."""
+        if self.cache is None:
+            return False
+        key = self.cache_key(index)
+        if key in self.cache:
+            return False
+        self.cache.put(key, self._render(index))
+        return True
+
+    def _render(self, index):
+        # The converter must return a QImage that owns its pixels (see normalization.to_qimage)
+        return self.converter(self.slice_array(index))
+
+    def set_converter(self, converter, display_settings=()):
+        self.converter = converter
+        self.display_settings = tuple(display_settings)
+
+    def close(self):
+        """Release the file the source reads from, for sources that keep one open (see stack_readers)."""
+        close = getattr(self.source, 'close', None)
+        if close is not None:
+            close()
+
+
+class LazySlice:
+    """
+    A single slice of a SliceStack.
+
+    Mimics the parts of the QImage API used by the annotator and the exporters
+    (width, height, save) and only decodes pixels when they are needed.
+    """
+
+    def __init__(self, stack, index):
+        self.stack = stack
+        self.index = tuple(index)
+
+    @property
+    def name(self):
+        return self.stack.slice_name(self.index)
+
+    def width(self):
+        return self.stack.width
+
+    def height(self):
+        return self.stack.height
+
+    def isNull(self):
+        return False
+
+    def to_qimage(self):
+        return self.stack.render(self.index)
+
+    def save(self, file_path, fmt=None):
+        qimage = self.to_qimage()
+        return qimage.save(file_path, fmt) if fmt else qimage.save(file_path)
+
+
+def materialize_slice(slice_image):
+    """Return a QImage for an entry of a slice list, rendering lazy slices on demand."""
+    if isinstance(slice_image, LazySlice):
+        return slice_image.to_qimage()
+    return slice_image
+
+
+def close_slices(slices):
+    """Close the stacks behind a slice list, once each."""
+    stacks = {id(slice_image.stack): slice_image.stack for _, slice_image in slices if isinstance(slice_image, LazySlice)}
+    for stack in stacks.values():
+        stack.close()
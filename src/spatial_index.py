@@ -0,0 +1,102 @@
+"""
+Spatial lookups over the annotations of the displayed image.
+
+AnnotationGridIndex buckets annotation bounding boxes into a uniform grid so
+hit-testing a point or a rectangle only looks at the annotations in the
+touched cells instead of every annotation of every class. The index is
+marked dirty when annotations are committed and rebuilt on the next query.
+
+polygons_connected answers the merge check with a shapely STRtree instead of
+comparing every pair of polygons.
+"""
+
+import math
+from collections import deque
+
+from shapely.strtree import STRtree
+
+
+DEFAULT_CELL_SIZE = 128
+
+
+class AnnotationGridIndex:
+    def __init__(self, cell_size=DEFAULT_CELL_SIZE):
+        self.cell_size = cell_size
+        self.cells = {}
+        self.entries = []
+        self.dirty = True
+        self.signature = None
+
+    @staticmethod
+    def annotations_signature(annotations):
+        # Catches reloads, additions and removals that bypassed mark_dirty
+        return tuple((class_name, id(items), len(items)) for class_name, items in annotations.items())
+
+    def mark_dirty(self):
+        self.dirty = True
+
+    def ensure_current(self, annotations, bounds_for):
+        signature = self.annotations_signature(annotations)
+        if self.dirty or signature != self.signature:
+            self.rebuild(annotations, bounds_for)
+            self.signature = signature
+
+    def rebuild(self, annotations, bounds_for):
+        """Index every annotation; `bounds_for(annotation)` returns its QRectF bounds or None."""
+        self.cells = {}
+        self.entries = []
+        for class_name, items in annotations.items():
+            for annotation in items:
+                bounds = bounds_for(annotation)
+                if bounds is not None and not bounds.isNull():
+                    self.insert(class_name, annotation, bounds)
+        self.dirty = False
+
+    def insert(self, class_name, annotation, bounds):
+        # Entries keep their insertion order so queries return annotations in drawing order
+        entry = (len(self.entries), class_name, annotation, bounds)
+        self.entries.append(entry)
+        for cell in self.cells_for(bounds.left(), bounds.top(), bounds.right(), bounds.bottom()):
+            self.cells.setdefault(cell, []).append(entry)
+
+    def cells_for(self, x0, y0, x1, y1):
+        size = self.cell_size
+        for cx in range(math.floor(x0 / size), math.floor(x1 / size) + 1):
+            for cy in range(math.floor(y0 / size), math.floor(y1 / size) + 1):
+                yield cx, cy
+
+    def query_point(self, x, y):
+        """(class_name, annotation, bounds) of annotations whose bounds contain the point."""
+        size = self.cell_size
+        candidates = self.cells.get((math.floor(x / size), math.floor(y / size)), [])
+        return [entry[1:] for entry in candidates
+                if entry[3].left() <= x <= entry[3].right() and entry[3].top() <= y <= entry[3].bottom()]
+
+    def query_rect(self, x0, y0, x1, y1):
+        """(class_name, annotation, bounds) of annotations whose bounds intersect the rectangle."""
+        found = {}
+        for cell in self.cells_for(x0, y0, x1, y1):
+            for entry in self.cells.get(cell, ()):
+                bounds = entry[3]
+                if (entry[0] not in found and bounds.left() <= x1 and bounds.right() >= x0
+                        and bounds.top() <= y1 and bounds.bottom() >= y0):
+                    found[entry[0]] = entry
+        return [found[key][1:] for key in sorted(found)]
+
+
+def polygons_connected(polygons):
+    """True if the shapely polygons form one group of touching/overlapping shapes."""
+    if len(polygons) < 2:
+        return True
+    tree = STRtree(polygons)
+    seen = {0}
+    queue = deque([0])
+    while queue:
+        i = queue.popleft()
+        # intersects also covers polygons that only touch
+        for j in tree.query(polygons[i], predicate='intersects'):
+            j = int(j)
+            if j not in seen:
+                seen.add(j)
+                queue.append(j)
+    return len(seen) == len(polygons)
@@ -0,0 +1,208 @@
+"""
+Backing stores for multi-dimensional TIFF and CZI images.
+
+The readers return array-like objects exposing shape, dtype, ndim, reshape
+and basic indexing, so that process_multidimensional_image and SliceStack can
+slice them without the whole file ever being loaded into memory:
+
+- contiguous, uncompressed TIFFs are memory-mapped with tifffile.memmap
+- other TIFFs are read one page at a time (TiffPageArray)
+- CZI files are read one subblock at a time (CziSubblockArray)
+"""
+
+import threading
+
+import numpy as np
+import tifffile
+from tifffile import TiffFile
+from czifile import CziFile
+
+
+def open_tiff_stack(image_path):
+    """Return a memory-mapped or page-level view of the first series of a TIFF."""
+    try:
+        return tifffile.memmap(image_path, mode='r')
+    except (ValueError, OSError) as e:
+        print(f"TIFF is not memory-mappable ({e}), reading pages on demand")
+    return TiffPageArray(image_path)
+
+
+def open_czi_stack(image_path):
+    """Return a subblock-level view of a CZI file."""
+    return CziSubblockArray(image_path)
+
+
+def _normalize_key(key, ndim):
+    if not isinstance(key, tuple):
+        key = (key,)
+    if any(k is Ellipsis for k in key):
+        position = key.index(Ellipsis)
+        fill = ndim - (len(key) - 1)
+        key = key[:position] + (slice(None),) * fill + key[position + 1:]
+    if len(key) > ndim:
+        raise IndexError(f"too many indices for array with {ndim} dimensions")
+    return key + (slice(None),) * (ndim - len(key))
+
+
+class TiffPageArray:
+    """Array-like view of a TIFF series that decodes only the pages being indexed."""
+
+    def __init__(self, image_path, lead_shape=None):
+        self.image_path = image_path
+        self._tif = TiffFile(image_path)
+        self._lock = threading.Lock()
+        series = self._tif.series[0]
+        self._pages = list(series.pages)
+        self.page_shape = tuple(self._pages[0].shape)
+        self.dtype = np.dtype(series.dtype)
+
+        series_shape = tuple(series.shape)
+        page_ndim = len(self.page_shape)
+        series_lead = series_shape[:len(series_shape) - page_ndim]
+        if (None in self._pages
+                or series_shape[len(series_lead):] != self.page_shape
+                or int(np.prod(series_lead, dtype=np.int64)) != len(self._pages)):
+            # Irregular series (e.g. truncated ImageJ pages): treat every page as one entry
+            series_lead = (len(self._pages),)
+            self._pages = list(self._tif.pages)
+        self.lead_shape = tuple(lead_shape) if lead_shape is not None else series_lead
+
+    @property
+    def shape(self):
+        return self.lead_shape + self.page_shape
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    @property
+    def size(self):
+        return int(np.prod(self.shape, dtype=np.int64))
+
+    def read_page(self, page_number):
+        with self._lock:
+            return self._pages[page_number].asarray()
+
+    def reshape(self, *shape):
+        if len(shape) == 1 and isinstance(shape[0], (tuple, list)):
+            shape = shape[0]
+        shape = tuple(int(s) for s in shape)
+        if shape == self.shape:
+            return self
+        page_ndim = len(self.page_shape)
+        lead = shape[:len(shape) - page_ndim]
+        if shape[len(lead):] == self.page_shape and int(np.prod(lead, dtype=np.int64)) == len(self._pages):
+            view = TiffPageArray.__new__(TiffPageArray)
+            view.__dict__.update(self.__dict__)
+            view.lead_shape = lead
+            return view
+        # The new shape mixes page and stack axes, so the pages have to be assembled first
+        return np.asarray(self).reshape(shape)
+
+    def __getitem__(self, key):
+        key = _normalize_key(key, self.ndim)
+        lead_key = key[:len(self.lead_shape)]
+        page_key = key[len(self.lead_shape):]
+        page_numbers = np.arange(len(self._pages)).reshape(self.lead_shape)[lead_key]
+        if page_numbers.ndim == 0:
+            return self.read_page(int(page_numbers))[page_key]
+
+        out = None
+        for position, page_number in np.ndenumerate(page_numbers):
+            data = self.read_page(int(page_number))[page_key]
+            if out is None:
+                out = np.empty(page_numbers.shape + data.shape, dtype=data.dtype)
+            out[position] = data
+        if out is None:
+            out = np.empty(page_numbers.shape + np.empty(self.page_shape)[page_key].shape, dtype=self.dtype)
+        return out
+
+    def __array__(self, dtype=None, copy=None):
+        array = self[...]
+        return array.astype(dtype) if dtype is not None else array
+
+    def close(self):
+        # Waits for a page being read on another thread (e.g. the slice prefetcher)
+        with self._lock:
+            self._tif.close()
+
+
+class CziSubblockArray:
+    """Array-like view of a CZI file that decodes only the subblocks overlapping an index."""
+
+    def __init__(self, image_path):
+        self.image_path = image_path
+        self._czi = CziFile(image_path)
+        self._lock = threading.Lock()
+        self.axes = self._czi.axes
+        self.dtype = np.dtype(self._czi.dtype)
+        self._shape = tuple(self._czi.shape)
+        self._start = tuple(self._czi.start)
+        self._entries = [
+            (entry, tuple(i - j for i, j in zip(entry.start, self._start)))
+            for entry in self._czi.filtered_subblock_directory
+        ]
+
+    @property
+    def shape(self):
+        return self._shape
+
+    @property
+    def ndim(self):
+        return len(self._shape)
+
+    @property
+    def size(self):
+        return int(np.prod(self._shape, dtype=np.int64))
+
+    def reshape(self, *shape):
+        if len(shape) == 1 and isinstance(shape[0], (tuple, list)):
+            shape = shape[0]
+        shape = tuple(int(s) for s in shape)
+        if shape == self._shape:
+            return self
+        return np.asarray(self).reshape(shape)
+
+    def __getitem__(self, key):
+        key = _normalize_key(key, self.ndim)
+        if any(not isinstance(k, (int, np.integer, slice)) for k in key) or \
+                any(isinstance(k, slice) and k.step not in (None, 1) for k in key):
+            return np.asarray(self)[key]
+
+        # Bounding region of the request along every axis
+        bounds = []
+        for k, n in zip(key, self._shape):
+            if isinstance(k, slice):
+                lo, hi, _ = k.indices(n)
+                bounds.append((lo, max(lo, hi)))
+            else:
+                k = int(k) + n if k < 0 else int(k)
+                if not 0 <= k < n:
+                    raise IndexError(f"index {k} is out of bounds for axis with size {n}")
+                bounds.append((k, k + 1))
+
+        out = np.zeros(tuple(hi - lo for lo, hi in bounds), dtype=self.dtype)
+        for entry, offset in self._entries:
+            overlap = []
+            for (lo, hi), start, size in zip(bounds, offset, entry.shape):
+                a, b = max(lo, start), min(hi, start + size)
+                if a >= b:
+                    break
+                overlap.append((a, b, start, lo))
+            else:
+                with self._lock:
+                    tile = entry.data_segment().data(resize=True, order=0)
+                src = tuple(slice(a - start, b - start) for a, b, start, _ in overlap)
+                dst = tuple(slice(a - lo, b - lo) for a, b, _, lo in overlap)
+                out[dst] = tile[src]
+
+        squeeze = tuple(0 if not isinstance(k, slice) else slice(None) for k in key)
+        return out[squeeze]
+
+    def __array__(self, dtype=None, copy=None):
+        array = self[...]
+        return array.astype(dtype) if dtype is not None else array
+
+    def close(self):
+        with self._lock:
+            self._czi.close()
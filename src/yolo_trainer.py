@@ -129,6 +129,7 @@ class YOLOTrainer(QObject):
         return False
 
     def prepare_dataset(self):
+        self.main_window.ensure_stacks_loaded()
         output_dir, yaml_path = export_yolo_v5plus(
             self.main_window.all_annotations,
             self.main_window.class_mapping,
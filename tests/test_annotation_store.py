@@ -0,0 +1,130 @@
+import numpy as np
+
+from src.annotation_store import AnnotationStore, PackedImage
+
+
+def polygon(class_name, number, offset=0, **extra):
+    annotation = {
+        "segmentation": [offset, offset, offset + 10, offset, offset + 10, offset + 10],
+        "category_id": 1,
+        "category_name": class_name,
+        "number": number,
+    }
+    annotation.update(extra)
+    return annotation
+
+
+def sample_annotations():
+    return {
+        "cell": [polygon("cell", 1), polygon("cell", 2, offset=5.5, bbox=[5.5, 5.5, 10, 10])],
+        "nucleus": [polygon("nucleus", 1, offset=20)],
+    }
+
+
+def test_pack_unpack_round_trip():
+    annotations = sample_annotations()
+    store = AnnotationStore()
+    store.load("a.png", annotations)
+
+    assert store.is_packed("a.png")
+    unpacked = store.peek("a.png")
+    assert unpacked == annotations
+    # Integer polygons come back as ints, float ones as floats
+    assert all(isinstance(v, int) for v in unpacked["cell"][0]["segmentation"])
+    assert unpacked["cell"][1]["segmentation"][0] == 5.5
+    # Mutable values are not shared with the store
+    unpacked["cell"][1]["bbox"].append(0)
+    assert store.peek("a.png")["cell"][1]["bbox"] == [5.5, 5.5, 10, 10]
+
+
+def test_unpackable_segmentation_is_kept_as_is():
+    annotations = {"cell": [polygon("cell", 1)]}
+    annotations["cell"][0]["segmentation"] = [[0, 0, 1, 1, 2, 0]]
+    store = AnnotationStore()
+    store.load("a.png", annotations)
+    assert store.peek("a.png") == annotations
+
+
+def test_get_does_not_unpack():
+    store = AnnotationStore()
+    store.load("a.png", sample_annotations())
+    assert [a["number"] for a in store.get("a.png")["cell"]] == [1, 2]
+    assert store.is_packed("a.png")
+    assert store.get("missing.png", {}) == {}
+    # Item access unpacks the image and keeps it live
+    store["a.png"]["cell"].pop()
+    assert not store.is_packed("a.png")
+    assert len(store.get("a.png")["cell"]) == 1
+
+
+def test_rename_class_on_packed_image():
+    store = AnnotationStore()
+    store.load("a.png", sample_annotations())
+    with store.batch():
+        store.rename_class("cell", "cell body")
+
+    assert store.is_packed("a.png")
+    annotations = store.peek("a.png")
+    assert set(annotations) == {"cell body", "nucleus"}
+    assert all(a["category_name"] == "cell body" for a in annotations["cell body"])
+
+
+def test_remove_classes_repacks_vertices():
+    store = AnnotationStore()
+    store.load("a.png", sample_annotations())
+    store.load("b.png", {"cell": [polygon("cell", 1)]})
+    changed = []
+    store.commit_listeners.append(changed.append)
+
+    with store.batch():
+        store.remove_classes(lambda name: name == "cell", drop_empty=True)
+
+    assert changed == [{"a.png", "b.png"}]
+    assert "b.png" not in store
+    assert store.peek("a.png") == {"nucleus": [polygon("nucleus", 1, offset=20, id=3)]}
+    # Only the nucleus polygon's vertices are left in the buffer
+    assert store.nbytes() == 6 * np.dtype(np.float64).itemsize
+
+
+def test_extract_and_add_classes_restore_a_class():
+    store = AnnotationStore()
+    store.load("a.png", sample_annotations())
+    before = store.peek("a.png")
+
+    extracted = store.extract_class("cell")
+    store.remove_classes(lambda name: name == "cell")
+    store.add_classes("a.png", extracted["a.png"])
+
+    assert store.is_packed("a.png")
+    restored = store.peek("a.png")
+    assert restored["cell"] == before["cell"]
+    assert restored["nucleus"] == before["nucleus"]
+
+
+def test_add_classes_creates_missing_image():
+    packed = PackedImage.pack({"cell": [polygon("cell", 1, id=7)]})
+    store = AnnotationStore()
+    store.add_classes("a.png", packed)
+    assert store.peek("a.png") == {"cell": [polygon("cell", 1, id=7)]}
+
+
+def test_assign_ids_replaces_collisions():
+    store = AnnotationStore()
+    annotations = {"cell": [polygon("cell", 1, id=4), polygon("cell", 2, id=4), polygon("cell", 3, id="x")]}
+    store.assign_ids(annotations)
+
+    ids = [a["id"] for a in annotations["cell"]]
+    assert ids[0] == 4
+    assert len(set(ids)) == 3
+    assert all(isinstance(i, int) for i in ids)
+    # The counter moves past every ID seen
+    assert store.new_id() > max(ids)
+
+
+def test_renumber_packed_image():
+    store = AnnotationStore()
+    annotations = sample_annotations()
+    annotations["cell"].reverse()
+    store.load("a.png", annotations)
+    store.renumber("a.png")
+    assert [a["number"] for a in store.peek("a.png")["cell"]] == [1, 2]
@@ -0,0 +1,70 @@
+import os
+from types import SimpleNamespace
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+import pytest
+from PyQt5.QtCore import QEvent, QPointF, QRect, Qt
+from PyQt5.QtGui import QColor, QImage, QMouseEvent, QRegion
+from PyQt5.QtWidgets import QApplication
+
+from src.image_label import ImageLabel
+
+
+@pytest.fixture
+def label():
+    app = QApplication.instance() or QApplication([])
+    label = ImageLabel()
+    label.main_window = SimpleNamespace(is_class_visible=lambda class_name: True,
+                                        paint_brush_size=5, eraser_size=5)
+    image = QImage(400, 300, QImage.Format_RGB32)
+    image.fill(Qt.black)
+    label.setPixmap(image)
+    label.resize(400, 300)
+    label.dark_mode = True
+    label.class_colors = {"cell": QColor(Qt.red)}
+    # The label text "cell 1" runs right of the centroid (130, 130), past the polygon's right edge
+    label.annotations = {"cell": [{"segmentation": [100, 100, 160, 100, 160, 160, 100, 160],
+                                   "category_id": 1, "category_name": "cell", "number": 1}]}
+    yield label
+    label.pyramid_builder.stop()
+    app.processEvents()
+
+
+def render(label, region=None):
+    image = QImage(label.size(), QImage.Format_ARGB32)
+    image.fill(Qt.transparent)
+    if region is None:
+        label.render(image)
+    else:
+        label.render(image, region.topLeft(), QRegion(region))
+    return image
+
+
+def pixels(image, rect):
+    return [image.pixel(x, y) for y in range(rect.top(), rect.bottom() + 1)
+            for x in range(rect.left(), rect.right() + 1)]
+
+
+def test_partial_repaint_keeps_label_and_stroke_overflow(label):
+    full = render(label)
+    label_overflow = QRect(163, 115, 20, 20)
+    stroke_overflow = QRect(160, 120, 2, 10)
+    for rect in (label_overflow, stroke_overflow):
+        assert len(set(pixels(full, rect))) > 1
+        assert pixels(render(label, rect), rect) == pixels(full, rect)
+
+
+def test_cursor_over_label_leaves_it_drawn(label):
+    full = render(label)
+    label.current_tool = "eraser"
+    dirty = []
+    label.update = lambda *rect: dirty.extend(rect)
+    for x in (175, 180, 300):
+        label.mouseMoveEvent(QMouseEvent(QEvent.MouseMove, QPointF(x, 125), Qt.NoButton, Qt.NoButton, Qt.NoModifier))
+    assert dirty
+    # Each partial repaint requested by the moving indicator redraws what was under it
+    label.current_tool = None
+    for rect in dirty:
+        rect = rect.intersected(label.rect())
+        assert pixels(render(label, rect), rect) == pixels(full, rect)